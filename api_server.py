@@ -2,33 +2,211 @@
 FastAPI Server for SAP Invoice RAG System
 """
 
-from fastapi import FastAPI, HTTPException
+import os
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from fastapi import APIRouter, FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Any, Awaitable, Callable, Hashable, Tuple
 import uvicorn
 
 from sap_invoice_rag import (
-    query_invoices,
+    aquery_invoices,
+    abatch_query_invoices,
+    fast_path_answer,
+    record_fast_path_turn,
+    astream_query_invoices,
     get_invoice_count,
-    get_invoices_by_date_range
+    get_invoices_by_date_range,
+    get_invoices_page,
+    get_invoice_breakdown,
+    get_invoice_record,
+    clear_session,
+    get_cache_stats,
+    get_router_stats,
+    get_component_stats,
+    warm_up,
+    StaleCursorError,
+    BATCH_FANOUT,
+    DATE_RANGE_PAGE_SIZE
 )
 
-# Initialize FastAPI app
-app = FastAPI(
-    title="SAP Invoice RAG API",
-    description="Query SAP invoices using natural language",
-    version="1.0.0"
-)
+# Concurrency: queries in progress per worker, how long a request may wait for
+# a slot before 503, and threads for synchronous work (SQLite, sync clients)
+MAX_CONCURRENT_QUERIES = int(os.getenv("MAX_CONCURRENT_QUERIES", "16"))
+QUERY_QUEUE_TIMEOUT = float(os.getenv("QUERY_QUEUE_TIMEOUT", "30"))
+THREAD_POOL_SIZE = int(os.getenv("THREAD_POOL_SIZE", "16"))
+MAX_BATCH_QUESTIONS = int(os.getenv("MAX_BATCH_QUESTIONS", "500"))  # Questions accepted by /query/batch
+GZIP_MINIMUM_SIZE = 1000  # Bytes; smaller responses are sent uncompressed
+GZIP_EXCLUDED_PATHS = ('/query/stream',)  # Server-sent events must reach the client as produced
+
+# Arrow column types of the invoice table fields; any other field is a string column
+ARROW_FIELD_TYPES = {
+    'ID': 'string',
+    'invoiceNumber': 'string',
+    'companyCode': 'string',
+    'fiscalYear': 'int64',
+    'documentType': 'string',
+    'amount': 'double',
+    'currency': 'string',
+    'documentDay': 'int64',
+    'postingDay': 'int64',
+    'businessArea': 'string',
+    'reference': 'string',
+    'documentDateConverted': 'string',
+    'postingDateConverted': 'string'
+}
+DATE_RANGE_FORMATS = ('json', 'ndjson', 'arrow')
+# Build the RAG components at startup: background (serve while building), blocking or off
+RAG_WARMUP = os.getenv("RAG_WARMUP", "background")
+# Components the endpoints use, in build order: what warm-up builds and /ready waits for
+SERVING_COMPONENTS = ('embeddings', 'query_embeddings', 'vectorstore', 'record_store',
+                      'llm', 'agent_with_chat_history', 'session_store')
+
+query_slots = asyncio.Semaphore(MAX_CONCURRENT_QUERIES)
+
+
+def warm_up_components():
+    try:
+        warm_up(list(SERVING_COMPONENTS))
+    except Exception as e:
+        # Left unbuilt, so the first request that needs the component retries and reports the error
+        print(f"[startup] warm-up failed: {type(e).__name__}: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Bounded pool behind asyncio.to_thread and LangChain's sync tool offload
+    executor = ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE, thread_name_prefix="rag-worker")
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(executor)
+    if RAG_WARMUP == "blocking":
+        await loop.run_in_executor(None, warm_up_components)
+    elif RAG_WARMUP == "background":
+        loop.run_in_executor(None, warm_up_components)
+    yield
+    executor.shutdown(wait=False)
+
+
+async def acquire_query_slot():
+    """Take one of MAX_CONCURRENT_QUERIES slots; 503 if none frees up within QUERY_QUEUE_TIMEOUT"""
+    try:
+        await asyncio.wait_for(query_slots.acquire(), QUERY_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Too many concurrent queries, try again later")
+
+
+@asynccontextmanager
+async def query_slot():
+    """Hold a query slot for the duration of the block"""
+    await acquire_query_slot()
+    try:
+        yield
+    finally:
+        query_slots.release()
+
+
+class StreamAwareGZipMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware that leaves the server-sent event routes uncompressed
+
+    Older Starlette releases allowed by the fastapi requirement gzip
+    text/event-stream too, buffering events until enough bytes pile up.
+    """
+
+    def __init__(self, app, minimum_size: int = GZIP_MINIMUM_SIZE,
+                 excluded_paths: Tuple[str, ...] = GZIP_EXCLUDED_PATHS):
+        super().__init__(app, minimum_size=minimum_size)
+        self.excluded_paths = excluded_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+class SlotStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that owns a query slot taken by the endpoint
+
+    The slot is released when the response finishes sending, however it
+    ends: completed, failed, or a client that disconnected before the body
+    generator was ever started (whose own finally block would never run).
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            query_slots.release()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical requests
+    
+    The first caller for a key starts the computation; callers arriving
+    while it is in flight await the same task and share its result (or
+    exception). Nothing is kept afterwards, so the next call after it
+    finishes computes again. The shared task is shielded: one client
+    disconnecting does not cancel it for the others. Keys are tuples
+    whose first element names the endpoint, used to group the counts.
+    """
+    
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.executions = defaultdict(int)
+        self.coalesced = defaultdict(int)
+    
+    async def run(self, key: Tuple, compute: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            self.executions[key[0]] += 1
+        else:
+            self.coalesced[key[0]] += 1
+        return await asyncio.shield(task)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Executions and coalesced calls per endpoint, plus computations in flight"""
+        endpoints = {}
+        for name in sorted(set(self.executions) | set(self.coalesced)):
+            calls = self.executions[name] + self.coalesced[name]
+            endpoints[name] = {
+                'calls': calls,
+                'executions': self.executions[name],
+                'coalesced': self.coalesced[name],
+                'coalesce_rate': round(self.coalesced[name] / calls, 3) if calls else 0.0
+            }
+        return {'in_flight': len(self._in_flight), 'endpoints': endpoints}
+
+
+single_flight = SingleFlight()
 
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In production, specify your Streamlit URL
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+
+async def coalesced_call(key: Tuple, fn: Callable, *args, **kwargs) -> Any:
+    """
+    Run a synchronous function in a worker thread, shared by concurrent identical calls
+    
+    Only the caller that starts the computation takes a query slot.
+    """
+    async def compute():
+        async with query_slot():
+            return await asyncio.to_thread(fn, *args, **kwargs)
+    return await single_flight.run(key, compute)
+
+
+router = APIRouter()
 
 
 # Request/Response Models
@@ -40,9 +218,19 @@ class QueryResponse(BaseModel):
     answer: str
     session_id: str
 
+class BatchQueryRequest(BaseModel):
+    questions: List[str]
+    fanout: Optional[int] = None  # Questions processed concurrently (at most BATCH_FANOUT)
+
 class DateRangeRequest(BaseModel):
     start_date: str  # YYYY-MM-DD
     end_date: str    # YYYY-MM-DD
+    company_code: Optional[str] = None
+    fiscal_year: Optional[int] = None
+    fields: Optional[List[str]] = None  # Projection; all fields if omitted
+    cursor: Optional[str] = None  # next_cursor of the previous page
+    limit: Optional[int] = None  # Page size; all invoices in one response if neither limit nor cursor is set
+    format: str = "json"  # json | ndjson | arrow
 
 class InvoiceCountResponse(BaseModel):
     total_count: int
@@ -53,7 +241,7 @@ class HealthResponse(BaseModel):
 
 
 # API Endpoints
-@app.get("/", response_model=HealthResponse)
+@router.get("/", response_model=HealthResponse)
 async def root():
     """Health check endpoint"""
     return {
@@ -61,7 +249,20 @@ async def root():
         "message": "SAP Invoice RAG API is running"
     }
 
-@app.post("/query", response_model=QueryResponse)
+@router.get("/ready")
+async def ready_endpoint():
+    """
+    Readiness probe: 200 once the serving components are built, 503 while warming up
+
+    With RAG_WARMUP=off components are built on first use, so there is
+    nothing to wait for and the probe always succeeds.
+    """
+    components = get_component_stats()
+    if RAG_WARMUP != "off" and not all(components[name]['built'] for name in SERVING_COMPONENTS):
+        raise HTTPException(status_code=503, detail={"status": "warming up", "components": components})
+    return {"status": "ready", "components": components}
+
+@router.post("/query", response_model=QueryResponse)
 async def query_endpoint(request: QueryRequest):
     """
     Query invoices using natural language
@@ -75,24 +276,206 @@ async def query_endpoint(request: QueryRequest):
     ```
     """
     try:
-        answer = query_invoices(request.question, request.session_id)
-        return {
-            "answer": answer,
-            "session_id": request.session_id
-        }
+        # Fast-path answers don't depend on the session, so identical
+        # concurrent questions share one lookup; each caller's history
+        # still records its own turn
+        result = await coalesced_call(('query', request.question), fast_path_answer, request.question)
+        if result is not None:
+            answer = await asyncio.to_thread(record_fast_path_turn, request.question, request.session_id, result)
+        else:
+            async with query_slot():
+                answer = await aquery_invoices(request.question, request.session_id, fast_path=False)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "answer": answer,
+        "session_id": request.session_id
+    }
+
+@router.post("/query/batch")
+async def query_batch_endpoint(request: BatchQueryRequest):
+    """
+    Answer many independent questions in one request
+    
+    Duplicate questions are answered once, the questions that need the
+    agent are embedded in one batched call and their retrievals run
+    concurrently, then handed to the agent with the question. Each
+    question is answered without chat history. fanout is capped at
+    BATCH_FANOUT and MAX_CONCURRENT_QUERIES.
+    
+    Example:
+    ```
+    {
+        "questions": ["How many invoices in 2024?", "Which vendors have the largest amounts?"],
+        "fanout": 8
+    }
+    ```
+    """
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="questions must not be empty")
+    if len(request.questions) > MAX_BATCH_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUESTIONS} questions per batch")
+    if request.fanout is not None and request.fanout < 1:
+        raise HTTPException(status_code=400, detail="fanout must be at least 1")
+    
+    # The batch holds one query slot, so its own concurrency must stay within the server limits
+    fanout = min(request.fanout or BATCH_FANOUT, BATCH_FANOUT, MAX_CONCURRENT_QUERIES)
+    async with query_slot():
+        try:
+            return await abatch_query_invoices(request.questions, fanout=fanout)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/count", response_model=InvoiceCountResponse)
-async def count_endpoint():
-    """Get total count of unique invoices"""
+def format_sse(event: str, data: Dict) -> str:
+    """One server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@router.post("/query/stream")
+async def query_stream_endpoint(request: QueryRequest):
+    """
+    Query invoices and stream progress as server-sent events
+    
+    Events: `tool_start` and `tool_end` around each agent tool call,
+    `token` for each piece of answer text, then `done` with the complete
+    answer (or `error`).
+    """
+    async def events():
+        try:
+            async for event in astream_query_invoices(request.question, request.session_id):
+                yield format_sse(event['event'], event['data'])
+        except Exception as e:
+            yield format_sse('error', {'detail': str(e)})
+    
+    await acquire_query_slot()
+    return SlotStreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/count", response_model=InvoiceCountResponse)
+async def count_endpoint(company_code: Optional[str] = None, fiscal_year: Optional[int] = None,
+                         document_type: Optional[str] = None):
+    """
+    Get total count of unique invoices, optionally filtered
+    
+    Example: `/count?company_code=MF01&fiscal_year=2024`
+    """
+    try:
+        count = await coalesced_call(
+            ('count', company_code, fiscal_year, document_type),
+            get_invoice_count, company_code, fiscal_year, document_type
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"total_count": count}
+
+@router.delete("/sessions/{session_id}")
+async def clear_session_endpoint(session_id: str):
+    """Forget the chat history of a session"""
+    await asyncio.to_thread(clear_session, session_id)
+    return {"session_id": session_id, "cleared": True}
+
+@router.get("/cache/stats")
+async def cache_stats_endpoint():
+    """Hit rates of the query embedding, retrieval and embedding caches"""
+    # Stats count rows in the SQLite stores; keep that off the event loop
+    return await asyncio.to_thread(get_cache_stats)
+
+@router.get("/router/stats")
+async def router_stats_endpoint():
+    """Share of questions answered by the fast path instead of the agent"""
+    return get_router_stats()
+
+@router.get("/coalescing/stats")
+async def coalescing_stats_endpoint():
+    """Requests that shared an in-flight computation instead of running their own"""
+    return single_flight.stats()
+
+@router.get("/invoices/breakdown")
+async def breakdown_endpoint(by: str = "companyCode", start_date: Optional[str] = None,
+                             end_date: Optional[str] = None, company_code: Optional[str] = None,
+                             fiscal_year: Optional[int] = None, document_type: Optional[str] = None):
+    """
+    Get exact invoice counts grouped by companyCode, fiscalYear, documentType,
+    currency or businessArea
+    
+    Example: `/invoices/breakdown?by=documentType&fiscal_year=2024`
+    """
     try:
-        count = get_invoice_count()
-        return {"total_count": count}
+        breakdown = await coalesced_call(
+            ('breakdown', by, start_date, end_date, company_code, fiscal_year, document_type),
+            get_invoice_breakdown,
+            by,
+            start_date,
+            end_date,
+            companyCode=company_code,
+            fiscalYear=fiscal_year,
+            documentType=document_type
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "by": by,
+        "total_count": sum(breakdown.values()),
+        "breakdown": [{"value": value, "count": count} for value, count in breakdown.items()]
+    }
+
+def project(invoice: Dict[str, Any], fields: Optional[List[str]]) -> Dict[str, Any]:
+    """Keep only the requested fields of an invoice (all if fields is None)"""
+    if fields is None:
+        return invoice
+    return {field: invoice[field] for field in fields if field in invoice}
+
+def arrow_value(value: Any, type_name: str) -> Any:
+    if value is None or value == '':
+        return None
+    try:
+        if type_name == 'int64':
+            return int(float(value))
+        if type_name == 'double':
+            return float(value)
+    except (TypeError, ValueError):
+        return None
+    return str(value)
 
-@app.post("/invoices/date-range")
+class ArrowEncoder:
+    """Encodes pages of invoices as one Arrow IPC stream (schema, record batches, end marker)"""
+    
+    def __init__(self, fields: Optional[List[str]]):
+        try:
+            import pyarrow as pa
+        except ImportError as e:
+            raise HTTPException(status_code=400, detail="format=arrow requires 'pip install pyarrow' on the server") from e
+        self.pa = pa
+        self.fields = fields or list(ARROW_FIELD_TYPES)
+        self.types = [ARROW_FIELD_TYPES.get(field, 'string') for field in self.fields]
+        self.schema = pa.schema([(field, pa.type_for_alias(type_name))
+                                 for field, type_name in zip(self.fields, self.types)])
+    
+    def begin(self) -> bytes:
+        return self.schema.serialize().to_pybytes()
+    
+    def encode(self, invoices: List[Dict[str, Any]]) -> bytes:
+        columns = [
+            self.pa.array([arrow_value(invoice.get(field), type_name) for invoice in invoices],
+                          type=self.schema.field(field).type)
+            for field, type_name in zip(self.fields, self.types)
+        ]
+        return self.pa.record_batch(columns, schema=self.schema).serialize().to_pybytes()
+    
+    def end(self) -> bytes:
+        return b'\xff\xff\xff\xff\x00\x00\x00\x00'
+
+@router.post("/invoices/date-range")
 async def date_range_endpoint(request: DateRangeRequest):
     """
     Get invoices within a date range
@@ -101,21 +484,154 @@ async def date_range_endpoint(request: DateRangeRequest):
     ```
     {
         "start_date": "2024-01-01",
-        "end_date": "2024-12-31"
+        "end_date": "2024-12-31",
+        "company_code": "MF01",
+        "fields": ["invoiceNumber", "amount", "currency"],
+        "limit": 500
     }
     ```
+    
+    With `limit` or `cursor` one page is returned, plus `next_cursor` for
+    the following page. `format=ndjson` or `format=arrow` streams every
+    matching invoice from `cursor` on, read `limit` invoices at a time.
     """
+    if request.format not in DATE_RANGE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(DATE_RANGE_FORMATS)}")
+    if request.format != 'json':
+        return await stream_date_range(request)
+    
+    paged = request.limit is not None or request.cursor is not None
     try:
-        invoices = get_invoices_by_date_range(
-            request.start_date,
-            request.end_date
-        )
-        return {
-            "count": len(invoices),
-            "invoices": invoices
-        }
+        if paged:
+            page = await coalesced_call(
+                ('date_range_page', request.start_date, request.end_date, request.company_code,
+                 request.fiscal_year, request.cursor, request.limit),
+                get_invoices_page,
+                request.start_date,
+                request.end_date,
+                company_code=request.company_code,
+                fiscal_year=request.fiscal_year,
+                cursor=request.cursor,
+                limit=DATE_RANGE_PAGE_SIZE if request.limit is None else request.limit
+            )
+            invoices = page['invoices']
+        else:
+            invoices = await coalesced_call(
+                ('date_range', request.start_date, request.end_date, request.company_code, request.fiscal_year),
+                get_invoices_by_date_range,
+                request.start_date,
+                request.end_date,
+                company_code=request.company_code,
+                fiscal_year=request.fiscal_year
+            )
+    except HTTPException:
+        raise
+    except StaleCursorError as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    response = {
+        "count": len(invoices),
+        "invoices": [project(invoice, request.fields) for invoice in invoices]
+    }
+    if paged:
+        response["next_cursor"] = page['next_cursor']
+        if 'total_count' in page:
+            response["total_count"] = page['total_count']
+    return response
+
+async def stream_date_range(request: DateRangeRequest) -> StreamingResponse:
+    """
+    Stream the invoices of a date range as NDJSON or an Arrow IPC stream
+    
+    Pages are read one at a time, so memory use does not grow with the
+    size of the export.
+    """
+    encoder = ArrowEncoder(request.fields) if request.format == 'arrow' else None
+    limit = DATE_RANGE_PAGE_SIZE if request.limit is None else request.limit
+    
+    def read_page(cursor: Optional[str]) -> Dict[str, Any]:
+        return get_invoices_page(request.start_date, request.end_date, company_code=request.company_code,
+                                 fiscal_year=request.fiscal_year, cursor=cursor, limit=limit,
+                                 count_total=False)
+    
+    # Fetch the first page up front, so invalid input is an HTTP error rather than a broken stream
+    await acquire_query_slot()
+    try:
+        page = await asyncio.to_thread(read_page, request.cursor)
+    except StaleCursorError as e:
+        query_slots.release()
+        raise HTTPException(status_code=410, detail=str(e))
+    except ValueError as e:
+        query_slots.release()
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
+        query_slots.release()
         raise HTTPException(status_code=500, detail=str(e))
+    
+    async def chunks():
+        nonlocal page
+        if encoder is not None:
+            yield encoder.begin()
+        while True:
+            invoices = [project(invoice, request.fields) for invoice in page['invoices']]
+            if encoder is not None:
+                yield encoder.encode(invoices)
+            else:
+                yield "".join(json.dumps(invoice, default=str) + "\n" for invoice in invoices)
+            if page['next_cursor'] is None:
+                break
+            page = await asyncio.to_thread(read_page, page['next_cursor'])
+        if encoder is not None:
+            yield encoder.end()
+    
+    media_type = "application/vnd.apache.arrow.stream" if encoder is not None else "application/x-ndjson"
+    return SlotStreamingResponse(chunks(), media_type=media_type)
+
+@router.get("/invoices/{invoice_id}")
+async def invoice_record_endpoint(invoice_id: str):
+    """
+    Get the full record of one invoice by composite ID
+    
+    Example: `/invoices/5100000000_MF01_2024`
+    """
+    record = await asyncio.to_thread(get_invoice_record, invoice_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Invoice {invoice_id} not found")
+    return {"ID": invoice_id, "record": record}
+
+
+def create_app() -> FastAPI:
+    """
+    Application factory
+    
+    Creating the app is cheap: the RAG components are built by the
+    lifespan warm-up or on first use.
+    """
+    app = FastAPI(
+        title="SAP Invoice RAG API",
+        description="Query SAP invoices using natural language",
+        version="1.0.0",
+        lifespan=lifespan
+    )
+    
+    # Add CORS middleware
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # In production, specify your Streamlit URL
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.add_middleware(StreamAwareGZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
+    app.include_router(router)
+    return app
+
+
+app = create_app()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,171 @@
+"""
+Persistent Embedding Cache
+Wraps a LangChain embeddings object with a size-bounded SQLite store shared
+by the indexer and the RAG system
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from array import array
+from typing import List, Dict, Any
+
+from langchain_core.embeddings import Embeddings
+
+# Configuration
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+EVICTION_CHECK_INTERVAL = 1000  # Inserts between size checks
+SQLITE_MAX_VARIABLES = 900  # Stay below SQLite's bound-parameter limit
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that serves repeated texts from a local SQLite cache
+
+    Entries are keyed by model, dimensions and a SHA-256 of the text, so
+    changing either setting never returns stale vectors. When the cache
+    grows past max_entries the least recently used entries are evicted.
+    """
+
+    def __init__(self, underlying: Embeddings, path: str = EMBEDDING_CACHE_PATH,
+                 max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.underlying = underlying
+        self.path = path
+        self.max_entries = max_entries
+        self.namespace = f"{getattr(underlying, 'model', type(underlying).__name__)}:" \
+                         f"{getattr(underlying, 'dimensions', None)}"
+        self.hits = 0
+        self.misses = 0
+        self._inserts_since_check = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used);
+        """)
+        self._conn.commit()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.namespace}:{text}".encode('utf-8')).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        for start in range(0, len(unique_keys), SQLITE_MAX_VARIABLES):
+            batch = unique_keys[start:start + SQLITE_MAX_VARIABLES]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            ).fetchall()
+            for key, blob in rows:
+                vector = array('f')
+                vector.frombytes(blob)
+                found[key] = vector.tolist()
+        if found:
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                ((now, key) for key in found)
+            )
+        return found
+
+    def _store(self, entries: Dict[str, List[float]]):
+        now = time.time()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+            ((key, array('f', vector).tobytes(), now) for key, vector in entries.items())
+        )
+        self._inserts_since_check += len(entries)
+        if self._inserts_since_check >= EVICTION_CHECK_INTERVAL:
+            self._inserts_since_check = 0
+            self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries beyond max_entries"""
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,)
+            )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts, calling the underlying model only for cache misses"""
+        keys = [self._key(text) for text in texts]
+        missing = {}
+        with self._lock:
+            cached = self._lookup(keys)
+            self._conn.commit()
+            for key, text in zip(keys, texts):
+                if key not in cached:
+                    missing.setdefault(key, text)
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            with self._lock:
+                self._store(fresh)
+                self._conn.commit()
+            cached.update(fresh)
+
+        return [cached[key] for key in keys]
+
+    def _cached_query(self, key: str):
+        """Cached vector for a query key (counted as hit or miss), or None"""
+        with self._lock:
+            cached = self._lookup([key])
+            self._conn.commit()
+            if key in cached:
+                self.hits += 1
+                return cached[key]
+            self.misses += 1
+        return None
+
+    def _store_query(self, key: str, vector: List[float]):
+        with self._lock:
+            self._store({key: vector})
+            self._conn.commit()
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query, serving repeated queries from the cache"""
+        key = self._key(text)
+        vector = self._cached_query(key)
+        if vector is None:
+            vector = self.underlying.embed_query(text)
+            self._store_query(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Async embed_query: SQLite access runs in a worker thread, the model call is awaited"""
+        key = self._key(text)
+        vector = await asyncio.to_thread(self._cached_query, key)
+        if vector is None:
+            vector = await self.underlying.aembed_query(text)
+            await asyncio.to_thread(self._store_query, key, vector)
+        return vector
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current cache size"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'max_entries': self.max_entries
+        }
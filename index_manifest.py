@@ -0,0 +1,125 @@
+"""
+Index Manifest for Incremental Re-indexing
+Tracks a content hash and the vector IDs of every indexed invoice in SQLite
+"""
+
+import hashlib
+import json
+import sqlite3
+from datetime import datetime
+from typing import List, Iterable, Iterator, Optional, Tuple, Dict, Any
+
+
+def content_hash(page_content: str, metadata: Dict[str, Any]) -> str:
+    """
+    Hash the page content and metadata of a prepared invoice document
+
+    Args:
+        page_content: Text that gets embedded
+        metadata: Metadata stored alongside the vector
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    digest.update(page_content.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(json.dumps(metadata, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class IndexManifest:
+    """
+    Persistent record of what has been indexed, keyed by the composite
+    invoice ID built in prepare_documents (invoice_{number}_{company}_{year})
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source TEXT,
+                started_at TEXT
+            );
+            CREATE TABLE IF NOT EXISTS invoices (
+                invoice_id TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                vector_ids TEXT NOT NULL,
+                run_id INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_invoices_run ON invoices(run_id);
+        """)
+        self.conn.commit()
+
+    def start_run(self, source: str) -> int:
+        """Register a new indexing run and return its ID"""
+        cursor = self.conn.execute(
+            "INSERT INTO runs (source, started_at) VALUES (?, ?)",
+            (source, datetime.now().isoformat(timespec='seconds'))
+        )
+        self.conn.commit()
+        return cursor.lastrowid
+
+    def get(self, invoice_id: str) -> Optional[Tuple[str, List[str], int]]:
+        """
+        Look up an invoice
+
+        Returns:
+            (content_hash, vector_ids, run_id) or None if never indexed
+        """
+        row = self.conn.execute(
+            "SELECT content_hash, vector_ids, run_id FROM invoices WHERE invoice_id = ?",
+            (invoice_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), row[2]
+
+    def mark_seen(self, invoice_id: str, run_id: int):
+        """Mark an unchanged invoice as present in this run"""
+        self.conn.execute(
+            "UPDATE invoices SET run_id = ? WHERE invoice_id = ?",
+            (run_id, invoice_id)
+        )
+
+    def record(self, invoice_id: str, digest: str, vector_ids: List[str], run_id: int):
+        """Store the hash and vector IDs of a freshly indexed invoice"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO invoices (invoice_id, content_hash, vector_ids, run_id) "
+            "VALUES (?, ?, ?, ?)",
+            (invoice_id, digest, json.dumps(vector_ids), run_id)
+        )
+
+    def iter_stale(self, run_id: int) -> Iterator[Tuple[str, List[str]]]:
+        """Yield (invoice_id, vector_ids) for invoices not seen in the given run"""
+        cursor = self.conn.execute(
+            "SELECT invoice_id, vector_ids FROM invoices WHERE run_id < ?",
+            (run_id,)
+        )
+        for invoice_id, vector_ids in cursor:
+            yield invoice_id, json.loads(vector_ids)
+
+    def remove(self, invoice_ids: Iterable[str]):
+        """Forget invoices whose vectors have been deleted"""
+        self.conn.executemany(
+            "DELETE FROM invoices WHERE invoice_id = ?",
+            ((invoice_id,) for invoice_id in invoice_ids)
+        )
+
+    def clear(self):
+        """Forget everything (used when the namespace is cleared)"""
+        self.conn.execute("DELETE FROM invoices")
+        self.conn.commit()
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM invoices").fetchone()[0]
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
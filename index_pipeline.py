@@ -0,0 +1,228 @@
+"""
+Concurrent Embed-and-Upsert Pipeline
+Bounded queues and worker threads between document preparation, embedding
+and vector upserts, with backoff on rate limits and throughput reporting
+"""
+
+import time
+import queue
+import random
+import threading
+from typing import List, Dict, Any, Iterable, Tuple, Callable, Optional
+
+from langchain_core.documents import Document
+
+# A record travelling through the pipeline: (vector_id, document, embedding)
+Record = Tuple[str, Document, List[float]]
+
+_STOP = object()
+
+# Exception class names and message wording that mean "slow down"
+RATE_LIMIT_ERROR_NAMES = {'RateLimitError', 'TooManyRequests', 'TooManyRequestsError'}
+RATE_LIMIT_PHRASES = ('rate limit', 'rate_limit', 'ratelimit', 'too many requests')
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """
+    Detect HTTP 429 / rate limit errors from the OpenAI and Pinecone clients
+
+    Only status codes, rate-limit exception classes and rate-limit wording
+    count; a bare "429" in a message may just be part of an ID or a count.
+    """
+    for attr in ('status_code', 'status', 'http_status'):
+        if str(getattr(error, attr, None)) == '429':
+            return True
+    response = getattr(error, 'response', None)
+    if str(getattr(response, 'status_code', None)) == '429':
+        return True
+    if any(cls.__name__ in RATE_LIMIT_ERROR_NAMES for cls in type(error).__mro__):
+        return True
+    message = str(error).lower()
+    return any(phrase in message for phrase in RATE_LIMIT_PHRASES)
+
+
+def with_retry(fn: Callable, *args, max_retries: int = 6, base_delay: float = 1.0,
+               max_delay: float = 60.0):
+    """
+    Call fn, retrying rate-limit errors with exponential backoff and jitter
+
+    Other errors are raised immediately.
+    """
+    delay = base_delay
+    for attempt in range(max_retries + 1):
+        try:
+            return fn(*args)
+        except Exception as e:
+            if attempt == max_retries or not is_rate_limit_error(e):
+                raise
+            sleep_for = min(delay, max_delay) * random.uniform(0.5, 1.0)
+            print(f"  Rate limited ({type(e).__name__}), retrying in {sleep_for:.1f}s "
+                  f"(attempt {attempt + 1}/{max_retries})")
+            time.sleep(sleep_for)
+            delay *= 2
+
+
+class EmbedUpsertPipeline:
+    """
+    Embed and upsert documents on a pool of worker threads
+
+    The caller's document iterator is consumed on the calling thread and
+    grouped into embedding batches. Embed workers turn each batch into
+    vectors and split them into (usually smaller) upsert batches for the
+    upsert workers. Both hand-offs go through bounded queues, so a slow
+    stage blocks the producer instead of buffering the whole input.
+
+    on_upserted is always invoked on the calling thread, so it may use
+    objects that are not thread-safe (such as a SQLite connection).
+    """
+
+    def __init__(self,
+                 embed_fn: Callable[[List[str]], List[List[float]]],
+                 upsert_fn: Callable[[List[Record]], Any],
+                 embed_batch_size: int = 256,
+                 upsert_batch_size: int = 100,
+                 concurrency: int = 4,
+                 queue_size: Optional[int] = None,
+                 on_upserted: Optional[Callable[[List[Tuple[str, Document]]], None]] = None,
+                 report_interval: float = 5.0):
+        self.embed_fn = embed_fn
+        self.upsert_fn = upsert_fn
+        self.embed_batch_size = embed_batch_size
+        self.upsert_batch_size = upsert_batch_size
+        self.concurrency = max(1, concurrency)
+        self.queue_size = queue_size or self.concurrency * 2
+        self.on_upserted = on_upserted
+        self.report_interval = report_interval
+
+        self.stats = {'embedded': 0, 'upserted': 0, 'embed_batches': 0, 'upsert_batches': 0}
+        self._stats_lock = threading.Lock()
+        self._error = None
+        self._started = None
+        self._last_report = None
+
+    def _fail(self, error: Exception):
+        with self._stats_lock:
+            if self._error is None:
+                self._error = error
+
+    def _embed_worker(self, embed_q: queue.Queue, upsert_q: queue.Queue):
+        while True:
+            batch = embed_q.get()
+            if batch is _STOP:
+                return
+            if self._error is not None:
+                continue  # Drain so the producer never blocks on a dead pipeline
+            try:
+                vectors = with_retry(self.embed_fn, [doc.page_content for _, doc in batch])
+                records = [(vector_id, doc, vector) for (vector_id, doc), vector in zip(batch, vectors)]
+                with self._stats_lock:
+                    self.stats['embedded'] += len(records)
+                    self.stats['embed_batches'] += 1
+                for start in range(0, len(records), self.upsert_batch_size):
+                    upsert_q.put(records[start:start + self.upsert_batch_size])
+            except Exception as e:
+                self._fail(e)
+
+    def _upsert_worker(self, upsert_q: queue.Queue, done_q: queue.Queue):
+        while True:
+            records = upsert_q.get()
+            if records is _STOP:
+                return
+            if self._error is not None:
+                continue
+            try:
+                with_retry(self.upsert_fn, records)
+                with self._stats_lock:
+                    self.stats['upserted'] += len(records)
+                    self.stats['upsert_batches'] += 1
+                done_q.put([(vector_id, doc) for vector_id, doc, _ in records])
+            except Exception as e:
+                self._fail(e)
+
+    def _drain_done(self, done_q: queue.Queue):
+        while True:
+            try:
+                upserted = done_q.get_nowait()
+            except queue.Empty:
+                break
+            if self.on_upserted:
+                self.on_upserted(upserted)
+        now = time.monotonic()
+        if now - self._last_report >= self.report_interval:
+            self._last_report = now
+            self.report()
+
+    def throughput(self) -> Dict[str, float]:
+        """Documents embedded and vectors upserted per second so far"""
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        with self._stats_lock:
+            return {
+                'docs_per_sec': self.stats['embedded'] / elapsed,
+                'vectors_per_sec': self.stats['upserted'] / elapsed,
+                'elapsed': elapsed
+            }
+
+    def report(self):
+        rates = self.throughput()
+        print(f"  Embedded {self.stats['embedded']} docs ({rates['docs_per_sec']:.1f} docs/s), "
+              f"upserted {self.stats['upserted']} vectors ({rates['vectors_per_sec']:.1f} vectors/s)")
+
+    def run(self, items: Iterable[Tuple[str, Document]]) -> Dict[str, Any]:
+        """
+        Push (vector_id, document) pairs through the pipeline
+
+        Args:
+            items: Iterable of (vector_id, Document), consumed lazily
+
+        Returns:
+            Counters plus final throughput
+
+        Raises:
+            The first error raised by an embed or upsert call
+        """
+        self._started = self._last_report = time.monotonic()
+        embed_q = queue.Queue(maxsize=self.queue_size)
+        upsert_q = queue.Queue(maxsize=self.queue_size * 2)
+        done_q = queue.Queue()
+
+        embed_workers = [
+            threading.Thread(target=self._embed_worker, args=(embed_q, upsert_q), daemon=True)
+            for _ in range(self.concurrency)
+        ]
+        upsert_workers = [
+            threading.Thread(target=self._upsert_worker, args=(upsert_q, done_q), daemon=True)
+            for _ in range(self.concurrency)
+        ]
+        for worker in embed_workers + upsert_workers:
+            worker.start()
+
+        try:
+            batch = []
+            for item in items:
+                if self._error is not None:
+                    break
+                batch.append(item)
+                if len(batch) >= self.embed_batch_size:
+                    embed_q.put(batch)
+                    batch = []
+                    self._drain_done(done_q)
+            if batch and self._error is None:
+                embed_q.put(batch)
+        finally:
+            for _ in embed_workers:
+                embed_q.put(_STOP)
+            for worker in embed_workers:
+                worker.join()
+            for _ in upsert_workers:
+                upsert_q.put(_STOP)
+            for worker in upsert_workers:
+                worker.join()
+
+        self._drain_done(done_q)
+        if self._error is not None:
+            raise self._error
+
+        self.report()
+        result = dict(self.stats)
+        result.update(self.throughput())
+        return result
@@ -0,0 +1,418 @@
+"""
+Invoice Record Store
+Local SQLite side store holding the full invoice record once per invoice,
+so vectors only need to carry a small typed metadata projection, plus an
+indexed invoice table that answers counts, breakdowns and date ranges exactly
+and a full-text (BM25) index for lexical and exact-ID search
+"""
+
+import os
+import re
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+
+# Configuration
+INVOICE_STORE_PATH = os.getenv("INVOICE_STORE_PATH", "invoice_store.db")
+SQLITE_MAX_VARIABLES = 900  # Stay below SQLite's bound-parameter limit
+LEXICAL_QUERY_TERMS = 16  # Query words passed to the full-text index
+FTS_FORMAT = 'values'  # Full-text content holds field values only, without "Label:" prefixes
+FIELD_LABEL_PATTERN = re.compile(r'(?m)^[^:\n]{1,40}:[ \t]*')
+# Field label words of the document template and common question words:
+# they occur in every invoice, so they are dropped from full-text queries
+LEXICAL_STOP_WORDS = {
+    'invoice', 'invoices', 'number', 'numbers', 'no', 'company', 'code', 'codes', 'fiscal', 'year', 'years',
+    'document', 'documents', 'doc', 'type', 'types', 'amount', 'amounts', 'date', 'dates', 'posting',
+    'business', 'area', 'reference', 'currency', 'a', 'an', 'the', 'of', 'for', 'in', 'on', 'at', 'to',
+    'by', 'with', 'and', 'or', 'is', 'are', 'was', 'were', 'be', 'me', 'my', 'our', 'we', 'i', 'you',
+    'show', 'list', 'find', 'get', 'give', 'display', 'which', 'what', 'who', 'how', 'many', 'much',
+    'all', 'any', 'some', 'details', 'detail', 'info', 'information', 'about', 'please', 'there', 'that',
+    'this', 'these', 'those', 'from', 'have', 'has', 'do', 'does'
+}
+
+# Vector metadata field -> column of the structured invoice table
+INVOICE_COLUMNS = {
+    'invoiceNumber': 'invoice_number',
+    'companyCode': 'company_code',
+    'fiscalYear': 'fiscal_year',
+    'documentType': 'document_type',
+    'amount': 'amount',
+    'currency': 'currency',
+    'documentDay': 'document_day',
+    'postingDay': 'posting_day',
+    'businessArea': 'business_area',
+    'reference': 'reference'
+}
+
+# Fields that can be broken down by; filters also accept the invoice number
+GROUP_FIELDS = ('companyCode', 'fiscalYear', 'documentType', 'currency', 'businessArea')
+FILTER_FIELDS = GROUP_FIELDS + ('invoiceNumber',)
+
+
+class InvoiceRecordStore:
+    """
+    Key-value store of full invoice records keyed by the composite invoice
+    ID (invoice_{number}_{company}_{year})
+
+    Alongside the raw records, the typed metadata of every invoice is kept
+    in an indexed `invoices` table, so counts, breakdowns and date ranges
+    are answered exactly without touching the vector store. The invoice
+    number, reference, company code and document text are also kept in an
+    FTS5 table (`invoice_text`, rowid = invoices.rowid) for BM25 search.
+    """
+
+    def __init__(self, path: str = INVOICE_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS records (
+                invoice_id TEXT PRIMARY KEY,
+                record TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS invoices (
+                invoice_id TEXT PRIMARY KEY,
+                invoice_number TEXT,
+                company_code TEXT,
+                fiscal_year INTEGER,
+                document_type TEXT,
+                amount REAL,
+                currency TEXT,
+                document_day INTEGER,
+                posting_day INTEGER,
+                business_area TEXT,
+                reference TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_invoices_company_code ON invoices(company_code);
+            CREATE INDEX IF NOT EXISTS idx_invoices_fiscal_year ON invoices(fiscal_year);
+            CREATE INDEX IF NOT EXISTS idx_invoices_document_type ON invoices(document_type);
+            CREATE INDEX IF NOT EXISTS idx_invoices_document_day ON invoices(document_day);
+            CREATE INDEX IF NOT EXISTS idx_invoices_invoice_number ON invoices(invoice_number);
+            CREATE INDEX IF NOT EXISTS idx_invoices_reference ON invoices(reference);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        try:
+            fts_format = self.conn.execute("SELECT value FROM meta WHERE key = 'fts_format'").fetchone()
+            if fts_format is None or fts_format[0] != FTS_FORMAT:
+                # Built with labelled text: rebuilt from the next indexer run, which
+                # refills missing rows even for unchanged invoices
+                self.conn.execute("DROP TABLE IF EXISTS invoice_text")
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('fts_format', ?)", (FTS_FORMAT,))
+            self.conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS invoice_text USING fts5("
+                "invoice_number, reference, company_code, content)"
+            )
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: exact lookups still work
+            self.has_fts = False
+        self.conn.commit()
+
+    def put(self, invoice_id: str, record: Dict[str, Any], metadata: Optional[Dict[str, Any]] = None,
+            text: Optional[str] = None):
+        """
+        Insert or replace the full record of an invoice
+
+        Args:
+            invoice_id: Composite invoice ID
+            record: Raw invoice record
+            metadata: Typed vector metadata; also written to the invoice table
+            text: Document text for the full-text index
+        """
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO records (invoice_id, record, updated_at) VALUES (?, ?, ?)",
+                (invoice_id, json.dumps(record, default=str), datetime.now().isoformat(timespec='seconds'))
+            )
+            if metadata is not None:
+                self._put_row(invoice_id, metadata, text, replace=True)
+
+    def put_row(self, invoice_id: str, metadata: Dict[str, Any], text: Optional[str] = None,
+                replace: bool = True):
+        """
+        Write the typed metadata of an invoice to the invoice table
+
+        Args:
+            invoice_id: Composite invoice ID
+            metadata: Typed vector metadata (see INVOICE_COLUMNS)
+            text: Document text for the full-text index
+            replace: Overwrite an existing row; False only fills in missing rows
+        """
+        with self._lock:
+            self._put_row(invoice_id, metadata, text, replace)
+
+    def _put_row(self, invoice_id: str, metadata: Dict[str, Any], text: Optional[str], replace: bool):
+        columns = list(INVOICE_COLUMNS.values())
+        placeholders = ", ".join("?" * (len(columns) + 1))
+        # Upsert rather than replace, so the rowid shared with invoice_text stays stable
+        if replace:
+            on_conflict = "DO UPDATE SET " + ", ".join(f"{column} = excluded.{column}" for column in columns)
+        else:
+            on_conflict = "DO NOTHING"
+        self.conn.execute(
+            f"INSERT INTO invoices (invoice_id, {', '.join(columns)}) VALUES ({placeholders}) "
+            f"ON CONFLICT(invoice_id) {on_conflict}",
+            [invoice_id] + [metadata.get(field) for field in INVOICE_COLUMNS]
+        )
+        if text is None or not self.has_fts:
+            return
+        rowid = self.conn.execute("SELECT rowid FROM invoices WHERE invoice_id = ?", (invoice_id,)).fetchone()[0]
+        if replace:
+            self.conn.execute("DELETE FROM invoice_text WHERE rowid = ?", (rowid,))
+        elif self.conn.execute("SELECT 1 FROM invoice_text WHERE rowid = ?", (rowid,)).fetchone():
+            return
+        # Values only: template labels would make their words match every invoice
+        self.conn.execute(
+            "INSERT INTO invoice_text (rowid, invoice_number, reference, company_code, content) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (rowid, metadata.get('invoiceNumber'), metadata.get('reference'), metadata.get('companyCode'),
+             FIELD_LABEL_PATTERN.sub('', text))
+        )
+
+    def get(self, invoice_id: str) -> Optional[Dict[str, Any]]:
+        """Full record of one invoice, or None"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT record FROM records WHERE invoice_id = ?", (invoice_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, invoice_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Full records for several invoices, keyed by ID (missing IDs are omitted)"""
+        invoice_ids = list(dict.fromkeys(invoice_ids))
+        found = {}
+        with self._lock:
+            for start in range(0, len(invoice_ids), SQLITE_MAX_VARIABLES):
+                batch = invoice_ids[start:start + SQLITE_MAX_VARIABLES]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT invoice_id, record FROM records WHERE invoice_id IN ({placeholders})", batch
+                ).fetchall()
+                for invoice_id, record in rows:
+                    found[invoice_id] = json.loads(record)
+        return found
+
+    def delete(self, invoice_ids: Iterable[str]):
+        """Remove records of invoices that are no longer indexed"""
+        invoice_ids = [(invoice_id,) for invoice_id in invoice_ids]
+        with self._lock:
+            self.conn.executemany("DELETE FROM records WHERE invoice_id = ?", invoice_ids)
+            if self.has_fts:
+                self.conn.executemany(
+                    "DELETE FROM invoice_text WHERE rowid IN (SELECT rowid FROM invoices WHERE invoice_id = ?)",
+                    invoice_ids
+                )
+            self.conn.executemany("DELETE FROM invoices WHERE invoice_id = ?", invoice_ids)
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute("DELETE FROM records")
+            self.conn.execute("DELETE FROM invoices")
+            if self.has_fts:
+                self.conn.execute("DELETE FROM invoice_text")
+            self._bump_index_version()
+            self.conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def index_version(self) -> int:
+        """Counter bumped by the indexer whenever the indexed data may have changed"""
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'index_version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def bump_index_version(self):
+        """Mark the index as changed so query caches are invalidated"""
+        with self._lock:
+            self._bump_index_version()
+            self.conn.commit()
+
+    def _bump_index_version(self):
+        self.conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('index_version', '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+
+    def has_invoices(self) -> bool:
+        """True once the indexer has populated the invoice table"""
+        with self._lock:
+            return self.conn.execute("SELECT 1 FROM invoices LIMIT 1").fetchone() is not None
+
+    @staticmethod
+    def _where(filters: Optional[Dict[str, Any]] = None, start_day: Optional[int] = None,
+               end_day: Optional[int] = None) -> Tuple[str, List[Any]]:
+        """Build a WHERE clause from metadata equality filters and a document-day range"""
+        clauses, params = [], []
+        for field, value in (filters or {}).items():
+            if value is None:
+                continue
+            if field not in FILTER_FIELDS:
+                raise ValueError(f"Cannot filter on '{field}'. Choose from: {', '.join(FILTER_FIELDS)}")
+            clauses.append(f"{INVOICE_COLUMNS[field]} = ?")
+            params.append(value)
+        if start_day is not None:
+            clauses.append("document_day >= ?")
+            params.append(start_day)
+        if end_day is not None:
+            clauses.append("document_day <= ?")
+            params.append(end_day)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def count_invoices(self, filters: Optional[Dict[str, Any]] = None,
+                       start_day: Optional[int] = None, end_day: Optional[int] = None) -> int:
+        """
+        Exact number of invoices matching the filters
+
+        Args:
+            filters: Equality filters on FILTER_FIELDS, e.g. {'companyCode': 'MF01'}
+            start_day: First document day (days since 1970-01-01), inclusive
+            end_day: Last document day, inclusive
+        """
+        where, params = self._where(filters, start_day, end_day)
+        with self._lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM invoices{where}", params).fetchone()[0]
+
+    def breakdown(self, by: str, filters: Optional[Dict[str, Any]] = None,
+                  start_day: Optional[int] = None, end_day: Optional[int] = None) -> Dict[Any, int]:
+        """
+        Invoice counts grouped by one field
+
+        Args:
+            by: Field to group by (one of GROUP_FIELDS)
+            filters, start_day, end_day: As for count_invoices
+
+        Returns:
+            Dictionary of field value -> count, ordered by value
+        """
+        if by not in GROUP_FIELDS:
+            raise ValueError(f"Cannot break down by '{by}'. Choose from: {', '.join(GROUP_FIELDS)}")
+        column = INVOICE_COLUMNS[by]
+        where, params = self._where(filters, start_day, end_day)
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT {column}, COUNT(*) FROM invoices{where} GROUP BY {column} ORDER BY {column}", params
+            ).fetchall()
+        return dict(rows)
+
+    def find_invoices(self, filters: Optional[Dict[str, Any]] = None,
+                      start_day: Optional[int] = None, end_day: Optional[int] = None,
+                      limit: Optional[int] = None, offset: int = 0,
+                      after: Optional[Tuple[Optional[int], str]] = None) -> List[Dict[str, Any]]:
+        """
+        Invoices matching the filters, ordered by document date
+
+        Args:
+            filters, start_day, end_day: As for count_invoices
+            limit: Maximum number of invoices (None for all)
+            offset: Number of matching invoices to skip
+            after: (documentDay, ID) of the last invoice of the previous
+                page; only invoices ordered after it are returned (keyset
+                pagination, so deep pages cost the same as the first)
+
+        Returns:
+            List of metadata dictionaries (same keys as the vector metadata)
+        """
+        where, params = self._where(filters, start_day, end_day)
+        if after is not None:
+            day, invoice_id = after
+            # NULL document days sort first
+            if day is None:
+                keyset = "(document_day IS NOT NULL OR invoice_id > ?)"
+                keyset_params = [invoice_id]
+            else:
+                keyset = "(document_day > ? OR (document_day = ? AND invoice_id > ?))"
+                keyset_params = [day, day, invoice_id]
+            where = f"{where} AND {keyset}" if where else f" WHERE {keyset}"
+            params = params + keyset_params
+        columns = ", ".join(INVOICE_COLUMNS.values())
+        sql = f"SELECT invoice_id, {columns} FROM invoices{where} ORDER BY document_day, invoice_id"
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params = params + [-1 if limit is None else limit, offset]
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [self._row_dict(row) for row in rows]
+
+    @staticmethod
+    def _row_dict(row: Tuple) -> Dict[str, Any]:
+        fields = ['ID'] + list(INVOICE_COLUMNS)
+        return {field: value for field, value in zip(fields, row) if value is not None}
+
+    def get_rows(self, invoice_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Invoice table rows (metadata dictionaries) for several invoices, keyed by ID"""
+        invoice_ids = list(dict.fromkeys(invoice_ids))
+        columns = ", ".join(INVOICE_COLUMNS.values())
+        found = {}
+        with self._lock:
+            for start in range(0, len(invoice_ids), SQLITE_MAX_VARIABLES):
+                batch = invoice_ids[start:start + SQLITE_MAX_VARIABLES]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT invoice_id, {columns} FROM invoices WHERE invoice_id IN ({placeholders})", batch
+                ).fetchall()
+                for row in rows:
+                    found[row[0]] = self._row_dict(row)
+        return found
+
+    def exact_lookup(self, tokens: Iterable[str]) -> List[str]:
+        """
+        IDs of invoices whose invoice number or reference equals one of the tokens
+
+        An index lookup per token, so ID-like queries never need an embedding.
+        """
+        tokens = list(dict.fromkeys(token for token in tokens if token))[:SQLITE_MAX_VARIABLES // 2]
+        if not tokens:
+            return []
+        placeholders = ",".join("?" * len(tokens))
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT invoice_id FROM invoices WHERE invoice_number IN ({placeholders}) "
+                f"OR reference IN ({placeholders}) ORDER BY invoice_number, invoice_id",
+                tokens + tokens
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def lexical_search(self, query: str, limit: int = 50, min_score: float = 0.0) -> List[Tuple[str, float]]:
+        """
+        BM25 search over invoice number, reference, company code and document text
+
+        Args:
+            query: Free-text query; each word except LEXICAL_STOP_WORDS is matched as a term (OR)
+            limit: Maximum number of invoices
+            min_score: Drop hits scoring below this (terms common to most invoices score near 0)
+
+        Returns:
+            (invoice ID, score) pairs, best first (higher score is better)
+        """
+        terms = [term for term in re.findall(r'\w+', query) if term.lower() not in LEXICAL_STOP_WORDS]
+        terms = list(dict.fromkeys(terms))[:LEXICAL_QUERY_TERMS]
+        if not terms or not self.has_fts:
+            return []
+        match = " OR ".join(f'"{term}"' for term in terms)
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT invoices.invoice_id, bm25(invoice_text, 10.0, 5.0, 2.0, 1.0) AS rank "
+                "FROM invoice_text JOIN invoices ON invoices.rowid = invoice_text.rowid "
+                "WHERE invoice_text MATCH ? ORDER BY rank LIMIT ?",
+                (match, limit)
+            ).fetchall()
+        # FTS5 bm25() is negative, more negative for better matches
+        return [(invoice_id, -rank) for invoice_id, rank in rows if -rank >= min_score]
+
+    def commit(self):
+        with self._lock:
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.commit()
+            self.conn.close()
@@ -110,6 +110,95 @@ app.get('/odata/v4/Products/:id', (req, res) => {
   }
 });
 
+// Sample SAP invoice data for the OData V2 invoice service
+const COMPANY_CODES = ['1710', 'MF01', 'ZSYK'];
+const DOCUMENT_TYPES = ['RV', 'DR', 'KR', 'RE'];
+const CURRENCIES = { '1710': 'USD', 'MF01': 'EUR', 'ZSYK': 'USD' };
+const INVOICE_COUNT = parseInt(process.env.INVOICE_COUNT || '2500');
+const V2_SERVER_PAGE_SIZE = parseInt(process.env.V2_SERVER_PAGE_SIZE || '1000');
+
+const invoices = Array.from({ length: INVOICE_COUNT }, (_, i) => {
+  const companyCode = COMPANY_CODES[i % COMPANY_CODES.length];
+  const documentDate = Date.UTC(2024, 0, 1) + (i % 540) * 86400000;
+  return {
+    __metadata: {
+      id: `/odata/v2/InvoiceSet('${5100000000 + i}')`,
+      uri: `/odata/v2/InvoiceSet('${5100000000 + i}')`,
+      type: 'ZINVOICE_SRV.Invoice'
+    },
+    DocumentNumber: String(5100000000 + i),
+    CompanyCode: companyCode,
+    FiscalYear: String(new Date(documentDate).getUTCFullYear()),
+    Amount: ((i * 7919) % 100000 / 100 + 10).toFixed(2),
+    Currency: CURRENCIES[companyCode],
+    DocumentDate: `/Date(${documentDate})/`,
+    PostingDate: `/Date(${documentDate + 86400000})/`,
+    DocumentType: DOCUMENT_TYPES[i % DOCUMENT_TYPES.length],
+    Reference: `REF-${100000 + i}`,
+    BusinessArea: `BA${(i % 5) + 1}`,
+    CreatedBy: 'MOCKUSER',
+    ToItems: { __deferred: { uri: `/odata/v2/InvoiceSet('${5100000000 + i}')/ToItems` } }
+  };
+});
+
+// OData V2 service document
+app.get('/odata/v2/', (req, res) => {
+  res.json({ d: { EntitySets: ['InvoiceSet'] } });
+});
+
+// Invoice collection with OData V2 paging: $top/$skip, $skiptoken and
+// server-driven paging via __next, $inlinecount, $select and $filter
+app.get('/odata/v2/InvoiceSet', (req, res) => {
+  let result = invoices;
+
+  // Handle $filter (eq conditions joined by "and")
+  if (req.query.$filter) {
+    req.query.$filter.split(/\s+and\s+/).forEach(condition => {
+      const match = condition.match(/^\s*(\w+)\s+eq\s+'?([^']*)'?\s*$/);
+      if (match) {
+        result = result.filter(inv => String(inv[match[1]]) === match[2]);
+      }
+    });
+  }
+
+  const total = result.length;
+  const skip = parseInt(req.query.$skiptoken || req.query.$skip || '0');
+  const top = req.query.$top !== undefined ? parseInt(req.query.$top) : Infinity;
+  const end = Math.min(total, skip + top);
+  const pageEnd = Math.min(end, skip + V2_SERVER_PAGE_SIZE);
+  let page = result.slice(skip, pageEnd);
+
+  // Handle $select
+  if (req.query.$select) {
+    const fields = req.query.$select.split(',').map(f => f.trim());
+    page = page.map(item => {
+      const newItem = { __metadata: item.__metadata };
+      fields.forEach(field => {
+        if (item[field] !== undefined) newItem[field] = item[field];
+      });
+      return newItem;
+    });
+  }
+
+  const d = { results: page };
+  if (req.query.$inlinecount === 'allpages') {
+    d.__count = String(total);
+  }
+
+  // Server-driven paging: link to the rest of the requested range
+  if (pageEnd < end) {
+    const params = new URLSearchParams();
+    Object.entries(req.query).forEach(([key, value]) => {
+      if (!['$skip', '$skiptoken', '$top', '$inlinecount'].includes(key)) params.set(key, value);
+    });
+    if (top !== Infinity) params.set('$top', String(end - pageEnd));
+    params.set('$skiptoken', String(pageEnd));
+    d.__next = `${req.protocol}://${req.get('host')}/odata/v2/InvoiceSet?${params.toString()}`;
+  }
+
+  res.json({ d });
+});
+
 // Health check
 app.get('/', (req, res) => {
   res.json({ 
@@ -118,7 +207,9 @@ app.get('/', (req, res) => {
     endpoints: [
       '/odata/v4/',
       '/odata/v4/$metadata',
-      '/odata/v4/Products'
+      '/odata/v4/Products',
+      '/odata/v2/',
+      '/odata/v2/InvoiceSet'
     ]
   });
 });
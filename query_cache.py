@@ -0,0 +1,225 @@
+"""
+In-Process Query Cache
+LRU/TTL caches for query embeddings and deduplicated retrieval results,
+invalidated when the indexer bumps the index version
+"""
+
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Awaitable, Callable, Hashable, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+# Configuration
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))  # Entries per cache
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "300"))  # Seconds; 0 disables expiry
+QUERY_CACHE_VERSION_REFRESH = float(os.getenv("QUERY_CACHE_VERSION_REFRESH", "1"))  # Seconds between version checks
+
+
+def normalize_query(text: str) -> str:
+    """Cache key form of a query: lower case with whitespace collapsed"""
+    return " ".join(str(text).lower().split())
+
+
+class QueryCache:
+    """
+    Thread-safe LRU cache with optional TTL and version invalidation
+
+    version_fn is called at most once per version_refresh seconds (in a
+    worker thread from the async path); when it returns a different value
+    than before (the indexer bumped the index version), every entry is
+    dropped, so results outlive the index they were computed from by at
+    most version_refresh seconds. Concurrent async misses for the same key
+    share one computation.
+    """
+
+    def __init__(self, max_entries: int = QUERY_CACHE_SIZE, ttl: Optional[float] = QUERY_CACHE_TTL,
+                 version_fn: Optional[Callable[[], Any]] = None,
+                 version_refresh: float = QUERY_CACHE_VERSION_REFRESH):
+        self.max_entries = max_entries
+        self.ttl = ttl or None
+        self.version_fn = version_fn
+        self.version_refresh = version_refresh
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()
+        self._pending: Dict[Hashable, asyncio.Task] = {}
+        self._version = None
+        self._version_checked: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _version_due(self, now: float) -> bool:
+        return self.version_fn is not None and (
+            self._version_checked is None or now - self._version_checked >= self.version_refresh)
+
+    def _read_version(self, now: float) -> Any:
+        version = self.version_fn()
+        self._version_checked = now
+        return version
+
+    def _lookup(self, key: Hashable) -> Tuple[bool, Any, Any, float]:
+        """(hit, value, index version, lookup time) for key"""
+        now = time.monotonic()
+        version = self._read_version(now) if self._version_due(now) else self._version
+        return self._lookup_at(key, version, now)
+
+    async def _alookup(self, key: Hashable) -> Tuple[bool, Any, Any, float]:
+        """_lookup that reads the version in a worker thread, off the event loop"""
+        now = time.monotonic()
+        if self._version_due(now):
+            version = await asyncio.to_thread(self._read_version, now)
+        else:
+            version = self._version
+        return self._lookup_at(key, version, now)
+
+    def _lookup_at(self, key: Hashable, version: Any, now: float) -> Tuple[bool, Any, Any, float]:
+        with self._lock:
+            if version != self._version:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._version = version
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1], version, now
+            self.misses += 1
+        return False, None, version, now
+
+    def _store(self, key: Hashable, value: Any, version: Any, now: float):
+        with self._lock:
+            if version == self._version:
+                self._entries[key] = (now + self.ttl if self.ttl else None, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Return the cached value for key, computing and storing it on a miss
+
+        Args:
+            key: Hashable cache key (normalized query plus filters)
+            compute: Zero-argument function producing the value
+
+        Returns:
+            Cached or freshly computed value
+        """
+        hit, value, version, now = self._lookup(key)
+        if not hit:
+            value = compute()
+            self._store(key, value, version, now)
+        return value
+
+    async def aget_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Async variant of get_or_compute
+
+        A miss while the same key is already being computed in this event
+        loop awaits that computation instead of starting another.
+
+        Args:
+            key: Hashable cache key
+            compute: Zero-argument coroutine function producing the value
+
+        Returns:
+            Cached or freshly computed value
+        """
+        hit, value, version, now = await self._alookup(key)
+        if hit:
+            return value
+        task = self._pending.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            with self._lock:
+                self.coalesced += 1
+            return await asyncio.shield(task)
+
+        async def compute_and_store():
+            result = await compute()
+            self._store(key, result, version, now)
+            return result
+
+        def forget(done: asyncio.Task):
+            if self._pending.get(key) is done:
+                del self._pending[key]
+
+        task = asyncio.ensure_future(compute_and_store())
+        self._pending[key] = task
+        task.add_done_callback(forget)
+        return await asyncio.shield(task)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters, invalidations and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'invalidations': self.invalidations,
+                'coalesced': self.coalesced,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'version': self._version
+            }
+
+
+class QueryEmbeddingCache(Embeddings):
+    """
+    Embeddings wrapper that memoizes query embeddings in process
+
+    Repeated queries (including the fixed strings used by the count and
+    date-range paths) skip both the model and the on-disk cache lookup.
+    Query embeddings do not depend on the index, so they never expire.
+    """
+
+    def __init__(self, underlying: Embeddings, max_entries: int = QUERY_CACHE_SIZE):
+        self.underlying = underlying
+        self.cache = QueryCache(max_entries=max_entries, ttl=None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.cache.get_or_compute(normalize_query(text), lambda: self.underlying.embed_query(text))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.cache.aget_or_compute(normalize_query(text), lambda: self.underlying.aembed_query(text))
+
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed many queries, sending every cache miss to the model in one batched call
+
+        Args:
+            texts: Query strings (duplicates are embedded once)
+
+        Returns:
+            One vector per text, in order
+        """
+        vectors = {}
+        missing = {}
+        for text in texts:
+            key = normalize_query(text)
+            if key in vectors or key in missing:
+                continue
+            hit, value, version, now = await self.cache._alookup(key)
+            if hit:
+                vectors[key] = value
+            else:
+                missing[key] = (text, version, now)
+        if missing:
+            fresh = await self.underlying.aembed_documents([text for text, _, _ in missing.values()])
+            for (key, (_, version, now)), vector in zip(missing.items(), fresh):
+                self.cache._store(key, vector, version, now)
+                vectors[key] = vector
+        return [vectors[normalize_query(text)] for text in texts]
@@ -0,0 +1,194 @@
+"""
+Fast-Path Query Router
+Recognizes count, breakdown, filter and invoice-number questions that can
+be answered from the structured invoice table without the LLM agent
+"""
+
+import re
+import threading
+from typing import Dict, Any, Iterable, Optional
+
+# Question patterns
+INVOICE_NUMBER_PATTERN = re.compile(r'\b(?:invoice|document|doc)s?\s*(?:number|no\.?|nr\.?|#)?\s*#?\s*(\d{6,12})\b', re.I)
+NUMBER_PATTERN = re.compile(r'\b\d{6,12}\b')
+WORD_PATTERN = re.compile(r"[\w'-]+")
+COUNT_PATTERN = re.compile(r'\b(?:how many|number of|count|total (?:number of )?invoices)\b', re.I)
+LIST_PATTERN = re.compile(r'\b(?:show|list|display|give me|get|find)\b', re.I)
+BREAKDOWN_PATTERN = re.compile(
+    r'\b(?:breakdown|break down|split|grouped|group|per|by|each)\s+(?:the\s+|each\s+)?'
+    r'(company codes?|companies|company|fiscal years?|years?|document types?|doc types?|types?|'
+    r'currenc(?:y|ies)|business areas?)\b', re.I)
+FISCAL_YEAR_PATTERN = re.compile(r'\b(?:FY\s?|fiscal year\s*|in\s+|for\s+|of\s+)((?:19|20)\d{2})\b', re.I)
+COMPANY_CODE_PATTERN = re.compile(r'\bcompany(?:\s+code)?\s+((?-i:[A-Z0-9]{4}))\b', re.I)
+DOCUMENT_TYPE_PATTERN = re.compile(r'\b(?:document|doc)\s+type\s+((?-i:[A-Z0-9]{2}))\b', re.I)
+
+# Anything the structured table cannot answer goes to the agent: amounts and
+# aggregates over them, date ranges, comparisons and references to earlier turns
+OPEN_ENDED_PATTERN = re.compile(
+    r'\b(?:amount|value|sum|average|avg|mean|highest|lowest|largest|smallest|biggest|top|most|least|'
+    r'compare|comparison|why|how much|trend|between|before|after|since|until|from|during|month|quarter|week|'
+    r'day|date|dated|posted|january|february|march|april|may|june|july|august|september|october|'
+    r'november|december|last|this|next|recent|latest|oldest|vendor|supplier|customer|reference|'
+    r'overdue|paid|unpaid|open|those|these|them|they|it|that|similar|summar\w*|explain|'
+    r'not|no|except|excluding|exclude[sd]?|without|other than|\w+n\'t)\b', re.I)
+# Mentions of a filter whose value could not be parsed (e.g. "company code xy01")
+FILTER_MENTION_PATTERN = re.compile(r'\b(?:company|type|currenc\w*|business area)\b', re.I)
+CODE_TOKEN_PATTERN = re.compile(r'\b(?:[A-Z][A-Z0-9]{1,5}|\d{4})\b')
+
+# Words an invoice-number lookup may contain besides the numbers themselves
+ID_QUERY_FILLER = {
+    'a', 'an', 'the', 'me', 'show', 'find', 'get', 'give', 'display', 'lookup', 'look', 'up', 'for', 'of',
+    'with', 'what', 'is', 'details', 'detail', 'invoice', 'invoices', 'number', 'numbers', 'no', 'nr',
+    'document', 'doc', 'reference', 'ref', 'and', 'or'
+}
+# Words a count, list or breakdown question may contain besides its filter values;
+# any other word (e.g. "created by MOCKUSER") sends the question to the agent
+ROUTER_VOCABULARY = {
+    'how', 'many', 'number', 'of', 'count', 'total', 'invoice', 'invoices', 'are', 'is', 'were', 'was',
+    'there', 'do', 'does', 'we', 'i', 'you', 'have', 'has', 'in', 'for', 'with', 'the', 'a', 'an', 'all',
+    'any', 'show', 'list', 'display', 'give', 'me', 'get', 'find', 'please', 'can', 'could', 'tell',
+    'what', "what's", 'whats', 'breakdown', 'break', 'down', 'split', 'grouped', 'group', 'per', 'by',
+    'each', 'company', 'companies', 'code', 'codes', 'fiscal', 'year', 'years', 'fy', 'document',
+    'documents', 'doc', 'type', 'types', 'currency', 'currencies', 'business', 'area', 'areas', 'to',
+    'on', 'under', 'exist', 'our', 'overall', 'altogether', 'database', 'stored', 'recorded'
+}
+
+# Breakdown phrase -> invoice table field
+BREAKDOWN_FIELDS = {
+    'compan': 'companyCode',
+    'fiscal': 'fiscalYear',
+    'year': 'fiscalYear',
+    'doc': 'documentType',
+    'type': 'documentType',
+    'currenc': 'currency',
+    'business': 'businessArea'
+}
+
+
+def _breakdown_field(phrase: str) -> str:
+    phrase = phrase.lower()
+    for prefix, field in BREAKDOWN_FIELDS.items():
+        if phrase.startswith(prefix):
+            return field
+    return 'companyCode'
+
+
+def extract_filters(question: str, company_codes: Iterable[str] = ()) -> Dict[str, Any]:
+    """
+    Pull fiscal year, company code and document type predicates out of a question
+
+    Args:
+        question: User question
+        company_codes: Known company codes, matched as bare words (e.g. 'MF01')
+
+    Returns:
+        Dictionary with any of fiscalYear (int), companyCode and documentType
+    """
+    filters = {}
+    match = FISCAL_YEAR_PATTERN.search(question)
+    if match:
+        filters['fiscalYear'] = int(match.group(1))
+    match = COMPANY_CODE_PATTERN.search(question)
+    if match:
+        filters['companyCode'] = match.group(1)
+    else:
+        for code in company_codes:
+            if code and re.search(rf'\b{re.escape(str(code))}\b', question, re.I):
+                filters['companyCode'] = str(code)
+                break
+    match = DOCUMENT_TYPE_PATTERN.search(question)
+    if match:
+        filters['documentType'] = match.group(1)
+    return filters
+
+
+def classify_query(question: str, company_codes: Iterable[str] = ()) -> Optional[Dict[str, Any]]:
+    """
+    Decide whether a question can skip the agent
+
+    Args:
+        question: User question
+        company_codes: Known company codes
+
+    Returns:
+        None for open-ended questions, otherwise a route dictionary with
+        'intent' ('lookup', 'breakdown', 'count' or 'list') and its parameters
+    """
+    if INVOICE_NUMBER_PATTERN.search(question):
+        # Only plain lookups ("show invoice 5100000000 and 5100000001"); anything
+        # asked about the invoice ("who approved ...", "is ... paid") needs the agent
+        numbers = list(dict.fromkeys(NUMBER_PATTERN.findall(question)))
+        words = {word.lower() for word in WORD_PATTERN.findall(question)} - set(numbers)
+        if words <= ID_QUERY_FILLER:
+            return {'intent': 'lookup', 'invoice_numbers': numbers}
+        return None
+
+    if OPEN_ENDED_PATTERN.search(question) or 'invoice' not in question.lower():
+        return None
+
+    filters = extract_filters(question, company_codes)
+    match = BREAKDOWN_PATTERN.search(question)
+    rest = question[:match.start()] + question[match.end():] if match else question
+    if not _fully_parsed(rest, filters):
+        return None
+    if match:
+        by = _breakdown_field(match.group(1))
+        filters.pop(by, None)
+        return {'intent': 'breakdown', 'by': by, 'filters': filters}
+    if COUNT_PATTERN.search(question):
+        return {'intent': 'count', 'filters': filters}
+    if filters and LIST_PATTERN.search(question):
+        return {'intent': 'list', 'filters': filters}
+    return None
+
+
+def _fully_parsed(text: str, filters: Dict[str, Any]) -> bool:
+    """True if every filter mention and code-like token in text became a filter and no other word is left"""
+    mentions = {m.lower()[:4] for m in FILTER_MENTION_PATTERN.findall(text)}
+    if 'comp' in mentions and 'companyCode' not in filters:
+        return False
+    if 'type' in mentions and 'documentType' not in filters:
+        return False
+    if mentions - {'comp', 'type'}:
+        return False
+    known = {str(value) for value in filters.values()}
+    for token in CODE_TOKEN_PATTERN.findall(text):
+        if token.startswith('FY'):
+            token = token[2:] or 'FY'
+        if token not in known and token != 'FY':
+            return False
+    known = {value.upper() for value in known}
+    for word in WORD_PATTERN.findall(text):
+        value = word.upper()[2:] if word.upper().startswith('FY') and word[2:].isdigit() else word.upper()
+        if word.lower() not in ROUTER_VOCABULARY and value not in known:
+            return False
+    return True
+
+
+class RouterStats:
+    """Counters of routing decisions and their latency"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes = {}
+        self.total_ms = {}
+
+    def record(self, route: str, elapsed_ms: float):
+        with self._lock:
+            self.routes[route] = self.routes.get(route, 0) + 1
+            self.total_ms[route] = self.total_ms.get(route, 0.0) + elapsed_ms
+
+    def stats(self) -> Dict[str, Any]:
+        """Fast-path hit rate plus count and mean latency per route"""
+        with self._lock:
+            total = sum(self.routes.values())
+            fast = total - self.routes.get('agent', 0)
+            return {
+                'queries': total,
+                'fast_path': fast,
+                'fast_path_rate': fast / total if total else 0.0,
+                'routes': {
+                    route: {'count': count, 'avg_ms': self.total_ms[route] / count}
+                    for route, count in sorted(self.routes.items())
+                }
+            }
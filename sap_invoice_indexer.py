@@ -1,59 +1,205 @@
 """
 SAP Invoice Indexing Script
-Indexes invoice data from JSON files to Pinecone vector database
+Indexes invoice data from JSON files to the configured vector store
+(Pinecone, Qdrant or the local NumPy index)
 """
 
 import os
+import re
 import json
-from typing import List, Dict, Any
+import uuid
+from datetime import date, timedelta
+from typing import List, Dict, Any, Iterable, Iterator, Tuple, Optional
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
 from pathlib import Path
 
+import numpy as np
 from langchain_openai import OpenAIEmbeddings
-from langchain_pinecone import PineconeVectorStore
 from langchain_core.documents import Document
-from pinecone import Pinecone, ServerlessSpec
+
+from embedding_cache import CachedEmbeddings
+from index_manifest import IndexManifest, content_hash
+from invoice_store import InvoiceRecordStore, INVOICE_STORE_PATH
+from index_pipeline import EmbedUpsertPipeline
+from odata_connector import ODataV2Source, ODATA_PAGE_SIZE, ODATA_CONCURRENCY
+from vector_backends import VectorBackend, get_backend, BACKENDS, VECTOR_BACKEND
 
 # Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "your-openai-api-key")
-PINECONE_API_KEY = os.getenv("PINECONE_API_KEY", "your-pinecone-api-key")
-PINECONE_INDEX = "n8n-s4hana-new"
-PINECONE_NAMESPACE = "invoice-documents"
-PINECONE_ENVIRONMENT = "us-east-1"  # Update with your Pinecone environment
-
-# Initialize Pinecone
-pc = Pinecone(api_key=PINECONE_API_KEY)
-
-# Initialize embeddings
-embeddings = OpenAIEmbeddings(
-    model="text-embedding-3-small",
-    dimensions=512,
-    api_key=OPENAI_API_KEY
+EMBED_BATCH_SIZE = 256  # Chunks per embeddings request
+UPSERT_BATCH_SIZE = 100  # Vectors per upsert request
+INDEX_CONCURRENCY = 4  # Embed workers and upsert workers
+UPSERT_MODE = "overwrite"  # "overwrite" (deterministic IDs) or "append" (random IDs)
+PREP_WORKERS = 1  # Processes for document preparation and chunking
+PREP_SHARD_SIZE = 500  # Invoices per process pool task
+DELETE_BATCH_SIZE = 1000  # Stale invoices removed per manifest commit
+INDEX_MANIFEST_PATH = os.getenv("INDEX_MANIFEST_PATH")  # Default depends on the backend
+SAP_DATE_PATTERN = re.compile(r'/Date\((-?\d+)')
+SAP_DATE_VALUE = re.compile(r'/Date\((-?\d+)(?:[+-]\d+)?\)/')  # /Date(ms)/ or /Date(ms+0200)/
+MS_PER_DAY = 86400000
+EPOCH_DATE = date(1970, 1, 1)
+
+# Output of prepare_invoice: (invoice record, document, content hash, chunks)
+PreparedInvoice = Tuple[Dict[str, Any], Document, str, List[Document]]
+
+# Initialize embeddings (served from the shared on-disk cache when possible)
+embeddings = CachedEmbeddings(
+    OpenAIEmbeddings(
+        model="text-embedding-3-small",
+        dimensions=512,
+        api_key=OPENAI_API_KEY
+    )
 )
 
 
-def create_index_if_not_exists():
-    """Create Pinecone index if it doesn't exist"""
+def create_index_if_not_exists(backend: Optional[VectorBackend] = None):
+    """Create the vector index/collection if it doesn't exist"""
+    backend = backend or get_backend()
     try:
-        existing_indexes = [idx.name for idx in pc.list_indexes()]
-        
-        if PINECONE_INDEX not in existing_indexes:
-            print(f"Creating index: {PINECONE_INDEX}")
-            pc.create_index(
-                name=PINECONE_INDEX,
-                dimension=512,
-                metric="cosine",
-                spec=ServerlessSpec(
-                    cloud="aws",
-                    region=PINECONE_ENVIRONMENT
-                )
-            )
-            print("Index created successfully")
-        else:
-            print(f"Index '{PINECONE_INDEX}' already exists")
+        backend.ensure_index()
     except Exception as e:
         print(f"Error creating index: {e}")
 
 
+class _JsonArrayStream:
+    """
+    Incremental reader for the JSON layouts accepted by the indexer
+
+    Reads the file in fixed-size blocks and decodes one array element at a
+    time with ``json.JSONDecoder.raw_decode``, so only the current element
+    (plus one block of look-ahead) is held in memory.
+    """
+
+    WRAPPER_KEYS = ('invoices', 'data', 'results', 'items')
+    NUMBER_TERMINATORS = frozenset(' \t\r\n,]}')
+
+    def __init__(self, f, block_size: int = 1 << 20):
+        self.f = f
+        self.block_size = block_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, min_size: int = 0) -> bool:
+        """Read another block; returns False at end of file"""
+        if self.eof:
+            return False
+        # Drop the consumed prefix so the buffer never grows with the file
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        block = self.f.read(max(self.block_size, min_size))
+        if not block:
+            self.eof = True
+            return False
+        self.buf += block
+        return True
+
+    def _peek(self) -> str:
+        """Skip whitespace and return the next character ('' at end of file)"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char: str):
+        found = self._peek()
+        if found != char:
+            raise ValueError(f"Invalid JSON: expected '{char}' but found '{found or 'end of file'}'")
+        self.pos += 1
+
+    def _decode(self) -> Any:
+        """Decode the next complete JSON value, reading more data as needed"""
+        self._peek()
+        read_size = self.block_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number cut off by the block boundary still decodes as a shorter
+                # prefix ('12.' as 12), so it is only complete once a delimiter follows
+                is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+                complete = end < len(self.buf) and (not is_number or self.buf[end] in self.NUMBER_TERMINATORS)
+                if complete or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Grow reads geometrically so huge values are not re-parsed per block
+            self._fill(read_size)
+            read_size *= 2
+
+    def _iter_array(self) -> Iterator[Any]:
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self._decode()
+            if self._peek() == ',':
+                self.pos += 1
+                continue
+            self._expect(']')
+            return
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        first = self._peek()
+        if first == '[':
+            yield from self._iter_array()
+            return
+        if first != '{':
+            return
+
+        # Walk the top-level object until a wrapper key holding the list is found.
+        # Other members are kept in case the object is a single invoice.
+        self.pos += 1
+        single = {}
+        if self._peek() == '}':
+            self.pos += 1
+            yield single
+            return
+        while True:
+            key = self._decode()
+            self._expect(':')
+            if key in self.WRAPPER_KEYS and self._peek() == '[':
+                yield from self._iter_array()
+                return
+            value = self._decode()
+            if key in self.WRAPPER_KEYS:
+                yield from value if isinstance(value, list) else [value]
+                return
+            single[key] = value
+            if self._peek() == ',':
+                self.pos += 1
+                continue
+            self._expect('}')
+            break
+        yield single
+
+
+def iter_invoice_data(json_file_path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Stream invoice records from a JSON file without loading it into memory
+
+    Accepts a top-level array, an object wrapping the array under one of
+    'invoices', 'data', 'results' or 'items', or a single invoice object.
+
+    Args:
+        json_file_path: Path to JSON file containing invoice data
+
+    Yields:
+        Invoice dictionaries in file order
+    """
+    with open(json_file_path, 'r', encoding='utf-8') as f:
+        yield from _JsonArrayStream(f)
+
+
 def load_invoice_data(json_file_path: str) -> List[Dict[str, Any]]:
     """
     Load invoice data from JSON file
@@ -64,50 +210,126 @@ def load_invoice_data(json_file_path: str) -> List[Dict[str, Any]]:
     Returns:
         List of invoice dictionaries
     """
-    with open(json_file_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    # Handle different JSON structures
-    if isinstance(data, list):
-        return data
-    elif isinstance(data, dict):
-        # Check for common keys that might contain the invoice list
-        for key in ['invoices', 'data', 'results', 'items']:
-            if key in data:
-                return data[key]
-        # If single invoice object
-        return [data]
+    return list(iter_invoice_data(json_file_path))
+
+
+def to_int(value: Any) -> Optional[int]:
+    """Parse an integer field such as the fiscal year, or None"""
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def to_float(value: Any) -> float:
+    """Parse an amount, treating blanks and garbage as 0"""
+    try:
+        return float(value) if value else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def to_epoch_day(value: Any) -> Optional[int]:
+    """
+    Convert an SAP /Date(ms)/ or YYYY-MM-DD value to days since 1970-01-01 (UTC)
     
-    return []
+    Returns:
+        Epoch day, or None if the value is empty or unparseable
+    """
+    if not value or not isinstance(value, str):
+        return None
+    match = SAP_DATE_PATTERN.search(value)
+    if match:
+        return int(match.group(1)) // MS_PER_DAY
+    try:
+        return (date.fromisoformat(value[:10]) - EPOCH_DATE).days
+    except ValueError:
+        return None
 
 
-def prepare_documents(invoices: List[Dict[str, Any]]) -> List[Document]:
+def normalize_sap_dates(invoices: List[Dict[str, Any]]) -> List[Dict[str, Tuple[int, str]]]:
     """
-    Convert invoice data to LangChain Documents with metadata
+    Convert every SAP /Date(ms)/ and /Date(ms+offset)/ field of a batch of invoices to UTC
+    
+    One regex pass collects the millisecond values of all fields in the
+    batch, then a single NumPy conversion turns them into epoch days and
+    ISO 8601 timestamps. The milliseconds are already UTC; the optional
+    offset only records the sender's local time zone and is ignored.
     
     Args:
-        invoices: List of invoice dictionaries
+        invoices: Batch of invoice dictionaries
         
     Returns:
-        List of LangChain Document objects
+        One dictionary per invoice: field name -> (epoch day, 'YYYY-MM-DDTHH:MM:SSZ')
+    """
+    positions, millis = [], []
+    for position, invoice in enumerate(invoices):
+        for key, value in invoice.items():
+            if isinstance(value, str) and value.startswith('/Date('):
+                match = SAP_DATE_VALUE.fullmatch(value)
+                if match:
+                    positions.append((position, key))
+                    millis.append(int(match.group(1)))
+    
+    normalized = [{} for _ in invoices]
+    if millis:
+        ms = np.array(millis, dtype=np.int64)
+        days = (ms // MS_PER_DAY).tolist()
+        stamps = np.datetime_as_string(ms.astype('datetime64[ms]'), unit='s', timezone='UTC').tolist()
+        for (position, key), day, stamp in zip(positions, days, stamps):
+            normalized[position][key] = (day, stamp)
+    return normalized
+
+
+def normalized_date(invoice: Dict[str, Any], dates: Dict[str, Tuple[int, str]],
+                    *keys: str) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Epoch day and ISO value of the first date field present among keys
+    
+    Uses the batch-normalized SAP dates, falling back to to_epoch_day for
+    fields already in YYYY-MM-DD form.
+    """
+    for key in keys:
+        if key in dates:
+            return dates[key]
+        value = invoice.get(key)
+        if value:
+            day = to_epoch_day(value)
+            if day is None:
+                return None, None
+            return day, (EPOCH_DATE + timedelta(days=day)).isoformat()
+    return None, None
+
+
+def prepare_document(invoice: Dict[str, Any],
+                     dates: Optional[Dict[str, Tuple[int, str]]] = None) -> Document:
     """
-    documents = []
-    
-    for idx, invoice in enumerate(invoices):
-        # Extract key fields for text content
-        invoice_number = invoice.get('invoiceNumber', invoice.get('DocumentNumber', 'Unknown'))
-        company_code = invoice.get('companyCode', invoice.get('CompanyCode', 'Unknown'))
-        fiscal_year = invoice.get('fiscalYear', invoice.get('FiscalYear', 'Unknown'))
-        amount = invoice.get('amount', invoice.get('Amount', 0))
-        currency = invoice.get('currency', invoice.get('Currency', 'USD'))
-        document_date = invoice.get('documentDate', invoice.get('DocumentDate', ''))
-        posting_date = invoice.get('postingDate', invoice.get('PostingDate', ''))
-        document_type = invoice.get('documentType', invoice.get('DocumentType', ''))
-        reference = invoice.get('reference', invoice.get('Reference', ''))
-        business_area = invoice.get('businessArea', invoice.get('BusinessArea', ''))
+    Convert a single invoice to a LangChain Document with metadata
+    
+    Args:
+        invoice: Invoice dictionary
+        dates: This invoice's entry from normalize_sap_dates (computed if omitted)
         
-        # Create text content for embedding
-        text_content = f"""Invoice Number: {invoice_number}
+    Returns:
+        LangChain Document object
+    """
+    if dates is None:
+        dates = normalize_sap_dates([invoice])[0]
+    
+    # Extract key fields for text content
+    invoice_number = invoice.get('invoiceNumber', invoice.get('DocumentNumber', 'Unknown'))
+    company_code = invoice.get('companyCode', invoice.get('CompanyCode', 'Unknown'))
+    fiscal_year = invoice.get('fiscalYear', invoice.get('FiscalYear', 'Unknown'))
+    amount = invoice.get('amount', invoice.get('Amount', 0))
+    currency = invoice.get('currency', invoice.get('Currency', 'USD'))
+    document_date = invoice.get('documentDate', invoice.get('DocumentDate', ''))
+    posting_date = invoice.get('postingDate', invoice.get('PostingDate', ''))
+    document_type = invoice.get('documentType', invoice.get('DocumentType', ''))
+    reference = invoice.get('reference', invoice.get('Reference', ''))
+    business_area = invoice.get('businessArea', invoice.get('BusinessArea', ''))
+    
+    # Create text content for embedding
+    text_content = f"""Invoice Number: {invoice_number}
 Company Code: {company_code}
 Fiscal Year: {fiscal_year}
 Document Type: {document_type}
@@ -116,48 +338,131 @@ Document Date: {document_date}
 Posting Date: {posting_date}
 Business Area: {business_area}
 Reference: {reference}"""
+    
+    # Add any additional text fields
+    for key, value in invoice.items():
+        if isinstance(value, str) and len(value) > 10 and key not in [
+            'invoiceNumber', 'companyCode', 'fiscalYear', 'documentDate', 
+            'postingDate', 'documentType', 'reference', 'businessArea'
+        ]:
+            text_content += f"\n{key}: {value}"
+    
+    # Create unique ID
+    invoice_id = f"invoice_{invoice_number}_{company_code}_{fiscal_year}"
+    
+    # Dates normalized once to UTC, so queries never parse SAP date strings
+    document_day, document_iso = normalized_date(invoice, dates, 'documentDate', 'DocumentDate')
+    posting_day, posting_iso = normalized_date(invoice, dates, 'postingDate', 'PostingDate')
+    _, last_changed_iso = normalized_date(invoice, dates, 'lastChanged', 'LastChangeDateTime')
+    
+    # Prepare metadata: typed filter/display fields only. The full record
+    # lives in the invoice record store and is fetched by ID when needed.
+    metadata = {
+        'ID': invoice_id,
+        'invoiceNumber': str(invoice_number),
+        'companyCode': str(company_code),
+        'fiscalYear': to_int(fiscal_year),
+        'amount': to_float(amount),
+        'currency': str(currency),
+        'documentDay': document_day,
+        'postingDay': posting_day,
+        'documentDate': document_iso[:10] if document_iso else None,
+        'postingDate': posting_iso[:10] if posting_iso else None,
+        'lastChanged': last_changed_iso,
+        'documentType': str(document_type),
+        'reference': str(reference),
+        'businessArea': str(business_area)
+    }
+    # Vector stores reject null metadata values
+    metadata = {key: value for key, value in metadata.items() if value is not None}
+    
+    return Document(
+        page_content=text_content,
+        metadata=metadata
+    )
+
+
+def iter_documents(invoices: Iterable[Dict[str, Any]]) -> Iterator[Document]:
+    """
+    Lazily convert invoices to LangChain Documents
+    
+    Args:
+        invoices: Iterable of invoice dictionaries
         
-        # Add any additional text fields
-        for key, value in invoice.items():
-            if isinstance(value, str) and len(value) > 10 and key not in [
-                'invoiceNumber', 'companyCode', 'fiscalYear', 'documentDate', 
-                'postingDate', 'documentType', 'reference', 'businessArea'
-            ]:
-                text_content += f"\n{key}: {value}"
-        
-        # Create unique ID
-        invoice_id = f"invoice_{invoice_number}_{company_code}_{fiscal_year}"
-        
-        # Prepare metadata
-        metadata = {
-            'ID': invoice_id,
-            'invoiceNumber': str(invoice_number),
-            'companyCode': str(company_code),
-            'fiscalYear': str(fiscal_year),
-            'amount': float(amount) if amount else 0,
-            'currency': str(currency),
-            'documentDate': str(document_date),
-            'postingDate': str(posting_date),
-            'documentType': str(document_type),
-            'reference': str(reference),
-            'businessArea': str(business_area),
-            'source': 'SAP_S4HANA'
-        }
+    Yields:
+        LangChain Document objects
+    """
+    for invoice in invoices:
+        yield prepare_document(invoice)
+
+
+def prepare_documents(invoices: List[Dict[str, Any]]) -> List[Document]:
+    """
+    Convert invoice data to LangChain Documents with metadata
+    
+    Args:
+        invoices: List of invoice dictionaries
         
-        # Add all other fields to metadata (keeping original keys)
-        for key, value in invoice.items():
-            if key not in metadata and not isinstance(value, (dict, list)):
-                metadata[key] = str(value)
+    Returns:
+        List of LangChain Document objects
+    """
+    return list(iter_documents(invoices))
+
+
+@lru_cache(maxsize=None)
+def get_text_splitter(chunk_size: int = 1000):
+    """Text splitter for the given chunk size, built once per process"""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=100,
+        separators=["\n\n", "\n", " ", ""]
+    )
+
+
+def split_document(doc: Document, chunk_size: int = 1000) -> List[Document]:
+    """
+    Split one document into chunks if it is longer than chunk_size
+    
+    Args:
+        doc: Document object
+        chunk_size: Maximum characters per chunk
         
-        # Create Document
-        doc = Document(
-            page_content=text_content,
-            metadata=metadata
-        )
+    Returns:
+        List of chunk Documents (the document itself if it fits)
+    """
+    if len(doc.page_content) <= chunk_size:
+        return [doc]
+    
+    chunks = get_text_splitter(chunk_size).split_text(doc.page_content)
+    chunked_docs = []
+    for i, chunk in enumerate(chunks):
+        # Create new document with same metadata plus chunk info
+        chunk_metadata = doc.metadata.copy()
+        chunk_metadata['chunk_index'] = i
+        chunk_metadata['total_chunks'] = len(chunks)
         
-        documents.append(doc)
+        chunked_docs.append(Document(
+            page_content=chunk,
+            metadata=chunk_metadata
+        ))
+    return chunked_docs
+
+
+def iter_chunks(documents: Iterable[Document], chunk_size: int = 1000) -> Iterator[Document]:
+    """
+    Lazily split documents into smaller chunks if needed
     
-    return documents
+    Args:
+        documents: Iterable of Document objects
+        chunk_size: Maximum characters per chunk
+        
+    Yields:
+        Chunked Document objects
+    """
+    for doc in documents:
+        yield from split_document(doc, chunk_size)
 
 
 def chunk_documents(documents: List[Document], chunk_size: int = 1000) -> List[Document]:
@@ -171,103 +476,375 @@ def chunk_documents(documents: List[Document], chunk_size: int = 1000) -> List[D
     Returns:
         List of chunked Document objects
     """
-    from langchain.text_splitter import RecursiveCharacterTextSplitter
-    
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=100,
-        separators=["\n\n", "\n", " ", ""]
-    )
+    return list(iter_chunks(documents, chunk_size))
+
+
+def batched(items: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+    """Group an iterable into lists of at most batch_size items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def prepare_invoice(invoice: Dict[str, Any], use_chunking: bool = True,
+                    dates: Optional[Dict[str, Tuple[int, str]]] = None) -> PreparedInvoice:
+    """
+    Prepare, hash and chunk a single invoice
     
-    chunked_docs = []
-    for doc in documents:
-        if len(doc.page_content) > chunk_size:
-            # Split into chunks
-            chunks = text_splitter.split_text(doc.page_content)
-            for i, chunk in enumerate(chunks):
-                # Create new document with same metadata plus chunk info
-                chunk_metadata = doc.metadata.copy()
-                chunk_metadata['chunk_index'] = i
-                chunk_metadata['total_chunks'] = len(chunks)
-                
-                chunked_docs.append(Document(
-                    page_content=chunk,
-                    metadata=chunk_metadata
-                ))
-        else:
-            chunked_docs.append(doc)
+    The hash covers the full record as well as the vector payload, so a
+    change to a field that is only kept in the record store is detected.
     
-    return chunked_docs
+    Returns:
+        (invoice record, document, content hash, chunks to embed)
+    """
+    doc = prepare_document(invoice, dates)
+    digest = content_hash(doc.page_content, {'metadata': doc.metadata, 'record': invoice})
+    chunks = split_document(doc) if use_chunking else [doc]
+    return invoice, doc, digest, chunks
 
 
-def index_invoices(json_file_path: str, use_chunking: bool = True):
+def _prepare_shard(invoices: List[Dict[str, Any]], use_chunking: bool) -> List[PreparedInvoice]:
+    """Prepare a shard of invoices, normalizing their SAP dates in one batch"""
+    dates = normalize_sap_dates(invoices)
+    return [
+        prepare_invoice(invoice, use_chunking, invoice_dates)
+        for invoice, invoice_dates in zip(invoices, dates)
+    ]
+
+
+def iter_prepared_invoices(invoices: Iterable[Dict[str, Any]], use_chunking: bool = True,
+                           workers: int = PREP_WORKERS) -> Iterator[PreparedInvoice]:
     """
-    Index invoices from JSON file to Pinecone
+    Prepare, hash and chunk invoices, optionally across a process pool
+    
+    With workers > 1 the invoice stream is cut into shards that are prepared
+    in worker processes (each keeps its own text splitter). At most
+    2 * workers shards are in flight and results are yielded in input order,
+    so output is identical to the single-process path.
     
     Args:
-        json_file_path: Path to JSON file
+        invoices: Iterable of invoice dictionaries
         use_chunking: Whether to split large documents into chunks
+        workers: Number of worker processes (1 = prepare in this process)
+        
+    Yields:
+        (invoice record, document, content hash, chunks) per invoice, in input order
     """
-    print(f"\nIndexing invoices from: {json_file_path}")
-    
-    # Load invoice data
-    print("Loading invoice data...")
-    invoices = load_invoice_data(json_file_path)
-    print(f"Loaded {len(invoices)} invoices")
+    if workers <= 1:
+        for shard in batched(invoices, PREP_SHARD_SIZE):
+            yield from _prepare_shard(shard, use_chunking)
+        return
     
-    if not invoices:
-        print("No invoices found in file")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for shard in batched(invoices, PREP_SHARD_SIZE):
+            in_flight.append(executor.submit(_prepare_shard, shard, use_chunking))
+            if len(in_flight) >= workers * 2:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+def manifest_path_for(backend: VectorBackend) -> str:
+    """Manifest file for a backend; each backend tracks its own contents"""
+    if INDEX_MANIFEST_PATH:
+        return INDEX_MANIFEST_PATH
+    if backend.name == 'pinecone':
+        return "index_manifest.db"
+    return f"index_manifest_{backend.name}.db"
+
+
+def delete_vectors(vector_ids: List[str], backend: Optional[VectorBackend] = None):
+    """Delete vectors from the namespace by ID"""
+    if not vector_ids:
         return
+    (backend or get_backend()).delete(vector_ids)
+
+
+def delete_unmanifested_vectors(manifest: IndexManifest, backend: VectorBackend) -> int:
+    """
+    Delete every vector the manifest does not list
     
-    # Prepare documents
-    print("Preparing documents...")
-    documents = prepare_documents(invoices)
-    print(f"Created {len(documents)} documents")
+    Indexer versions before the manifest wrote random vector IDs, which no
+    later run can find. After the first full run over such a namespace,
+    each of its invoices has deterministic vectors in the manifest, so
+    anything else is a stale duplicate.
     
-    # Chunk documents if needed
-    if use_chunking:
-        print("Chunking documents...")
-        documents = chunk_documents(documents)
-        print(f"Created {len(documents)} chunks")
+    Returns:
+        Number of vectors deleted
+    """
+    obsolete = []
+    for ids in backend.list_ids():
+        for vector_id in ids:
+            invoice_id, _, chunk = vector_id.partition('#')
+            entry = manifest.get(invoice_id) if chunk else None
+            if entry is None or vector_id not in entry[1]:
+                obsolete.append(vector_id)
+    for batch in batched(obsolete, DELETE_BATCH_SIZE):
+        delete_vectors(batch, backend)
+    return len(obsolete)
+
+
+def vector_id_for(doc: Document) -> str:
+    """
+    Deterministic vector ID for a chunk: composite invoice ID plus chunk index
+    
+    Re-indexing the same invoice therefore overwrites its vectors instead of
+    adding another copy to the namespace.
+    """
+    return f"{doc.metadata['ID']}#{doc.metadata.get('chunk_index', 0)}"
+
+
+def upsert_records(records: List[Any], backend: Optional[VectorBackend] = None):
+    """Upsert (vector_id, document, embedding) records to the namespace"""
+    (backend or get_backend()).upsert([
+        # Same layout as PineconeVectorStore: page content under 'text'
+        (vector_id, vector, {**doc.metadata, 'text': doc.page_content})
+        for vector_id, doc, vector in records
+    ])
+
+
+def index_invoice_stream(invoices: Iterable[Dict[str, Any]], source: str, use_chunking: bool = True,
+                   embed_batch_size: int = EMBED_BATCH_SIZE,
+                   upsert_batch_size: int = UPSERT_BATCH_SIZE,
+                   concurrency: int = INDEX_CONCURRENCY,
+                   incremental: bool = True, prune: bool = True,
+                   upsert_mode: str = UPSERT_MODE, workers: int = PREP_WORKERS,
+                   backend: Optional[VectorBackend] = None):
+    """
+    Index a stream of invoices to the vector store
+    
+    Invoices flow through document preparation and chunking into a
+    concurrent embed-and-upsert pipeline with bounded queues, so memory use
+    does not grow with the size of the source.
+    Invoices whose content hash matches the manifest are skipped, and
+    vectors of invoices missing from the source are deleted.
+    
+    Args:
+        invoices: Iterable of invoice dictionaries, consumed lazily
+        source: Description of the source (file path or URL) for logs and the manifest
+        use_chunking: Whether to split large documents into chunks
+        embed_batch_size: Number of chunks per embeddings request
+        upsert_batch_size: Number of vectors per upsert request
+        concurrency: Number of embed workers and of upsert workers
+        incremental: Skip invoices that are unchanged since the last run
+        prune: Delete vectors of invoices that are no longer in the source. On the
+            first run over a namespace that already holds vectors (no manifest
+            yet), this also deletes the vectors older indexer versions wrote
+            under random IDs
+        upsert_mode: 'overwrite' uses deterministic vector IDs so re-runs replace
+            existing vectors; 'append' uses random IDs (legacy behaviour)
+        workers: Processes used for document preparation and chunking
+        backend: Vector store backend (defaults to VECTOR_BACKEND)
+    """
+    print(f"\nIndexing invoices from: {source}")
+    
+    backend = backend or get_backend()
     
     # Create or connect to index
-    create_index_if_not_exists()
+    create_index_if_not_exists(backend)
     
-    # Index to Pinecone
-    print(f"Indexing to Pinecone (namespace: {PINECONE_NAMESPACE})...")
+    manifest = IndexManifest(manifest_path_for(backend))
+    records = InvoiceRecordStore(INVOICE_STORE_PATH)
+    # Vectors but no manifest: written by an indexer version with random IDs
+    migrate_legacy = upsert_mode != 'append' and prune and manifest.count() == 0 and backend.count() > 0
+    run_id = manifest.start_run(source)
+    
+    counts = {
+        'invoices': 0, 'new': 0, 'changed': 0, 'unchanged': 0, 'duplicates': 0,
+        'chunks': 0, 'skipped_chunks': 0, 'deleted': 0, 'removed_invoices': 0
+    }
+    # Invoices whose chunks are being upserted: ID -> hash, old and new vector IDs
+    pending = {}
+    
+    prepared = iter_prepared_invoices(invoices, use_chunking, workers)
+    
+    def changed_chunks():
+        for invoice, doc, digest, chunks in prepared:
+            counts['invoices'] += 1
+            invoice_id = doc.metadata['ID']
+            previous = manifest.get(invoice_id)
+            if invoice_id in pending or (previous and previous[2] == run_id):
+                counts['duplicates'] += 1
+                continue
+            
+            if previous and incremental and previous[0] == digest:
+                manifest.mark_seen(invoice_id, run_id)
+                # Fill the invoice table and text index for indexes built before they existed
+                records.put_row(invoice_id, doc.metadata, doc.page_content, replace=False)
+                counts['unchanged'] += 1
+                counts['skipped_chunks'] += len(previous[1])
+                continue
+            
+            counts['changed' if previous else 'new'] += 1
+            records.put(invoice_id, invoice, doc.metadata, doc.page_content)
+            pending[invoice_id] = {
+                'hash': digest,
+                'old_ids': previous[1] if previous else [],
+                'ids': []
+            }
+            yield from chunks
+    
+    documents = changed_chunks()
+    
+    def on_upserted(upserted):
+        # Record invoices once all of their chunks are upserted
+        obsolete_ids = []
+        for vector_id, doc in upserted:
+            invoice_id = doc.metadata['ID']
+            entry = pending[invoice_id]
+            entry['ids'].append(vector_id)
+            if len(entry['ids']) == doc.metadata.get('total_chunks', 1):
+                manifest.record(invoice_id, entry['hash'], entry['ids'], run_id)
+                obsolete_ids.extend(set(entry['old_ids']) - set(entry['ids']))
+                del pending[invoice_id]
+        delete_vectors(obsolete_ids, backend)
+        counts['deleted'] += len(obsolete_ids)
+        records.commit()
+        manifest.commit()
+    
+    pipeline = EmbedUpsertPipeline(
+        embed_fn=embeddings.embed_documents,
+        upsert_fn=partial(upsert_records, backend=backend),
+        embed_batch_size=embed_batch_size,
+        upsert_batch_size=upsert_batch_size,
+        concurrency=concurrency,
+        on_upserted=on_upserted
+    )
+    
+    # Index to the vector store
+    print(f"Streaming to {backend.name} (embed batch: {embed_batch_size}, "
+          f"upsert batch: {upsert_batch_size}, concurrency: {concurrency})...")
     try:
-        vectorstore = PineconeVectorStore.from_documents(
-            documents=documents,
-            embedding=embeddings,
-            index_name=PINECONE_INDEX,
-            namespace=PINECONE_NAMESPACE,
-            pinecone_api_key=PINECONE_API_KEY
-        )
-        print(f"Successfully indexed {len(documents)} documents to Pinecone")
+        if upsert_mode == 'append':
+            items = ((str(uuid.uuid4()), doc) for doc in documents)
+        else:
+            items = ((vector_id_for(doc), doc) for doc in documents)
+        result = pipeline.run(items)
+        counts['chunks'] = result['upserted']
+        
+        # Remove invoices that disappeared from the source
+        if prune and counts['invoices']:
+            stale = list(manifest.iter_stale(run_id))
+            for stale_batch in batched(stale, DELETE_BATCH_SIZE):
+                stale_ids = [vector_id for _, ids in stale_batch for vector_id in ids]
+                delete_vectors(stale_ids, backend)
+                records.delete(invoice_id for invoice_id, _ in stale_batch)
+                manifest.remove(invoice_id for invoice_id, _ in stale_batch)
+                records.commit()
+                manifest.commit()
+                counts['deleted'] += len(stale_ids)
+                counts['removed_invoices'] += len(stale_batch)
+        
+        if migrate_legacy and counts['invoices']:
+            try:
+                legacy = delete_unmanifested_vectors(manifest, backend)
+                counts['deleted'] += legacy
+                print(f"Removed {legacy} vectors left by an older indexer version (random IDs)")
+            except Exception as e:
+                # e.g. Pinecone pod indexes cannot list IDs
+                print(f"Warning: could not list {backend.name} vector IDs ({type(e).__name__}: {e}); vectors "
+                      f"from older indexer versions may remain as duplicates. Re-run with --clear to rebuild.")
     except Exception as e:
-        print(f"Error indexing to Pinecone: {e}")
+        print(f"Error indexing to {backend.name}: {e}")
+        return
+    finally:
+        backend.flush()
+        # Invalidate the RAG system's query caches, even after a partial run
+        records.bump_index_version()
+        records.close()
+        manifest.close()
+    
+    if not counts['invoices']:
+        print("No invoices found in source")
+        return
+    
+    print(f"Successfully indexed {counts['chunks']} documents from {counts['invoices']} invoices to {backend.name} "
+          f"in {result['elapsed']:.1f}s ({result['docs_per_sec']:.1f} docs/s, "
+          f"{result['vectors_per_sec']:.1f} vectors/s)")
+    print(f"  New: {counts['new']}, changed: {counts['changed']}, unchanged: {counts['unchanged']}, "
+          f"duplicates in file: {counts['duplicates']}, removed: {counts['removed_invoices']}")
+    print(f"  Skipped {counts['skipped_chunks']} embeddings and {counts['skipped_chunks']} upserts "
+          f"for unchanged invoices")
+    print(f"  Deleted {counts['deleted']} obsolete vectors")
+    cache_stats = embeddings.stats()
+    print(f"  Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+          f"({cache_stats['entries']} entries cached)")
 
 
-def clear_namespace():
+def index_invoices(json_file_path: str, **kwargs):
+    """
+    Index invoices from JSON file to the vector store
+    
+    The file is streamed one invoice at a time; see index_invoice_stream
+    for the keyword arguments.
+    
+    Args:
+        json_file_path: Path to JSON file
+    """
+    index_invoice_stream(iter_invoice_data(json_file_path), json_file_path, **kwargs)
+
+
+def index_odata(service_url: str, entity_set: str, select: Optional[List[str]] = None,
+                filter: Optional[str] = None, page_size: int = ODATA_PAGE_SIZE,
+                odata_concurrency: int = ODATA_CONCURRENCY, **kwargs):
+    """
+    Index invoices directly from an SAP OData V2 entity set
+    
+    Pages are fetched concurrently over a pooled session and streamed into
+    the indexing pipeline; see index_invoice_stream for the keyword arguments.
+    
+    Args:
+        service_url: OData service root, e.g. https://host/sap/opu/odata/sap/ZINVOICE_SRV
+        entity_set: Entity set name, e.g. InvoiceSet
+        select: Columns to request ($select); defaults to the fields prepare_document reads
+        filter: Optional $filter expression; a filtered extract never prunes
+        page_size: Records per page ($top)
+        odata_concurrency: Pages fetched in parallel
+    """
+    if filter:
+        # Invoices outside the filter are missing from the extract, not deleted in SAP
+        kwargs['prune'] = False
+    source = ODataV2Source(
+        service_url,
+        entity_set,
+        select=select,
+        filter=filter,
+        page_size=page_size,
+        concurrency=odata_concurrency
+    )
+    index_invoice_stream(source, source.url, **kwargs)
+    print(f"  OData: {source.stats['records']} records in {source.stats['pages']} pages")
+
+
+def clear_namespace(backend: Optional[VectorBackend] = None):
     """Clear all vectors from the namespace"""
+    backend = backend or get_backend()
     try:
-        index = pc.Index(PINECONE_INDEX)
-        index.delete(delete_all=True, namespace=PINECONE_NAMESPACE)
-        print(f"Cleared namespace: {PINECONE_NAMESPACE}")
+        backend.delete_all()
+        # The manifest describes what is in the namespace, so it goes too
+        manifest = IndexManifest(manifest_path_for(backend))
+        manifest.clear()
+        manifest.close()
+        records = InvoiceRecordStore(INVOICE_STORE_PATH)
+        records.clear()
+        records.close()
+        print(f"Cleared {backend.name} vectors")
     except Exception as e:
         print(f"Error clearing namespace: {e}")
 
 
-def get_index_stats():
-    """Get statistics about the Pinecone index"""
+def get_index_stats(backend: Optional[VectorBackend] = None):
+    """Get statistics about the vector index"""
+    backend = backend or get_backend()
     try:
-        index = pc.Index(PINECONE_INDEX)
-        stats = index.describe_index_stats()
         print(f"\nIndex Statistics:")
-        print(f"Total vectors: {stats.total_vector_count}")
-        if stats.namespaces:
-            for ns, info in stats.namespaces.items():
-                print(f"  Namespace '{ns}': {info.vector_count} vectors")
+        print(backend.describe())
     except Exception as e:
         print(f"Error getting stats: {e}")
 
@@ -279,39 +856,95 @@ def get_index_stats():
 if __name__ == "__main__":
     import argparse
     
-    parser = argparse.ArgumentParser(description="Index SAP invoices to Pinecone")
+    parser = argparse.ArgumentParser(description="Index SAP invoices to a vector store")
     parser.add_argument("--file", type=str, help="Path to invoice JSON file")
+    parser.add_argument("--odata-url", type=str, help="OData V2 service root to index from instead of a file")
+    parser.add_argument("--entity-set", type=str, default="InvoiceSet", help="OData entity set (default: InvoiceSet)")
+    parser.add_argument("--odata-filter", type=str, help="OData $filter expression (implies --keep-missing)")
+    parser.add_argument("--odata-select", type=str,
+                        help="Comma-separated $select columns (default: fields used by prepare_document, '*' for all)")
+    parser.add_argument("--odata-page-size", type=int, default=ODATA_PAGE_SIZE, help="Records per OData page ($top)")
+    parser.add_argument("--odata-concurrency", type=int, default=ODATA_CONCURRENCY, help="OData pages fetched in parallel")
     parser.add_argument("--clear", action="store_true", help="Clear namespace before indexing")
     parser.add_argument("--stats", action="store_true", help="Show index statistics")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=VECTOR_BACKEND,
+                        help="Vector store backend (default: VECTOR_BACKEND or pinecone)")
     parser.add_argument("--no-chunk", action="store_true", help="Disable document chunking")
+    parser.add_argument("--full", action="store_true", help="Re-embed every invoice, ignoring the manifest")
+    parser.add_argument("--keep-missing", action="store_true",
+                        help="Keep vectors of invoices missing from the file (for partial/delta exports)")
+    parser.add_argument("--embed-batch-size", type=int, default=EMBED_BATCH_SIZE, help="Chunks per embeddings request")
+    parser.add_argument("--upsert-batch-size", type=int, default=UPSERT_BATCH_SIZE, help="Vectors per upsert request")
+    parser.add_argument("--upsert-mode", choices=["overwrite", "append"], default=UPSERT_MODE,
+                        help="overwrite: deterministic IDs replace existing vectors; append: random IDs")
+    parser.add_argument("--workers", type=int, default=PREP_WORKERS,
+                        help="Processes for document preparation and chunking (0 = one per CPU)")
+    parser.add_argument("--concurrency", type=int, default=INDEX_CONCURRENCY, help="Parallel embed and upsert workers")
     
     args = parser.parse_args()
     
     print("SAP Invoice Indexing Script")
     print("=" * 50)
     
+    backend = get_backend(args.backend)
+    
     # Show stats
     if args.stats:
-        get_index_stats()
+        get_index_stats(backend)
     
     # Clear namespace if requested
     if args.clear:
-        confirm = input(f"Are you sure you want to clear namespace '{PINECONE_NAMESPACE}'? (yes/no): ")
+        confirm = input(f"Are you sure you want to clear all {backend.name} vectors? (yes/no): ")
         if confirm.lower() == 'yes':
-            clear_namespace()
+            clear_namespace(backend)
+    
+    index_options = dict(
+        use_chunking=not args.no_chunk,
+        embed_batch_size=args.embed_batch_size,
+        upsert_batch_size=args.upsert_batch_size,
+        concurrency=args.concurrency,
+        upsert_mode=args.upsert_mode,
+        workers=args.workers or os.cpu_count() or 1,
+        incremental=not args.full,
+        prune=not args.keep_missing,
+        backend=backend
+    )
     
     # Index file if provided
     if args.file:
         if not Path(args.file).exists():
             print(f"Error: File not found: {args.file}")
         else:
-            index_invoices(args.file, use_chunking=not args.no_chunk)
-            get_index_stats()
+            index_invoices(args.file, **index_options)
+            get_index_stats(backend)
+    
+    # Index straight from an OData V2 service
+    if args.odata_url:
+        if args.odata_select == '*':
+            select = []
+        elif args.odata_select:
+            select = [field.strip() for field in args.odata_select.split(',') if field.strip()]
+        else:
+            select = None
+        index_odata(
+            args.odata_url,
+            args.entity_set,
+            select=select,
+            filter=args.odata_filter,
+            page_size=args.odata_page_size,
+            odata_concurrency=args.odata_concurrency,
+            **index_options
+        )
+        get_index_stats(backend)
     
     # Interactive mode if no file provided
-    if not args.file and not args.stats and not args.clear:
+    if not args.file and not args.odata_url and not args.stats and not args.clear:
         print("\nUsage examples:")
         print("  python sap_invoice_indexer.py --file invoices.json")
         print("  python sap_invoice_indexer.py --file invoices.json --clear")
         print("  python sap_invoice_indexer.py --stats")
         print("  python sap_invoice_indexer.py --file invoices.json --no-chunk")
+        print("  python sap_invoice_indexer.py --file delta.json --keep-missing")
+        print("  python sap_invoice_indexer.py --file invoices.json --full")
+        print("  python sap_invoice_indexer.py --file invoices.json --backend local")
+        print("  python sap_invoice_indexer.py --odata-url http://localhost:3000/odata/v2 --entity-set InvoiceSet")
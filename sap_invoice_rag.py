@@ -1,64 +1,212 @@
 """
-SAP Invoice RAG System with Pinecone
+SAP Invoice RAG System with a pluggable vector store (Pinecone, Qdrant or local)
 Handles invoice retrieval, deduplication, and date filtering
 """
 
 import os
-from datetime import datetime
-from typing import List, Dict, Any, Set
+import json
+import time
+import uuid
+import base64
+import asyncio
+import threading
+from datetime import datetime, date, timedelta
+from typing import List, Dict, Any, Set, Optional, AsyncIterator, Callable, Iterable, Iterator, Tuple
 import re
 from collections import defaultdict
+from functools import lru_cache, wraps
+from itertools import islice
+
 from dotenv import load_dotenv
 
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_pinecone import PineconeVectorStore
-from langchain.agents import AgentExecutor, create_openai_tools_agent
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.tools.retriever import create_retriever_tool
-from langchain_core.messages import HumanMessage, AIMessage
-from langchain_community.chat_message_histories import ChatMessageHistory
-from langchain_core.runnables.history import RunnableWithMessageHistory
-from pinecone import Pinecone
+from langchain_core.messages import HumanMessage
+from langchain_core.tools import StructuredTool, tool
+
+from query_cache import QueryCache, QueryEmbeddingCache, normalize_query
+from query_router import classify_query, RouterStats, ID_QUERY_FILLER
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "your-openai-api-key")
-PINECONE_API_KEY = os.getenv("PINECONE_API_KEY", "your-pinecone-api-key")
-PINECONE_INDEX = "n8n-s4hana-new"
-PINECONE_NAMESPACE = "invoice-documents"
-
-# Initialize Pinecone
-pc = Pinecone(api_key=PINECONE_API_KEY)
-
-# Initialize embeddings
-embeddings = OpenAIEmbeddings(
-    model="text-embedding-3-small",
-    dimensions=512,
-    api_key=OPENAI_API_KEY
-)
 
-# Initialize vector store
-vectorstore = PineconeVectorStore(
-    index_name=PINECONE_INDEX,
-    embedding=embeddings,
-    namespace=PINECONE_NAMESPACE,
-    pinecone_api_key=PINECONE_API_KEY
-)
 
-# Create retriever with high k to get all chunks
-retriever = vectorstore.as_retriever(
-    search_kwargs={"k": 50}
-)
+class LazyComponent:
+    """
+    A component of the RAG system, built on first use
+    
+    Clients, stores and the agent are not created at import time, so
+    importing this module is cheap and needs no API keys. Construction
+    runs at most once, under a lock: concurrent first requests wait for
+    the same instance instead of each building their own.
+    """
+    
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self.name = name
+        self.factory = factory
+        self.build_seconds = None
+        self._built = False
+        self._value = None
+        self._lock = threading.Lock()
+    
+    def get(self) -> Any:
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    started = time.perf_counter()
+                    self._value = self.factory()
+                    self.build_seconds = time.perf_counter() - started
+                    self._built = True
+                    print(f"[startup] built {self.name} in {self.build_seconds * 1000:.0f} ms")
+        return self._value
+    
+    @property
+    def built(self) -> bool:
+        return self._built
+
+
+_components: Dict[str, LazyComponent] = {}
+
+
+def component(name: str):
+    """Register a factory as a lazily built component; the decorated function returns the instance"""
+    def register(factory):
+        lazy = _components[name] = LazyComponent(name, factory)
+        
+        @wraps(factory)
+        def get():
+            return lazy.get()
+        return get
+    return register
+
+
+@component('embeddings')
+def get_embeddings():
+    """Query embeddings model, served from the shared on-disk cache when possible"""
+    from langchain_openai import OpenAIEmbeddings
+    from embedding_cache import CachedEmbeddings
+    
+    return CachedEmbeddings(
+        OpenAIEmbeddings(
+            model="text-embedding-3-small",
+            dimensions=512,
+            api_key=OPENAI_API_KEY
+        )
+    )
+
+
+@component('query_embeddings')
+def get_query_embeddings():
+    """In-process memo over the embeddings, so repeated queries skip embedding entirely"""
+    return QueryEmbeddingCache(get_embeddings())
+
+
+@component('vectorstore')
+def get_vectorstore():
+    """Vector store (backend selected by VECTOR_BACKEND)"""
+    from vector_backends import BackendVectorStore, get_backend
+    
+    return BackendVectorStore(
+        backend=get_backend(),
+        embedding=get_query_embeddings()
+    )
+
+
+@component('record_store')
+def get_record_store():
+    """Invoice table and full invoice records, fetched by ID only when needed"""
+    from invoice_store import InvoiceRecordStore
+    
+    return InvoiceRecordStore()
+
+
+# Deduplicated retrieval results, dropped whenever the indexer bumps the index version
+retrieval_cache = QueryCache(version_fn=lambda: get_record_store().index_version())
+
+EPOCH_DATE = date(1970, 1, 1)
+EPOCH_DAY_RANGE = 200000  # Days either side of 1970-01-01 that any document day falls within
+
+# Filtered vector queries: chunks requested per query, and per query within a
+# single day (both capped by the backend's max_query_k, 1000 for Pinecone)
+FILTER_PAGE_SIZE = int(os.getenv("FILTER_PAGE_SIZE", "1000"))
+MAX_FILTER_PAGE_SIZE = 10000
+SCAN_BATCH_SIZE = int(os.getenv("SCAN_BATCH_SIZE", "100"))  # Vectors per page of a full scan
+DATE_RANGE_PAGE_SIZE = int(os.getenv("DATE_RANGE_PAGE_SIZE", "500"))  # Invoices per date-range page
+MAX_DATE_RANGE_PAGE_SIZE = 10000
+FILTER_QUERY = "invoice document financial"
+
+# Token budget of search_invoice_documents output (aggregates plus ranked sample)
+CHAT_MODEL = "gpt-4o-mini"
+SEARCH_TOKEN_BUDGET = int(os.getenv("SEARCH_TOKEN_BUDGET", "3000"))
+SEARCH_TOKEN_RESERVE = 100  # Room for the list heading, omission note and scope note
+SEARCH_SCOPE_NOTE = ("\nSCOPE: these totals cover the retrieved invoices only. For exact counts or sums "
+                     "over all invoices use scan_all_invoices.")
+
+# Document text rebuilt for invoice table rows (layout of sap_invoice_indexer.py)
+INVOICE_TEXT_FIELDS = ('invoiceNumber', 'companyCode', 'fiscalYear', 'documentType', 'amount', 'currency',
+                       'documentDate', 'postingDate', 'businessArea', 'reference')
+INVOICE_TEXT_TEMPLATE = """Invoice Number: {invoiceNumber}
+Company Code: {companyCode}
+Fiscal Year: {fiscalYear}
+Document Type: {documentType}
+Amount: {amount} {currency}
+Document Date: {documentDate}
+Posting Date: {postingDate}
+Business Area: {businessArea}
+Reference: {reference}"""
+
+# Hybrid search: lexical hits fetched and the reciprocal rank fusion constant
+LEXICAL_K = 50
+LEXICAL_MIN_SCORE = float(os.getenv("LEXICAL_MIN_SCORE", "2.0"))  # BM25; terms shared by many invoices score lower
+RRF_K = 60
+ID_TOKEN_PATTERN = re.compile(r'[A-Za-z0-9][\w-]*\d[\w-]*')  # Words containing digits: numbers, references
+
+# Invoices listed in a fast-path answer before summarizing the rest
+FAST_PATH_LIST_LIMIT = 20
+FIELD_LABELS = {
+    'companyCode': 'company code',
+    'fiscalYear': 'fiscal year',
+    'documentType': 'document type',
+    'currency': 'currency',
+    'businessArea': 'business area'
+}
+
+# Adaptive-k semantic retrieval: start small and double k until enough unique
+# invoices are found or similarity falls below the cutoff
+ADAPTIVE_INITIAL_K = int(os.getenv("ADAPTIVE_INITIAL_K", "10"))
+ADAPTIVE_MAX_K = int(os.getenv("ADAPTIVE_MAX_K", "200"))
+ADAPTIVE_TARGET_INVOICES = int(os.getenv("ADAPTIVE_TARGET_INVOICES", "50"))  # Matches the old fixed k=50
+ADAPTIVE_MIN_SCORE = float(os.getenv("ADAPTIVE_MIN_SCORE", "0.2"))  # Cosine similarity cutoff
+ADAPTIVE_SCORE_DROP = float(os.getenv("ADAPTIVE_SCORE_DROP", "0.15"))  # Stop widening past this fall from the best score
+
+# Batch queries: questions of one batch retrieved and answered concurrently
+BATCH_FANOUT = int(os.getenv("BATCH_FANOUT", "8"))
+BATCH_CONTEXT_TEMPLATE = """{question}
+
+search_invoice_documents was already run for this question and returned:
+{results}
+
+Answer from these results. Call a tool only if they do not answer the question."""
+
+
+@component('retriever')
+def get_retriever():
+    """Fixed-k retriever (LangChain interface); whole-corpus questions use scan_invoices"""
+    return get_vectorstore().as_retriever(
+        search_kwargs={"k": 50}
+    )
 
 
 def convert_sap_date(sap_date_str: str) -> str:
     """
-    Convert SAP date format /Date(timestamp)/ to YYYY-MM-DD
+    Convert SAP date format /Date(timestamp)/ to YYYY-MM-DD (UTC)
+    
+    Only needed for vectors indexed without normalized dates; the indexer
+    stores documentDate/postingDate/lastChanged already converted.
     
     Args:
-        sap_date_str: Date string in format /Date(1609113600000)/
+        sap_date_str: Date string in format /Date(1609113600000)/ or /Date(1609113600000+0200)/
         
     Returns:
         Date string in YYYY-MM-DD format or original if conversion fails
@@ -66,26 +214,42 @@ def convert_sap_date(sap_date_str: str) -> str:
     if not sap_date_str or not isinstance(sap_date_str, str):
         return sap_date_str
     
-    match = re.search(r'/Date\((\d+)\)/', sap_date_str)
+    match = re.search(r'/Date\((-?\d+)(?:[+-]\d+)?\)/', sap_date_str)
     if match:
         timestamp = int(match.group(1))
-        dt = datetime.fromtimestamp(timestamp / 1000)
-        return dt.strftime('%Y-%m-%d')
+        return epoch_day_to_date(timestamp // 86400000)
     
     return sap_date_str
 
 
-def deduplicate_invoices(documents: List[Any]) -> List[Dict[str, Any]]:
+def epoch_day_to_date(epoch_day: Any) -> str:
     """
-    Deduplicate invoice documents by invoiceNumber + companyCode + fiscalYear
+    Convert an epoch-day metadata value (days since 1970-01-01) to YYYY-MM-DD
     
     Args:
-        documents: List of LangChain documents from retriever
+        epoch_day: Integer day number as written by the indexer
         
     Returns:
-        List of unique invoices with converted dates
+        Date string in YYYY-MM-DD format, or '' if the value is not a number
+    """
+    try:
+        return (EPOCH_DATE + timedelta(days=int(epoch_day))).strftime('%Y-%m-%d')
+    except (TypeError, ValueError, OverflowError):
+        return ''
+
+
+def iter_unique_invoices(documents: Iterable[Any], seen: Optional[Set[str]] = None) -> Iterator[Dict[str, Any]]:
     """
-    unique_invoices = {}
+    Lazily deduplicate invoice documents by invoiceNumber + companyCode + fiscalYear
+    
+    Args:
+        documents: Iterable of LangChain documents (consumed lazily)
+        seen: Set of invoice IDs already yielded; updated in place
+        
+    Yields:
+        Unique invoices with converted dates, in input order
+    """
+    seen = set() if seen is None else seen
     
     for doc in documents:
         # Create composite ID from invoice number, company code, and fiscal year
@@ -96,30 +260,76 @@ def deduplicate_invoices(documents: List[Any]) -> List[Dict[str, Any]]:
         if not invoice_num:
             continue
         
-        # Create unique ID
-        invoice_id = f"{invoice_num}_{company_code}_{fiscal_year}"
+        # Unique ID: the indexer's own (also the invoice table key), so a fiscal year
+        # it could not parse (kept out of the metadata) still yields the same ID
+        indexed_id = str(doc.metadata.get('ID', ''))
+        if indexed_id.startswith('invoice_'):
+            invoice_id = indexed_id[len('invoice_'):]
+        else:
+            invoice_id = f"{invoice_num}_{company_code}_{fiscal_year}"
         
         # If we've already seen this ID, skip
-        if invoice_id in unique_invoices:
+        if invoice_id in seen:
             continue
+        seen.add(invoice_id)
         
         # Convert SAP dates
         invoice_data = doc.metadata.copy()
         invoice_data['text'] = doc.page_content
         invoice_data['ID'] = invoice_id
         
-        if 'documentDate' in invoice_data:
-            invoice_data['documentDateConverted'] = convert_sap_date(invoice_data['documentDate'])
-        
-        if 'postingDate' in invoice_data:
-            invoice_data['postingDateConverted'] = convert_sap_date(invoice_data['postingDate'])
+        # Dates are normalized to UTC at index time; only older vectors need converting
+        for field, day_field in (('documentDate', 'documentDay'), ('postingDate', 'postingDay'),
+                                 ('lastChanged', None)):
+            value = invoice_data.get(field)
+            if isinstance(value, str) and value and not value.startswith('/Date('):
+                invoice_data[f'{field}Converted'] = value[:10]
+            elif day_field in invoice_data:
+                invoice_data[f'{field}Converted'] = epoch_day_to_date(invoice_data[day_field])
+            elif value:
+                invoice_data[f'{field}Converted'] = convert_sap_date(value)
         
-        if 'lastChanged' in invoice_data and invoice_data['lastChanged']:
-            invoice_data['lastChangedConverted'] = convert_sap_date(invoice_data['lastChanged'])
+        yield invoice_data
+
+
+def deduplicate_invoices(documents: Iterable[Any]) -> List[Dict[str, Any]]:
+    """
+    Deduplicate invoice documents by invoiceNumber + companyCode + fiscalYear
+    
+    Args:
+        documents: List of LangChain documents from retriever
         
-        unique_invoices[invoice_id] = invoice_data
+    Returns:
+        List of unique invoices with converted dates
+    """
+    return list(iter_unique_invoices(documents))
+
+
+def scan_invoices(batch_size: int = SCAN_BATCH_SIZE, **filters) -> Iterator[Dict[str, Any]]:
+    """
+    Stream every invoice in the vector store, deduplicated
     
-    return list(unique_invoices.values())
+    Pages through all vector IDs of the namespace/collection and fetches
+    their metadata in bulk, one batch at a time, so the whole corpus is
+    covered in memory bounded by the batch plus the set of invoice IDs
+    already yielded. No embedding or similarity search is involved.
+    
+    Args:
+        batch_size: Vectors listed and fetched per request
+        **filters: Metadata equality filters, e.g. companyCode='MF01', fiscalYear=2024;
+            None values are ignored
+        
+    Yields:
+        Unique invoices with converted dates, in storage order
+    """
+    filters = {field: str(value) for field, value in filters.items() if value is not None}
+    vectorstore = get_vectorstore()
+    seen = set()
+    for batch in vectorstore.backend.scan(batch_size):
+        docs = (vectorstore._to_document(metadata) for _, metadata in batch)
+        for invoice in iter_unique_invoices(docs, seen):
+            if all(str(invoice.get(field)) == value for field, value in filters.items()):
+                yield invoice
 
 
 def filter_by_date_range(invoices: List[Dict], start_date: str = None, end_date: str = None) -> List[Dict]:
@@ -154,65 +364,377 @@ def filter_by_date_range(invoices: List[Dict], start_date: str = None, end_date:
     return filtered
 
 
-# Custom tool that returns only summarized invoice data
-from langchain.tools import tool
+@lru_cache(maxsize=1)
+def _token_encoding():
+    """tiktoken encoding of the chat model, or None if it cannot be loaded (offline)"""
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model(CHAT_MODEL)
+    except Exception as e:
+        print(f"Warning: tiktoken encoding unavailable ({type(e).__name__}); estimating tokens from length")
+        return None
 
-@tool
-def search_invoice_documents(query: str) -> str:
-    """Search SAP invoice documents and return summarized results. Each invoice may appear as multiple chunks - automatically deduplicates by ID field. Use this to find invoices, count totals, or filter by criteria. Returns ALL matching invoices with full details."""
-    # Retrieve documents
-    docs = retriever.invoke(query)
+
+def count_tokens(text: str) -> int:
+    """Number of chat-model tokens in text"""
+    encoding = _token_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+class SearchStats:
+    """Tokens returned to the LLM by the search tools, and the k chosen by adaptive retrieval"""
     
-    # Deduplicate by ID
-    unique_invoices = deduplicate_invoices(docs)
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.tokens = 0
+        self.listed = 0
+        self.omitted = 0
+        self.retrievals = 0
+        self.retrieval_k = 0
+        self.retrieval_queries = 0
     
+    def record(self, tokens: int, listed: int, total: int):
+        with self._lock:
+            self.calls += 1
+            self.tokens += tokens
+            self.listed += listed
+            self.omitted += total - listed
+    
+    def record_retrieval(self, k: int, queries: int):
+        with self._lock:
+            self.retrievals += 1
+            self.retrieval_k += k
+            self.retrieval_queries += queries
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'tokens': self.tokens,
+                'avg_tokens': self.tokens / self.calls if self.calls else 0.0,
+                'invoices_listed': self.listed,
+                'invoices_omitted': self.omitted,
+                'token_budget': SEARCH_TOKEN_BUDGET,
+                'retrievals': self.retrievals,
+                'avg_k': self.retrieval_k / self.retrievals if self.retrievals else 0.0,
+                'avg_vector_queries': self.retrieval_queries / self.retrievals if self.retrievals else 0.0
+            }
+
+
+search_stats = SearchStats()
+
+
+# Custom tool that returns only summarized invoice data
+
+def _render_search_tool(unique_invoices: List[Dict[str, Any]]) -> str:
     if not unique_invoices:
         return "No invoices found matching your query."
     
-    # Analyze by fiscal year for date-based queries
-    invoices_by_year = {}
-    for inv in unique_invoices:
-        fy = inv.get('fiscalYear', 'Unknown')
-        doc_date = inv.get('documentDateConverted', '')
-        if fy not in invoices_by_year:
-            invoices_by_year[fy] = []
-        invoices_by_year[fy].append({'num': inv.get('invoiceNumber'), 'date': doc_date, 'company': inv.get('companyCode')})
-    
-    # Build result
-    result = f"TOTAL: {len(unique_invoices)} unique invoices found.\n\n"
-    
-    # Show breakdown by fiscal year
-    result += "Breakdown by Fiscal Year:\n"
-    for fy in sorted(invoices_by_year.keys()):
-        result += f"  FY{fy}: {len(invoices_by_year[fy])} invoices\n"
-    
-    # Show ALL invoices with details (condensed format)
-    result += f"\nComplete List of All {len(unique_invoices)} Invoices:\n"
-    for i, inv in enumerate(unique_invoices, 1):
-        doc_date = inv.get('documentDateConverted', inv.get('documentDate', 'N/A'))
-        post_date = inv.get('postingDateConverted', inv.get('postingDate', 'N/A'))
-        last_updated = inv.get('lastUpdated', 'N/A')
-        reference = inv.get('reference', 'N/A')
-        result += f"{i}. #{inv.get('invoiceNumber')} | {inv.get('companyCode')} | FY{inv.get('fiscalYear')} | DocDate:{doc_date} | PostDate:{post_date} | Amt:{inv.get('amount', 0)} {inv.get('currency', 'USD')} | Type:{inv.get('documentType', 'N/A')} | Ref:{reference} | Updated:{last_updated}\n"
-    
-    # Add summary stats
-    company_codes = {}
-    doc_types = {}
+    result, tokens, listed, _ = render_search_result(unique_invoices, SEARCH_TOKEN_BUDGET)
+    result += SEARCH_SCOPE_NOTE
+    search_stats.record(tokens, listed, len(unique_invoices))
+    print(f"[search_invoice_documents] {tokens} tokens, listed {listed} of {len(unique_invoices)} invoices "
+          f"(budget {SEARCH_TOKEN_BUDGET})")
+    return result
+
+
+def _search_invoice_documents(query: str) -> str:
+    # Hybrid lexical + semantic retrieval, deduplicated by ID (cached per normalized query)
+    unique_invoices = retrieval_cache.get_or_compute(
+        ('search', normalize_query(query)),
+        lambda: hybrid_search(query)
+    )
+    return _render_search_tool(unique_invoices)
+
+
+async def _asearch_invoice_documents(query: str) -> str:
+    unique_invoices = await retrieval_cache.aget_or_compute(
+        ('search', normalize_query(query)),
+        lambda: ahybrid_search(query)
+    )
+    return await asyncio.to_thread(_render_search_tool, unique_invoices)
+
+
+# Sync and async implementations, so ainvoke never blocks the event loop
+search_invoice_documents = StructuredTool.from_function(
+    func=_search_invoice_documents,
+    coroutine=_asearch_invoice_documents,
+    name="search_invoice_documents",
+    description="Search SAP invoice documents and return summarized results. Each invoice may appear as multiple chunks - automatically deduplicates by ID field. Use this to find invoices or filter by criteria. Invoice numbers and references in the query are matched exactly. Returns totals and breakdowns over the retrieved invoices (the best matches, not necessarily every match) plus the most relevant invoices with full details. For exact counts and sums over all invoices use scan_all_invoices."
+)
+
+
+@tool
+def scan_all_invoices(company_code: Optional[str] = None, fiscal_year: Optional[int] = None,
+                      document_type: Optional[str] = None) -> str:
+    """Scan EVERY invoice in the database (no search cutoff) and return exact totals, breakdowns and amount totals. Use this for questions about all invoices, the whole database or overall totals, optionally restricted to a company code, fiscal year or document type."""
+    filters = {'companyCode': company_code, 'fiscalYear': fiscal_year, 'documentType': document_type}
+    result, tokens, listed, total = retrieval_cache.get_or_compute(
+        ('scan', company_code, fiscal_year, document_type),
+        lambda: render_search_result(scan_invoices(**filters), SEARCH_TOKEN_BUDGET, ranked=False)
+    )
+    if not total:
+        return "No invoices found matching your query."
+    search_stats.record(tokens, listed, total)
+    print(f"[scan_all_invoices] scanned {total} invoices, {tokens} tokens")
+    return result
+
+
+def table_row_to_invoice(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape an invoice table row like a deduplicated retrieval result"""
+    invoice = with_converted_dates(dict(row))
+    invoice['ID'] = invoice['ID'][len('invoice_'):] if invoice['ID'].startswith('invoice_') else invoice['ID']
+    for field in ('documentDate', 'postingDate'):
+        if f'{field}Converted' in invoice:
+            invoice[field] = invoice[f'{field}Converted']
+    # Same layout as the indexed document text, without the free-text extras
+    invoice['text'] = INVOICE_TEXT_TEMPLATE.format(**{field: invoice.get(field, '') for field in INVOICE_TEXT_FIELDS})
+    return invoice
+
+
+def _adaptive_step(results: List[Tuple[Any, float]], k: int, target: int, max_k: int,
+                   min_score: float, score_drop: float) -> Tuple[List[Dict[str, Any]], bool]:
+    """Deduplicate one adaptive-k page; returns (unique invoices, whether to stop widening)"""
+    relevant = [doc for doc, score in results if score >= min_score]
+    unique_invoices = deduplicate_invoices(relevant)
+    # Narrow queries: relevance has already tailed off within this page
+    tailed_off = bool(results) and score_drop > 0 and results[-1][1] < results[0][1] - score_drop
+    done = (len(unique_invoices) >= target or len(results) < k or len(relevant) < len(results)
+            or tailed_off or k >= max_k)
+    return unique_invoices, done
+
+
+def _record_adaptive(k: int, queries: int, unique_invoices: List[Dict[str, Any]]):
+    search_stats.record_retrieval(k, queries)
+    print(f"[adaptive_retrieve] k={k} after {queries} queries: {len(unique_invoices)} unique invoices")
+
+
+def adaptive_retrieve(query: str, target: int = ADAPTIVE_TARGET_INVOICES,
+                      initial_k: int = ADAPTIVE_INITIAL_K, max_k: int = ADAPTIVE_MAX_K,
+                      min_score: float = ADAPTIVE_MIN_SCORE,
+                      score_drop: float = ADAPTIVE_SCORE_DROP) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Semantic retrieval that widens k until enough unique invoices are found
+    
+    Starts with initial_k chunks and doubles k while fewer than target
+    unique invoices come back. Widening stops early when the store has no
+    more chunks, when the lowest score of a page falls below min_score
+    (further chunks would only score lower), when it has fallen more than
+    score_drop below the best score (a narrow query whose matches are
+    already in hand) or at max_k. Chunks below min_score are dropped.
+    
+    Args:
+        query: Search query
+        target: Unique invoices wanted
+        initial_k: Chunks requested by the first query
+        max_k: Largest k tried
+        min_score: Cosine similarity cutoff
+        score_drop: Fall from the best score that ends widening (0 disables)
+        
+    Returns:
+        (deduplicated invoices best first, k settled on)
+    """
+    vectorstore = get_vectorstore()
+    query_vector = get_query_embeddings().embed_query(query)
+    k = max(1, min(initial_k, max_k))
+    queries = 0
+    while True:
+        results = vectorstore.similarity_search_by_vector_with_score(query_vector, k=k)
+        queries += 1
+        unique_invoices, done = _adaptive_step(results, k, target, max_k, min_score, score_drop)
+        if done:
+            break
+        k = min(k * 2, max_k)
+    _record_adaptive(k, queries, unique_invoices)
+    return unique_invoices, k
+
+
+async def aadaptive_retrieve(query: str, target: int = ADAPTIVE_TARGET_INVOICES,
+                             initial_k: int = ADAPTIVE_INITIAL_K, max_k: int = ADAPTIVE_MAX_K,
+                             min_score: float = ADAPTIVE_MIN_SCORE,
+                             score_drop: float = ADAPTIVE_SCORE_DROP) -> Tuple[List[Dict[str, Any]], int]:
+    """Async adaptive_retrieve: awaits the query embedding and vector queries"""
+    vectorstore = get_vectorstore()
+    query_vector = await get_query_embeddings().aembed_query(query)
+    k = max(1, min(initial_k, max_k))
+    queries = 0
+    while True:
+        results = await vectorstore.asimilarity_search_by_vector_with_score(query_vector, k=k)
+        queries += 1
+        unique_invoices, done = _adaptive_step(results, k, target, max_k, min_score, score_drop)
+        if done:
+            break
+        k = min(k * 2, max_k)
+    _record_adaptive(k, queries, unique_invoices)
+    return unique_invoices, k
+
+
+def _exact_matches(query: str) -> Tuple[List[str], Dict[str, Dict[str, Any]], bool]:
+    """
+    Resolve invoice numbers and references in the query against the invoice table
+    
+    Returns:
+        (matched invoice IDs, their table rows, whether the query is nothing but those IDs)
+    """
+    id_tokens = ID_TOKEN_PATTERN.findall(query)
+    record_store = get_record_store()
+    exact_ids = record_store.exact_lookup(id_tokens) if id_tokens else []
+    exact_rows = record_store.get_rows(exact_ids)
+    
+    # Pure ID queries: every word is either a matched number/reference or filler
+    matched = {str(row.get(field, '')).lower() for row in exact_rows.values()
+               for field in ('invoiceNumber', 'reference')}
+    words = {word.lower() for word in re.findall(r'[\w-]+', query)} - matched
+    return exact_ids, exact_rows, bool(exact_rows) and words <= ID_QUERY_FILLER
+
+
+def _fuse_results(semantic: List[Dict[str, Any]], lexical: List[Tuple[str, float]],
+                  exact_ids: List[str], exact_rows: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Reciprocal rank fusion of semantic and lexical hits, exact matches first"""
+    if not lexical and not exact_ids:
+        return semantic
+    
+    # Keys are the composite IDs used by the invoice table
+    scores = defaultdict(float)
+    invoices = {}
+    for rank, inv in enumerate(semantic):
+        key = f"invoice_{inv['ID']}"
+        invoices[key] = inv
+        scores[key] += 1 / (RRF_K + rank + 1)
+    for rank, (invoice_id, _) in enumerate(lexical):
+        scores[invoice_id] += 1 / (RRF_K + rank + 1)
+    for invoice_id in exact_ids:
+        scores[invoice_id] += 1.0
+    
+    missing = [invoice_id for invoice_id in scores if invoice_id not in invoices]
+    for invoice_id, row in {**exact_rows, **get_record_store().get_rows(missing)}.items():
+        invoices[invoice_id] = table_row_to_invoice(row)
+    
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [invoices[invoice_id] for invoice_id in ranked if invoice_id in invoices]
+
+
+def hybrid_search(query: str) -> List[Dict[str, Any]]:
+    """
+    Semantic retrieval fused with the local lexical index
+    
+    Invoice numbers and references in the query are resolved by an exact
+    index lookup; if the query is nothing but such IDs, no embedding or
+    vector query is made. Otherwise adaptive-k semantic results and BM25
+    results are combined with reciprocal rank fusion, with exact matches
+    ranked first.
+    
+    Args:
+        query: Search query
+        
+    Returns:
+        Deduplicated invoices, best first
+    """
+    exact_ids, exact_rows, id_only = _exact_matches(query)
+    if id_only:
+        return [table_row_to_invoice(exact_rows[invoice_id]) for invoice_id in exact_ids if invoice_id in exact_rows]
+    
+    semantic, _ = adaptive_retrieve(query)
+    lexical = get_record_store().lexical_search(query, LEXICAL_K, LEXICAL_MIN_SCORE)
+    return _fuse_results(semantic, lexical, exact_ids, exact_rows)
+
+
+async def ahybrid_search(query: str) -> List[Dict[str, Any]]:
+    """
+    Async hybrid_search
+    
+    The semantic retrieval is awaited while the SQLite lexical search runs
+    in a worker thread, so both proceed concurrently.
+    """
+    exact_ids, exact_rows, id_only = await asyncio.to_thread(_exact_matches, query)
+    if id_only:
+        return [table_row_to_invoice(exact_rows[invoice_id]) for invoice_id in exact_ids if invoice_id in exact_rows]
+    
+    (semantic, _), lexical = await asyncio.gather(
+        aadaptive_retrieve(query),
+        asyncio.to_thread(get_record_store().lexical_search, query, LEXICAL_K, LEXICAL_MIN_SCORE)
+    )
+    return await asyncio.to_thread(_fuse_results, semantic, lexical, exact_ids, exact_rows)
+
+
+def render_search_result(unique_invoices: Iterable[Dict[str, Any]], token_budget: int,
+                         ranked: bool = True) -> Tuple[str, int, int, int]:
+    """
+    Render tool output: exact aggregates plus as many listed invoices as fit the budget
+    
+    The invoices are consumed in a single pass, keeping only the candidate
+    lines that could fit the budget, so a full-corpus scan can be rendered
+    without materializing it.
+    
+    Args:
+        unique_invoices: Deduplicated invoices in relevance order (any iterable)
+        token_budget: Maximum tokens of the returned text
+        ranked: False for invoices in storage order (a scan), which are
+            listed as "First N" rather than "Top N ... by Relevance"
+        
+    Returns:
+        (text, tokens used, number of invoices listed, number of invoices)
+    """
+    # Aggregates over every matching invoice, always included
+    invoices_by_year = defaultdict(int)
+    company_codes = defaultdict(int)
+    doc_types = defaultdict(int)
+    amounts = defaultdict(float)
+    total = 0
+    candidates = []
+    candidate_tokens = 0
     for inv in unique_invoices:
-        cc = inv.get('companyCode', 'N/A')
-        dt = inv.get('documentType', 'N/A')
-        company_codes[cc] = company_codes.get(cc, 0) + 1
-        doc_types[dt] = doc_types.get(dt, 0) + 1
+        total += 1
+        invoices_by_year[str(inv.get('fiscalYear', 'Unknown'))] += 1
+        company_codes[str(inv.get('companyCode', 'N/A'))] += 1
+        doc_types[str(inv.get('documentType', 'N/A'))] += 1
+        try:
+            amounts[inv.get('currency', 'USD')] += float(inv.get('amount', 0) or 0)
+        except (TypeError, ValueError):
+            pass
+        if candidate_tokens <= token_budget:
+            line = f"{total}. {format_invoice_line(inv)}\n"
+            line_tokens = count_tokens(line)
+            candidates.append((line, line_tokens))
+            candidate_tokens += line_tokens
     
-    result += f"\n\nCompany Breakdown: "
-    result += ", ".join([f"{cc}({count})" for cc, count in sorted(company_codes.items())])
-    result += f"\nDocument Type Breakdown: "
-    result += ", ".join([f"{dt}({count})" for dt, count in sorted(doc_types.items())])
+    header = f"TOTAL: {total} unique invoices found.\n\n"
+    header += "Breakdown by Fiscal Year:\n"
+    for fy in sorted(invoices_by_year):
+        header += f"  FY{fy}: {invoices_by_year[fy]} invoices\n"
+    header += "Company Breakdown: "
+    header += ", ".join(f"{cc}({count})" for cc, count in sorted(company_codes.items()))
+    header += "\nDocument Type Breakdown: "
+    header += ", ".join(f"{dt}({count})" for dt, count in sorted(doc_types.items()))
+    header += "\nAmount Totals: "
+    header += ", ".join(f"{amount:.2f} {currency}" for currency, amount in sorted(amounts.items()))
+    header += "\n"
     
-    return result
+    # Listed sample: invoices in input order (most relevant first for searches), until the budget is spent
+    tokens = count_tokens(header) + SEARCH_TOKEN_RESERVE
+    lines = []
+    for line, line_tokens in candidates:
+        if tokens + line_tokens > token_budget:
+            break
+        lines.append(line)
+        tokens += line_tokens
+    
+    omitted = total - len(lines)
+    if omitted:
+        heading = (f"Top {len(lines)} of {total} Invoices by Relevance" if ranked
+                   else f"First {len(lines)} of {total} Invoices (storage order, not ranked)")
+        result = header + f"\n{heading}:\n" + "".join(lines)
+        result += (f"\nOMITTED: {omitted} of {total} invoices are not listed (token budget). "
+                   f"The totals and breakdowns above cover all {total}.")
+    else:
+        result = header + f"\nComplete List of All {total} Invoices:\n" + "".join(lines)
+    return result, count_tokens(result), len(lines), total
 
 # System prompt
-system_prompt = """You are an AI assistant that helps users query SAP invoice data from a Pinecone vector database.
+system_prompt = """You are an AI assistant that helps users query SAP invoice data from a vector database.
 
 CRITICAL RULES:
 
@@ -223,9 +745,9 @@ CRITICAL RULES:
    - Example: If asked "invoices with company code ZSYK" and breakdown shows "ZSYK(5)" → Answer is "5 invoices"
    - NEVER use the TOTAL count when user asks for filtered results
 
-2. READING THE COMPLETE LIST:
-   - The tool returns "Complete List of All X Invoices" - this shows ALL invoices found
-   - Count invoices matching the user's criteria from the complete list OR use the breakdown section
+2. READING THE INVOICE LIST:
+   - The tools return either "Complete List of All X Invoices" or, for large results, a sample: "Top N of X Invoices by Relevance" from search_invoice_documents, or "First N of X Invoices" from scan_all_invoices, which is in storage order and says nothing about relevance
+   - When an OMITTED line is present the list is only a sample - take counts and totals from the TOTAL, breakdown and Amount Totals sections, never by counting list rows
    - Breakdown format: CompanyCode(count) - use this count for accuracy
 
 3. DATE HANDLING:
@@ -235,60 +757,234 @@ CRITICAL RULES:
 
 4. WORKFLOW:
    - Use search_invoice_documents tool for ANY query
+   - Use scan_all_invoices instead when the question is about ALL invoices or overall totals - search results only cover the best matches
    - Read the breakdown sections carefully
    - When filtering, use breakdown counts or manually count from complete list
    - Provide accurate counts based on user's specific criteria
 
 Never hallucinate data. Always use the breakdown sections for accurate filtered counts."""
 
-# Create prompt template
-prompt = ChatPromptTemplate.from_messages([
-    ("system", system_prompt),
-    MessagesPlaceholder(variable_name="chat_history", optional=True),
-    ("human", "{input}"),
-    MessagesPlaceholder(variable_name="agent_scratchpad"),
-])
-
-# Initialize LLM
-llm = ChatOpenAI(
-    model="gpt-4o-mini",
-    temperature=0.3,
-    api_key=OPENAI_API_KEY
-)
+@component('llm')
+def get_llm():
+    """Chat model used by the agent and for session summaries"""
+    from langchain_openai import ChatOpenAI
+    
+    return ChatOpenAI(
+        model=CHAT_MODEL,
+        temperature=0.3,
+        api_key=OPENAI_API_KEY
+    )
 
-# Create agent
-agent = create_openai_tools_agent(llm, [search_invoice_documents], prompt)
 
-# Create agent executor
-agent_executor = AgentExecutor(
-    agent=agent,
-    tools=[search_invoice_documents],
-    verbose=False,  # Disable verbose output
-    handle_parsing_errors=True,
-    max_iterations=5
-)
+@component('agent_with_chat_history')
+def get_agent():
+    """Tool-calling agent wrapped with per-session message history"""
+    from langchain.agents import AgentExecutor, create_openai_tools_agent
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain_core.runnables.history import RunnableWithMessageHistory
+    
+    # Create prompt template
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", system_prompt),
+        MessagesPlaceholder(variable_name="chat_history", optional=True),
+        ("human", "{input}"),
+        MessagesPlaceholder(variable_name="agent_scratchpad"),
+    ])
+    
+    # Create agent
+    tools = [search_invoice_documents, scan_all_invoices]
+    agent = create_openai_tools_agent(get_llm(), tools, prompt)
+    
+    # Create agent executor
+    agent_executor = AgentExecutor(
+        agent=agent,
+        tools=tools,
+        verbose=False,  # Disable verbose output
+        handle_parsing_errors=True,
+        max_iterations=5
+    )
+    
+    # Wrap agent with message history
+    return RunnableWithMessageHistory(
+        agent_executor,
+        get_session_history,
+        input_messages_key="input",
+        history_messages_key="chat_history",
+    )
+
 
 # Chat history management
-store = {}
+SUMMARY_PROMPT = """Summarize this conversation between a user and an SAP invoice assistant in at most 120 words.
+Keep invoice numbers, company codes, fiscal years, dates, counts and amounts exactly as written.
+
+Earlier summary:
+{summary}
+
+Conversation:
+{conversation}"""
+
+
+def summarize_history(summary: str, messages: List[Any]) -> str:
+    """
+    Fold old turns into the running session summary
+    
+    Args:
+        summary: Summary so far ('' for none)
+        messages: Turns leaving the history window, oldest first
+        
+    Returns:
+        Updated summary
+    """
+    conversation = "\n".join(
+        f"{'User' if isinstance(message, HumanMessage) else 'Assistant'}: {message.content}"
+        for message in messages
+    )
+    response = get_llm().invoke(SUMMARY_PROMPT.format(summary=summary or "(none)", conversation=conversation))
+    return response.content
+
+
+@component('session_store')
+def get_session_store():
+    """Chat sessions, persisted in SQLite (shared by API workers) and bounded by count, age and tokens"""
+    from session_store import SessionStore
+    
+    return SessionStore(summarize=summarize_history, token_counter=count_tokens)
+
 
 def get_session_history(session_id: str):
-    if session_id not in store:
-        store[session_id] = ChatMessageHistory()
-    return store[session_id]
-
-# Wrap agent with message history
-agent_with_chat_history = RunnableWithMessageHistory(
-    agent_executor,
-    get_session_history,
-    input_messages_key="input",
-    history_messages_key="chat_history",
-)
+    return get_session_store().get(session_id)
+
+
+# Routing decisions (fast path vs agent) for measuring the hit rate
+router_stats = RouterStats()
+
+
+def format_invoice_line(inv: Dict[str, Any]) -> str:
+    """One-line summary of an invoice for answers and tool output"""
+    doc_date = inv.get('documentDateConverted', inv.get('documentDate', 'N/A'))
+    post_date = inv.get('postingDateConverted', inv.get('postingDate', 'N/A'))
+    return (f"#{inv.get('invoiceNumber')} | {inv.get('companyCode')} | FY{inv.get('fiscalYear')} | "
+            f"DocDate:{doc_date} | PostDate:{post_date} | Amt:{inv.get('amount', 0)} {inv.get('currency', 'USD')} | "
+            f"Type:{inv.get('documentType', 'N/A')} | Ref:{inv.get('reference', 'N/A')}")
+
+
+def describe_filters(filters: Dict[str, Any]) -> str:
+    """Human-readable filter description, e.g. ' with company code MF01 and fiscal year 2024'"""
+    parts = [f"{FIELD_LABELS[field]} {value}" for field, value in filters.items() if value is not None]
+    return f" with {' and '.join(parts)}" if parts else ""
+
+
+def answer_from_structured_data(route: Dict[str, Any]) -> str:
+    """
+    Answer a routed question from the invoice table
+    
+    Args:
+        route: Route dictionary from classify_query
+        
+    Returns:
+        Answer text
+    """
+    intent = route['intent']
+    record_store = get_record_store()
+    
+    if intent == 'lookup':
+        lines = []
+        for number in route['invoice_numbers']:
+            matches = record_store.find_invoices({'invoiceNumber': number})
+            if not matches:
+                lines.append(f"Invoice {number} was not found.")
+            for inv in matches:
+                lines.append(format_invoice_line(with_converted_dates(inv)))
+        return "\n".join(lines)
+    
+    filters = route['filters']
+    if intent == 'breakdown':
+        by = route['by']
+        breakdown = record_store.breakdown(by, filters)
+        lines = [f"Invoices by {FIELD_LABELS[by]}{describe_filters(filters)}:"]
+        lines += [f"- {value}: {count}" for value, count in breakdown.items()]
+        lines.append(f"Total: {sum(breakdown.values())} invoices")
+        return "\n".join(lines)
+    
+    count = record_store.count_invoices(filters)
+    answer = f"There {'is' if count == 1 else 'are'} {count} invoice{'' if count == 1 else 's'}{describe_filters(filters)}."
+    if intent == 'list' and count:
+        invoices = record_store.find_invoices(filters, limit=FAST_PATH_LIST_LIMIT)
+        answer += "\n" + "\n".join(
+            f"{i}. {format_invoice_line(with_converted_dates(inv))}" for i, inv in enumerate(invoices, 1)
+        )
+        if count > len(invoices):
+            answer += f"\n...and {count - len(invoices)} more."
+    return answer
+
+
+def route_query(question: str) -> Optional[Dict[str, Any]]:
+    """
+    Classify a question for the fast path, or None if it needs the agent
+    
+    Only used when the indexed invoice table is available, since its
+    answers must be exact.
+    """
+    record_store = get_record_store()
+    if not record_store.has_invoices():
+        return None
+    company_codes = retrieval_cache.get_or_compute(
+        ('company_codes',), lambda: [str(code) for code in record_store.breakdown('companyCode') if code]
+    )
+    return classify_query(question, company_codes)
+
+
+def fast_path_answer(question: str) -> Optional[Dict[str, Any]]:
+    """
+    Session-independent fast-path answer from the invoice table
+    
+    Args:
+        question: User's question about invoices
+        
+    Returns:
+        Dict with route, answer and elapsed_ms, or None if the router
+        does not accept the question
+    """
+    started = time.perf_counter()
+    route = route_query(question)
+    if route is None:
+        return None
+    answer = answer_from_structured_data(route)
+    return {'route': route, 'answer': answer, 'elapsed_ms': (time.perf_counter() - started) * 1000}
+
+
+def record_fast_path_turn(question: str, session_id: str, result: Dict[str, Any]) -> str:
+    """Add a fast-path answer to the session history and router stats; returns the answer"""
+    # Keep the conversation complete for follow-up questions to the agent
+    history = get_session_history(session_id)
+    history.add_user_message(question)
+    history.add_ai_message(result['answer'])
+    router_stats.record(result['route']['intent'], result['elapsed_ms'])
+    print(f"[router] fast path: {result['route']} ({result['elapsed_ms']:.1f} ms)")
+    return result['answer']
+
+
+def _fast_path_answer(question: str, session_id: str) -> Optional[str]:
+    """Answer from the invoice table if the router accepts the question, else None"""
+    result = fast_path_answer(question)
+    if result is None:
+        return None
+    return record_fast_path_turn(question, session_id, result)
+
+
+def _record_agent_call(started: float):
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    router_stats.record('agent', elapsed_ms)
+    print(f"[router] agent ({elapsed_ms:.0f} ms)")
 
 
 def query_invoices(question: str, session_id: str = "default") -> str:
     """
     Query the SAP invoice system
     
+    Count, breakdown, filter and invoice-number questions are answered
+    directly from the invoice table; everything else goes to the agent.
+    
     Args:
         question: User's question about invoices
         session_id: Session ID for chat history
@@ -296,51 +992,657 @@ def query_invoices(question: str, session_id: str = "default") -> str:
     Returns:
         AI's response
     """
-    response = agent_with_chat_history.invoke(
+    started = time.perf_counter()
+    answer = _fast_path_answer(question, session_id)
+    if answer is not None:
+        return answer
+    
+    response = get_agent().invoke(
         {"input": question},
         config={"configurable": {"session_id": session_id}}
     )
+    _record_agent_call(started)
+    return response["output"]
+
+
+async def aquery_invoices(question: str, session_id: str = "default", fast_path: bool = True) -> str:
+    """
+    Async query_invoices for use inside an event loop
+    
+    The LLM, query embedding and vector queries are awaited; SQLite work
+    (fast path, lexical search) and synchronous tools run in worker threads.
+    
+    Args:
+        question: User's question about invoices
+        session_id: Session ID for chat history
+        fast_path: Try the router first; False when the caller already did
+        
+    Returns:
+        AI's response
+    """
+    started = time.perf_counter()
+    if fast_path:
+        answer = await asyncio.to_thread(_fast_path_answer, question, session_id)
+        if answer is not None:
+            return answer
     
+    response = await get_agent().ainvoke(
+        {"input": question},
+        config={"configurable": {"session_id": session_id}}
+    )
+    _record_agent_call(started)
     return response["output"]
 
 
-def get_invoice_count() -> int:
+async def astream_query_invoices(question: str, session_id: str = "default") -> AsyncIterator[Dict[str, Any]]:
+    """
+    Stream the answer to a question as progress events
+    
+    Fast-path answers arrive as a single token event. Agent answers emit
+    tool_start/tool_end around each tool call and token events as the LLM
+    generates the final answer.
+    
+    Args:
+        question: User's question about invoices
+        session_id: Session ID for chat history
+        
+    Yields:
+        {'event': 'tool_start' | 'tool_end' | 'token' | 'done', 'data': {...}};
+        'done' carries the complete answer
+    """
+    started = time.perf_counter()
+    answer = await asyncio.to_thread(_fast_path_answer, question, session_id)
+    if answer is not None:
+        yield {'event': 'token', 'data': {'text': answer}}
+        yield {'event': 'done', 'data': {'answer': answer, 'session_id': session_id}}
+        return
+    
+    answer = ""
+    async for event in get_agent().astream_events(
+        {"input": question},
+        config={"configurable": {"session_id": session_id}},
+        version="v2"
+    ):
+        kind = event['event']
+        if kind == 'on_tool_start':
+            yield {'event': 'tool_start', 'data': {'tool': event['name'], 'input': event['data'].get('input')}}
+        elif kind == 'on_tool_end':
+            output = str(getattr(event['data'].get('output'), 'content', event['data'].get('output')))
+            yield {'event': 'tool_end', 'data': {'tool': event['name'], 'summary': output.split("\n", 1)[0]}}
+        elif kind == 'on_chat_model_stream':
+            # Tool-calling turns stream empty content; only answer text is forwarded
+            text = event['data']['chunk'].content
+            if text:
+                yield {'event': 'token', 'data': {'text': text}}
+        elif kind == 'on_chain_end' and not event.get('parent_ids'):
+            answer = event['data']['output']['output']
+    
+    _record_agent_call(started)
+    yield {'event': 'done', 'data': {'answer': answer, 'session_id': session_id}}
+
+
+async def abatch_query_invoices(questions: List[str], fanout: int = BATCH_FANOUT) -> Dict[str, Any]:
+    """
+    Answer many independent questions in one call
+    
+    Questions that are identical after normalization are answered once.
+    Fast-path questions are answered from the invoice table. The rest are
+    embedded in one batched call and their hybrid retrievals run
+    concurrently (at most fanout at a time). The agent then answers them
+    with the same fan-out, each given its retrieval result up front, so it
+    only calls a tool when that result does not answer the question. Each
+    agent question gets its own throwaway session, so no question sees
+    another's history.
+    
+    Args:
+        questions: User questions about invoices
+        fanout: Maximum questions retrieved or answered concurrently
+        
+    Returns:
+        {'results': one {'question', 'answer', 'route', 'elapsed_ms'}
+        (or 'error' instead of 'answer') per question in order,
+        'timings': batch phase durations in ms, 'unique_questions': n}
+    """
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(max(1, fanout))
+    timings = {}
+    
+    # One entry per distinct question, in order of first appearance
+    unique = {}
+    for question in questions:
+        unique.setdefault(normalize_query(question), question)
+    answers: Dict[str, Dict[str, Any]] = {}
+    
+    async def fast_path(key: str, question: str):
+        async with semaphore:
+            result = await asyncio.to_thread(fast_path_answer, question)
+        if result is not None:
+            router_stats.record(result['route']['intent'], result['elapsed_ms'])
+            answers[key] = {'answer': result['answer'], 'route': result['route']['intent'],
+                            'elapsed_ms': round(result['elapsed_ms'], 1)}
+    
+    phase = time.perf_counter()
+    await asyncio.gather(*(fast_path(key, question) for key, question in unique.items()))
+    timings['fast_path_ms'] = round((time.perf_counter() - phase) * 1000, 1)
+    pending = {key: question for key, question in unique.items() if key not in answers}
+    
+    if pending:
+        # Shared retrieval: one embedding request, then concurrent vector searches
+        phase = time.perf_counter()
+        await get_query_embeddings().aembed_queries(list(pending.values()))
+        timings['embedding_ms'] = round((time.perf_counter() - phase) * 1000, 1)
+        
+        async def prefetch(key: str, question: str):
+            async with semaphore:
+                try:
+                    invoices = await retrieval_cache.aget_or_compute(
+                        ('search', normalize_query(question)),
+                        lambda: ahybrid_search(question)
+                    )
+                    context[key] = await asyncio.to_thread(_render_search_tool, invoices)
+                except Exception as e:
+                    # The agent can still search for itself
+                    print(f"[batch] retrieval failed for {question!r}: {type(e).__name__}: {e}")
+        
+        context: Dict[str, str] = {}
+        phase = time.perf_counter()
+        await asyncio.gather(*(prefetch(key, question) for key, question in pending.items()))
+        timings['retrieval_ms'] = round((time.perf_counter() - phase) * 1000, 1)
+        
+        agent = get_agent()
+        batch_id = uuid.uuid4().hex
+        
+        async def answer(index: int, key: str, question: str):
+            session_id = f"batch-{batch_id}-{index}"
+            async with semaphore:
+                question_started = time.perf_counter()
+                try:
+                    agent_input = question
+                    if key in context:
+                        agent_input = BATCH_CONTEXT_TEMPLATE.format(question=question, results=context[key])
+                    response = await agent.ainvoke(
+                        {"input": agent_input},
+                        config={"configurable": {"session_id": session_id}}
+                    )
+                    answers[key] = {'answer': response["output"], 'route': 'agent'}
+                    _record_agent_call(question_started)
+                except Exception as e:
+                    answers[key] = {'error': f"{type(e).__name__}: {e}", 'route': 'agent'}
+                finally:
+                    await asyncio.to_thread(clear_session, session_id)
+                answers[key]['elapsed_ms'] = round((time.perf_counter() - question_started) * 1000, 1)
+        
+        phase = time.perf_counter()
+        await asyncio.gather(*(answer(index, key, question)
+                               for index, (key, question) in enumerate(pending.items())))
+        timings['agent_ms'] = round((time.perf_counter() - phase) * 1000, 1)
+    
+    timings['total_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    print(f"[batch] {len(questions)} questions ({len(unique)} unique, {len(pending)} to the agent) "
+          f"in {timings['total_ms']:.0f} ms")
+    return {
+        'results': [{'question': question, **answers[normalize_query(question)]} for question in questions],
+        'unique_questions': len(unique),
+        'timings': timings
+    }
+
+
+def date_to_epoch_day(date_str: str) -> int:
+    """
+    Convert a YYYY-MM-DD date to days since 1970-01-01
+    
+    Args:
+        date_str: Date string in YYYY-MM-DD format
+        
+    Returns:
+        Epoch day number, as stored in documentDay/postingDay
+    """
+    return (datetime.strptime(date_str, '%Y-%m-%d').date() - EPOCH_DATE).days
+
+
+def with_converted_dates(invoice: Dict[str, Any]) -> Dict[str, Any]:
+    """Add YYYY-MM-DD documentDateConverted/postingDateConverted to an invoice table row"""
+    if 'documentDay' in invoice:
+        invoice['documentDateConverted'] = epoch_day_to_date(invoice['documentDay'])
+    if 'postingDay' in invoice:
+        invoice['postingDateConverted'] = epoch_day_to_date(invoice['postingDay'])
+    return invoice
+
+
+def get_invoice_count(company_code: Optional[str] = None, fiscal_year: Optional[int] = None,
+                      document_type: Optional[str] = None) -> int:
     """
     Get total count of unique invoices in the database
     
+    Answered exactly from the indexed invoice table. Indexes built outside
+    sap_invoice_indexer.py (e.g. by n8n) have no table, so the count falls
+    back to a full scan of the vector store.
+    
+    Args:
+        company_code: Only count invoices of this company code
+        fiscal_year: Only count invoices of this fiscal year
+        document_type: Only count invoices of this document type
+        
     Returns:
         Number of unique invoices
     """
-    # Query for all invoices
-    docs = retriever.invoke("invoice document financial")
+    filters = {'companyCode': company_code, 'fiscalYear': fiscal_year, 'documentType': document_type}
+    return retrieval_cache.get_or_compute(
+        ('count', company_code, fiscal_year, document_type),
+        lambda: _count_invoices(filters)
+    )
+
+
+def _count_invoices(filters: Dict[str, Any]) -> int:
+    record_store = get_record_store()
+    if record_store.has_invoices():
+        return record_store.count_invoices(filters)
     
-    # Deduplicate
-    unique_invoices = deduplicate_invoices(docs)
+    # Stream every vector once; only invoice IDs are kept
+    return sum(1 for _ in scan_invoices(**filters))
+
+
+def get_invoice_breakdown(by: str = 'companyCode', start_date: Optional[str] = None,
+                          end_date: Optional[str] = None, **filters) -> Dict[Any, int]:
+    """
+    Get exact invoice counts grouped by one field
     
-    return len(unique_invoices)
+    Args:
+        by: companyCode, fiscalYear, documentType, currency or businessArea
+        start_date: Optional start of the document date range (YYYY-MM-DD)
+        end_date: Optional end of the document date range (YYYY-MM-DD)
+        **filters: Equality filters on the same fields, e.g. fiscalYear=2024
+        
+    Returns:
+        Dictionary of field value -> invoice count
+    """
+    return get_record_store().breakdown(
+        by,
+        filters,
+        start_day=date_to_epoch_day(start_date) if start_date else None,
+        end_day=date_to_epoch_day(end_date) if end_date else None
+    )
 
 
-def get_invoices_by_date_range(start_date: str, end_date: str) -> List[Dict]:
+def build_metadata_filter(start_day: Optional[int] = None, end_day: Optional[int] = None,
+                          company_code: Optional[str] = None,
+                          fiscal_year: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Build a vector-store metadata filter (Pinecone syntax, supported by all backends)
+    
+    Args:
+        start_day: First document day (days since 1970-01-01), inclusive
+        end_day: Last document day, inclusive
+        company_code: Company code to match
+        fiscal_year: Fiscal year to match
+        
+    Returns:
+        Filter dictionary for BackendVectorStore queries
+    """
+    metadata_filter = {}
+    day_range = {}
+    if start_day is not None:
+        day_range['$gte'] = start_day
+    if end_day is not None:
+        day_range['$lte'] = end_day
+    if day_range:
+        metadata_filter['documentDay'] = day_range
+    if company_code:
+        metadata_filter['companyCode'] = {'$eq': company_code}
+    if fiscal_year is not None:
+        metadata_filter['fiscalYear'] = {'$eq': int(fiscal_year)}
+    return metadata_filter
+
+
+def iter_filtered_documents(start_day: int, end_day: int, page_size: int = FILTER_PAGE_SIZE,
+                            **filters) -> Iterator[Any]:
+    """
+    Page through every chunk whose documentDay lies in a range, in date order
+    
+    Vector stores have no offset paging, so the date range itself is paged:
+    each window is one filtered query of up to page_size chunks, and a window
+    that comes back full is split in half and queried again. The store does
+    all of the selection; nothing outside the predicates is fetched.
+    
+    Args:
+        start_day: First document day, inclusive
+        end_day: Last document day, inclusive
+        page_size: Chunks requested per query
+        **filters: company_code / fiscal_year, as for build_metadata_filter
+        
+    Yields:
+        LangChain documents matching the predicates
+    """
+    for docs in iter_filtered_windows(start_day, end_day, page_size, **filters):
+        yield from docs
+
+
+def iter_filtered_windows(start_day: int, end_day: int, page_size: int = FILTER_PAGE_SIZE,
+                          **filters) -> Iterator[List[Any]]:
+    """
+    The chunks of iter_filtered_documents grouped by day window
+    
+    Windows are disjoint, ascending day ranges, so every chunk of an
+    invoice (they share its document day) is in the same window.
+    
+    Yields:
+        All matching chunks of one window, in no particular order
+    """
+    vectorstore = get_vectorstore()
+    query_vector = get_query_embeddings().embed_query(FILTER_QUERY)
+    max_k = vectorstore.backend.max_query_k
+    if max_k:
+        page_size = min(page_size, max_k)
+    windows = [(start_day, end_day)]
+    while windows:
+        low, high = windows.pop()
+        metadata_filter = build_metadata_filter(low, high, **filters)
+        if low == high:
+            yield list(_iter_single_day(vectorstore, query_vector, metadata_filter, max_k))
+            continue
+        docs = vectorstore.similarity_search_by_vector(query_vector, k=page_size, filter=metadata_filter)
+        if len(docs) >= page_size:
+            middle = (low + high) // 2
+            windows.append((middle + 1, high))
+            windows.append((low, middle))
+            continue
+        yield docs
+
+
+def invoice_sort_key(invoice: Dict[str, Any]) -> Tuple[Optional[int], str]:
+    """(documentDay, ID): the order of date-range results and the key of their page cursors"""
+    return invoice.get('documentDay'), str(invoice.get('ID', ''))
+
+
+def iter_invoices_by_day(start_day: int, end_day: int, after: Optional[Tuple[Optional[int], str]] = None,
+                         **filters) -> Iterator[Dict[str, Any]]:
+    """
+    Unique invoices of a date range from the vector store, in (documentDay, ID) order
+    
+    Each window of iter_filtered_windows is deduplicated and sorted on its
+    own, so memory is bounded by one window, and resuming after a cursor
+    key only queries the days from the cursor's day on.
+    
+    Args:
+        start_day: First document day, inclusive
+        end_day: Last document day, inclusive
+        after: Sort key to resume after (exclusive), as in a page cursor
+        **filters: company_code / fiscal_year, as for build_metadata_filter
+        
+    Yields:
+        Unique invoices with converted dates
+    """
+    if after is not None:
+        if after[0] is None:
+            raise StaleCursorError("Cursor has no document day; restart from the first page")
+        start_day = max(start_day, after[0])
+    for docs in iter_filtered_windows(start_day, end_day, **filters):
+        for invoice in sorted(deduplicate_invoices(docs), key=invoice_sort_key):
+            if after is None or invoice_sort_key(invoice) > after:
+                yield invoice
+
+
+def _iter_single_day(vectorstore, query_vector: List[float], metadata_filter: Dict[str, Any],
+                     max_k: Optional[int]) -> Iterator[Any]:
+    """
+    Page through the chunks of one document day
+    
+    A day cannot be split further, so each following query excludes the
+    invoices already returned (by their ID metadata) until a page comes
+    back short.
+    """
+    k = min(MAX_FILTER_PAGE_SIZE, max_k) if max_k else MAX_FILTER_PAGE_SIZE
+    seen = set()
+    while True:
+        page_filter = dict(metadata_filter, ID={'$nin': sorted(seen)}) if seen else metadata_filter
+        docs = vectorstore.similarity_search_by_vector(query_vector, k=k, filter=page_filter)
+        yield from docs
+        if len(docs) < k:
+            return
+        new_ids = {doc.metadata.get('ID') for doc in docs} - seen - {None}
+        if not new_ids:
+            # Chunks without ID metadata cannot be paged any further
+            return
+        seen |= new_ids
+
+
+def has_day_metadata() -> bool:
+    """
+    True if the vectors carry epoch-day (documentDay) metadata
+    
+    One filtered query of k=1, cached until the index version changes, so
+    an empty date range is not mistaken for vectors indexed without it
+    (e.g. by n8n), which need a scan.
+    """
+    def probe():
+        vectorstore = get_vectorstore()
+        query_vector = get_query_embeddings().embed_query(FILTER_QUERY)
+        docs = vectorstore.similarity_search_by_vector(
+            query_vector, k=1, filter={'documentDay': {'$gte': -EPOCH_DAY_RANGE, '$lte': EPOCH_DAY_RANGE}}
+        )
+        return bool(docs)
+    return retrieval_cache.get_or_compute(('has_day_metadata',), probe)
+
+def get_invoices_by_date_range(start_date: str, end_date: str, company_code: Optional[str] = None,
+                               fiscal_year: Optional[int] = None) -> List[Dict]:
     """
     Get invoices within a date range
     
+    Answered from the indexed invoice table when present, otherwise by
+    pushing the predicates down into the vector store as metadata filters.
+    
     Args:
         start_date: Start date in YYYY-MM-DD format
         end_date: End date in YYYY-MM-DD format
+        company_code: Optional company code
+        fiscal_year: Optional fiscal year
         
     Returns:
         List of invoices in the date range
     """
-    # Query for all invoices
-    docs = retriever.invoke("invoice document financial")
+    start_day = date_to_epoch_day(start_date)
+    end_day = date_to_epoch_day(end_date)
+    return retrieval_cache.get_or_compute(
+        ('date_range', start_day, end_day, company_code, fiscal_year),
+        lambda: _find_invoices_by_date_range(start_date, end_date, start_day, end_day, company_code, fiscal_year)
+    )
+
+
+class StaleCursorError(Exception):
+    """A page cursor that no longer points into the result (the data changed between pages)"""
+
+
+def encode_cursor(invoice: Dict[str, Any]) -> str:
+    """Opaque page cursor pointing after an invoice: its (documentDay, ID) sort key"""
+    key = json.dumps(list(invoice_sort_key(invoice)))
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[int], str]:
+    """Sort key encoded by encode_cursor; ValueError if the cursor is malformed"""
+    try:
+        day, invoice_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not (day is None or isinstance(day, int)) or not isinstance(invoice_id, str):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return day, invoice_id
+
+
+def get_invoices_page(start_date: str, end_date: str, company_code: Optional[str] = None,
+                      fiscal_year: Optional[int] = None, cursor: Optional[str] = None,
+                      limit: int = DATE_RANGE_PAGE_SIZE, count_total: bool = True) -> Dict[str, Any]:
+    """
+    One page of the invoices within a date range
     
-    # Deduplicate
-    unique_invoices = deduplicate_invoices(docs)
+    Pages are read with keyset pagination on (documentDay, ID): one
+    indexed query of the invoice table, or without the table, filtered
+    vector queries from the cursor's day on, so a page costs the same at
+    any depth. Only vectors indexed without day metadata fall back to
+    slicing the cached result of get_invoices_by_date_range.
     
-    # Filter by date
-    filtered = filter_by_date_range(unique_invoices, start_date, end_date)
+    Args:
+        start_date: Start date in YYYY-MM-DD format
+        end_date: End date in YYYY-MM-DD format
+        company_code: Optional company code
+        fiscal_year: Optional fiscal year
+        cursor: next_cursor of the previous page (None for the first page)
+        limit: Invoices per page (1 to MAX_DATE_RANGE_PAGE_SIZE)
+        count_total: Count the matching invoices on the first page
+        
+    Returns:
+        {'invoices': [...], 'next_cursor': cursor of the next page or None,
+        'total_count': matching invoices (first page with count_total only)}
+        
+    Raises:
+        ValueError: Invalid limit or malformed cursor
+        StaleCursorError: The cursor's invoice is gone from a sliced result
+    """
+    if not 1 <= limit <= MAX_DATE_RANGE_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_DATE_RANGE_PAGE_SIZE}")
+    after = decode_cursor(cursor) if cursor else None
+    start_day = date_to_epoch_day(start_date)
+    end_day = date_to_epoch_day(end_date)
+    filters = {'companyCode': company_code, 'fiscalYear': fiscal_year}
+    want_total = cursor is None and count_total
     
-    return filtered
+    record_store = get_record_store()
+    if record_store.has_invoices():
+        # Cursors carry the invoice ID without the table's 'invoice_' prefix
+        table_after = (after[0], f"invoice_{after[1]}") if after else None
+        invoices = record_store.find_invoices(filters, start_day=start_day, end_day=end_day,
+                                              limit=limit + 1, after=table_after)
+        page = [table_row_to_invoice(invoice) for invoice in invoices[:limit]]
+        total = record_store.count_invoices(filters, start_day, end_day) if want_total else None
+    elif has_day_metadata():
+        invoices = list(islice(iter_invoices_by_day(start_day, end_day, after, company_code=company_code,
+                                                    fiscal_year=fiscal_year), limit + 1))
+        page = invoices[:limit]
+        total = sum(1 for _ in iter_invoices_by_day(start_day, end_day, company_code=company_code,
+                                                    fiscal_year=fiscal_year)) if want_total else None
+    else:
+        matching = get_invoices_by_date_range(start_date, end_date, company_code, fiscal_year)
+        start = 0
+        if after is not None:
+            start = next((i + 1 for i, invoice in enumerate(matching) if invoice_sort_key(invoice) == after), None)
+            if start is None:
+                raise StaleCursorError("Cursor no longer matches the result; restart from the first page")
+        invoices = matching[start:start + limit + 1]
+        page = invoices[:limit]
+        total = len(matching) if want_total else None
+    
+    result = {
+        'invoices': page,
+        'next_cursor': encode_cursor(page[-1]) if len(invoices) > limit else None
+    }
+    if total is not None:
+        result['total_count'] = total
+    return result
+
+
+def _find_invoices_by_date_range(start_date: str, end_date: str, start_day: int, end_day: int,
+                                 company_code: Optional[str], fiscal_year: Optional[int]) -> List[Dict]:
+    record_store = get_record_store()
+    if record_store.has_invoices():
+        invoices = record_store.find_invoices(
+            {'companyCode': company_code, 'fiscalYear': fiscal_year},
+            start_day=start_day,
+            end_day=end_day
+        )
+        return [table_row_to_invoice(invoice) for invoice in invoices]
+    
+    # Filtered, paged vector-store queries on the epoch-day metadata
+    if has_day_metadata():
+        return list(iter_invoices_by_day(start_day, end_day, company_code=company_code, fiscal_year=fiscal_year))
+    
+    # Vectors indexed without epoch-day metadata (e.g. by n8n) carry SAP date
+    # strings that cannot be filtered in the store, so scan and filter here
+    invoices = scan_invoices(companyCode=company_code, fiscalYear=fiscal_year)
+    return list(filter_by_date_range(invoices, start_date, end_date))
+
+
+def get_router_stats() -> Dict[str, Any]:
+    """
+    Fast-path hit rate and latency per route
+    
+    Returns:
+        Number of queries, fast-path rate, per-route count and mean latency,
+        and the token usage of the agent's search tool
+    """
+    stats = router_stats.stats()
+    stats['search_tool'] = search_stats.stats()
+    return stats
+
+
+def clear_session(session_id: str):
+    """Delete a chat session and its history"""
+    get_session_store().clear(session_id)
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    """
+    Hit rates of the query caches
+    
+    Returns:
+        Stats for the in-process query embedding and retrieval caches, the
+        on-disk embedding cache and the chat session store
+    """
+    return {
+        'query_embeddings': get_query_embeddings().cache.stats(),
+        'retrieval': retrieval_cache.stats(),
+        'embedding_store': get_embeddings().stats(),
+        'sessions': get_session_store().stats()
+    }
+
+
+def get_invoice_record(invoice_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Fetch the full invoice record from the local record store
+    
+    Args:
+        invoice_id: Composite ID, with or without the 'invoice_' prefix
+            (e.g. invoice_5100000000_MF01_2024 or 5100000000_MF01_2024)
+        
+    Returns:
+        Full invoice record as indexed, or None if unknown
+    """
+    if not invoice_id.startswith('invoice_'):
+        invoice_id = f"invoice_{invoice_id}"
+    return get_record_store().get(invoice_id)
+
+
+def warm_up(names: Optional[List[str]] = None):
+    """
+    Build components ahead of the first request
+    
+    Args:
+        names: Components to build (default: all, in dependency order)
+    """
+    for name in names or list(_components):
+        _components[name].get()
+
+
+def get_component_stats() -> Dict[str, Any]:
+    """
+    Which components are built and how long each took
+    
+    Returns:
+        Dictionary of component name -> {'built', 'build_ms'}
+    """
+    return {
+        name: {
+            'built': lazy.built,
+            'build_ms': round(lazy.build_seconds * 1000, 1) if lazy.build_seconds is not None else None
+        }
+        for name, lazy in _components.items()
+    }
+
+
+def __getattr__(name: str) -> Any:
+    # Module attributes such as sap_invoice_rag.vectorstore or .llm build their component on access
+    if name in _components:
+        return _components[name].get()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # ============================================
@@ -0,0 +1,440 @@
+"""
+Chat Session Store
+Bounded chat histories (LRU/TTL eviction) with a token-limited window that
+folds older turns into a running summary, kept in SQLite so every API
+worker sees the same sessions
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Callable, Optional, Sequence, Tuple, Type
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, messages_from_dict, messages_to_dict
+
+# Configuration
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite")  # sqlite | memory
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "sessions.db")
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "1000"))  # Least recently used beyond this are dropped
+SESSION_TTL = float(os.getenv("SESSION_TTL", "86400"))  # Seconds since last use; 0 disables expiry
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))  # Tokens of history sent to the LLM
+# Summarize overflowing history in a background thread instead of inside the chat turn
+SESSION_COMPACT_BACKGROUND = os.getenv("SESSION_COMPACT_BACKGROUND", "1") != "0"
+EVICTION_CHECK_INTERVAL = 100  # Writes between eviction passes
+
+# Summary of the folded turns plus the messages still in the window
+SessionState = Tuple[str, List[BaseMessage]]
+# The same, with each message's sequence number (increasing within a session)
+NumberedSessionState = Tuple[str, List[Tuple[int, BaseMessage]]]
+
+
+class SessionBackend:
+    """Interface implemented by every session persistence backend"""
+
+    name = "base"
+
+    def load(self, session_id: str, ttl: Optional[float]) -> SessionState:
+        """Summary and messages of a session ('', [] if unknown or expired); marks it used"""
+        raise NotImplementedError
+
+    def append(self, session_id: str, messages: Sequence[BaseMessage]):
+        """Append messages to a session, creating it if needed"""
+        raise NotImplementedError
+
+    def load_numbered(self, session_id: str) -> NumberedSessionState:
+        """Summary and sequence-numbered messages of a session, without marking it used"""
+        raise NotImplementedError
+
+    def compact(self, session_id: str, expected_summary: str, summary: str, last_seq: int) -> bool:
+        """
+        Atomically replace the summary and drop messages up to last_seq
+
+        Nothing changes unless the stored summary still equals
+        expected_summary, so of two concurrent compactions of one session
+        only the first applies.
+
+        Returns:
+            Whether the compaction was applied
+        """
+        raise NotImplementedError
+
+    def delete(self, session_id: str):
+        raise NotImplementedError
+
+    def evict(self, max_sessions: int, ttl: Optional[float]) -> int:
+        """Drop expired sessions and the least recently used beyond max_sessions"""
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """Sessions in a SQLite file, shared by all processes that open it"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = SESSION_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                summary TEXT NOT NULL DEFAULT '',
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_last_used ON sessions(last_used);
+            CREATE TABLE IF NOT EXISTS messages (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                message TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id, seq);
+        """)
+        self._conn.commit()
+
+    def load(self, session_id, ttl):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary, last_used FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return '', []
+            if ttl and row[1] < now - ttl:
+                self._delete(session_id)
+                self._conn.commit()
+                return '', []
+            rows = self._conn.execute(
+                "SELECT message FROM messages WHERE session_id = ? ORDER BY seq", (session_id,)
+            ).fetchall()
+            self._conn.execute("UPDATE sessions SET last_used = ? WHERE session_id = ?", (now, session_id))
+            self._conn.commit()
+        return row[0], messages_from_dict([json.loads(message) for (message,) in rows])
+
+    def append(self, session_id, messages):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sessions (session_id, last_used) VALUES (?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET last_used = excluded.last_used",
+                (session_id, time.time())
+            )
+            self._conn.executemany(
+                "INSERT INTO messages (session_id, message) VALUES (?, ?)",
+                ((session_id, json.dumps(message)) for message in messages_to_dict(list(messages)))
+            )
+            self._conn.commit()
+
+    def load_numbered(self, session_id):
+        with self._lock:
+            row = self._conn.execute("SELECT summary FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            rows = self._conn.execute(
+                "SELECT seq, message FROM messages WHERE session_id = ? ORDER BY seq", (session_id,)
+            ).fetchall()
+        if row is None:
+            return '', []
+        messages = messages_from_dict([json.loads(message) for _, message in rows])
+        return row[0], [(seq, message) for (seq, _), message in zip(rows, messages)]
+
+    def compact(self, session_id, expected_summary, summary, last_seq):
+        with self._lock:
+            # The conditional UPDATE takes the write lock, so the check and the
+            # delete are one transaction even across worker processes
+            updated = self._conn.execute(
+                "UPDATE sessions SET summary = ? WHERE session_id = ? AND summary = ?",
+                (summary, session_id, expected_summary)
+            ).rowcount
+            if updated:
+                self._conn.execute("DELETE FROM messages WHERE session_id = ? AND seq <= ?", (session_id, last_seq))
+            self._conn.commit()
+        return bool(updated)
+
+    def _delete(self, session_id: str):
+        self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def delete(self, session_id):
+        with self._lock:
+            self._delete(session_id)
+            self._conn.commit()
+
+    def evict(self, max_sessions, ttl):
+        with self._lock:
+            expired = []
+            if ttl:
+                expired = self._conn.execute(
+                    "SELECT session_id FROM sessions WHERE last_used < ?", (time.time() - ttl,)
+                ).fetchall()
+            excess = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] - len(expired) - max_sessions
+            if excess > 0:
+                expired += self._conn.execute(
+                    "SELECT session_id FROM sessions ORDER BY last_used LIMIT ? OFFSET ?",
+                    (excess, len(expired))
+                ).fetchall()
+            for (session_id,) in expired:
+                self._delete(session_id)
+            self._conn.commit()
+        return len(expired)
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class MemorySessionBackend(SessionBackend):
+    """Sessions in process memory (single worker, lost on restart)"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions: OrderedDict = OrderedDict()  # session_id -> [summary, [(seq, message)], last_used]
+        self._seq = 0
+
+    def load(self, session_id, ttl):
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return '', []
+            if ttl and session[2] < now - ttl:
+                del self._sessions[session_id]
+                return '', []
+            session[2] = now
+            self._sessions.move_to_end(session_id)
+            return session[0], [message for _, message in session[1]]
+
+    def append(self, session_id, messages):
+        with self._lock:
+            session = self._sessions.setdefault(session_id, ['', [], 0.0])
+            for message in messages:
+                self._seq += 1
+                session[1].append((self._seq, message))
+            session[2] = time.time()
+            self._sessions.move_to_end(session_id)
+
+    def load_numbered(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return (session[0], list(session[1])) if session is not None else ('', [])
+
+    def compact(self, session_id, expected_summary, summary, last_seq):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session[0] != expected_summary:
+                return False
+            session[0] = summary
+            session[1] = [(seq, message) for seq, message in session[1] if seq > last_seq]
+            return True
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def evict(self, max_sessions, ttl):
+        cutoff = time.time() - ttl if ttl else None
+        with self._lock:
+            expired = [session_id for session_id, session in self._sessions.items()
+                       if cutoff is not None and session[2] < cutoff]
+            for session_id in expired:
+                del self._sessions[session_id]
+            evicted = len(expired)
+            while len(self._sessions) > max_sessions:
+                self._sessions.popitem(last=False)
+                evicted += 1
+        return evicted
+
+    def count(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+BACKENDS: Dict[str, Type[SessionBackend]] = {
+    'sqlite': SQLiteSessionBackend,
+    'memory': MemorySessionBackend,
+}
+
+
+def get_session_backend(name: Optional[str] = None) -> SessionBackend:
+    """
+    New session backend by name (defaults to SESSION_BACKEND)
+
+    Args:
+        name: 'sqlite' or 'memory'
+
+    Returns:
+        SessionBackend instance
+    """
+    name = name or SESSION_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown session backend '{name}', expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name]()
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+class WindowedChatHistory(BaseChatMessageHistory):
+    """
+    Chat history of one session, read from and written to a SessionStore
+
+    messages returns the running summary (as a system message) followed by
+    the turns still inside the token window.
+    """
+
+    def __init__(self, store: 'SessionStore', session_id: str):
+        self.store = store
+        self.session_id = session_id
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        summary, messages = self.store.backend.load(self.session_id, self.store.ttl)
+        if summary:
+            return [SystemMessage(content=f"Summary of the earlier conversation: {summary}")] + messages
+        return messages
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.store.append(self.session_id, messages)
+
+    def clear(self) -> None:
+        self.store.backend.delete(self.session_id)
+
+
+class SessionStore:
+    """
+    Bounded chat session store
+
+    Sessions unused for ttl seconds expire and at most max_sessions are
+    kept (least recently used are dropped). When a session's messages
+    exceed token_budget, the oldest turns are removed until the rest fit
+    in half the budget; if a summarize function is given they are first
+    folded into the session summary, otherwise they are simply dropped.
+
+    Summarizing costs an LLM round-trip, so with background=True it runs in
+    a single worker thread after append returns; the turn that crossed the
+    budget is not delayed, and the next turn may still see the full window.
+    Compactions apply atomically (see SessionBackend.compact), so workers
+    compacting the same session concurrently never drop turns twice.
+    """
+
+    def __init__(self, backend: Optional[SessionBackend] = None,
+                 max_sessions: int = SESSION_MAX_SESSIONS, ttl: Optional[float] = SESSION_TTL,
+                 token_budget: int = HISTORY_TOKEN_BUDGET,
+                 summarize: Optional[Callable[[str, List[BaseMessage]], str]] = None,
+                 token_counter: Callable[[str], int] = estimate_tokens,
+                 background: bool = SESSION_COMPACT_BACKGROUND):
+        self.backend = backend or get_session_backend()
+        self.max_sessions = max_sessions
+        self.ttl = ttl or None
+        self.token_budget = token_budget
+        self.summarize = summarize
+        self.token_counter = token_counter
+        self.background = background
+        self.summaries = 0
+        self.conflicts = 0
+        self.evicted = 0
+        self._writes = 0
+        self._compacting = set()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> WindowedChatHistory:
+        """History object for a session (created on first write)"""
+        return WindowedChatHistory(self, session_id)
+
+    def append(self, session_id: str, messages: Sequence[BaseMessage]):
+        """Append messages, then compact the session and evict old sessions as needed"""
+        self.backend.append(session_id, messages)
+        if self.background and self.summarize is not None:
+            self._schedule_compact(session_id)
+        else:
+            self._compact(session_id)
+        with self._lock:
+            self._writes += 1
+            check = self._writes % EVICTION_CHECK_INTERVAL == 0
+        if check:
+            evicted = self.backend.evict(self.max_sessions, self.ttl)
+            with self._lock:
+                self.evicted += evicted
+
+    def _schedule_compact(self, session_id: str):
+        """Compact a session in the background thread, once at a time per session"""
+        with self._lock:
+            if session_id in self._compacting:
+                return
+            self._compacting.add(session_id)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-compact")
+            executor = self._executor
+        executor.submit(self._background_compact, session_id)
+
+    def _background_compact(self, session_id: str):
+        try:
+            self._compact(session_id)
+        except Exception as e:
+            # The session stays over budget; the next turn tries again
+            print(f"Warning: session compaction failed ({type(e).__name__}: {e})")
+        finally:
+            with self._lock:
+                self._compacting.discard(session_id)
+
+    def _compact(self, session_id: str):
+        loaded_summary, numbered = self.backend.load_numbered(session_id)
+        messages = [message for _, message in numbered]
+        tokens = [self.token_counter(str(message.content)) for message in messages]
+        total = sum(tokens)
+        if total <= self.token_budget:
+            return
+
+        # Drop whole turns from the front until the rest fits in half the budget
+        dropped = 0
+        while dropped < len(messages) and total > self.token_budget // 2:
+            total -= tokens[dropped]
+            dropped += 1
+        while dropped < len(messages) and not isinstance(messages[dropped], HumanMessage):
+            dropped += 1
+        if not dropped:
+            return
+        summary = loaded_summary
+        if self.summarize is not None:
+            summary = self.summarize(loaded_summary, messages[:dropped])
+        applied = self.backend.compact(session_id, loaded_summary, summary, numbered[dropped - 1][0])
+        with self._lock:
+            if not applied:
+                # Another worker compacted the session first; its result stands
+                self.conflicts += 1
+            elif self.summarize is not None:
+                self.summaries += 1
+
+    def clear(self, session_id: str):
+        self.backend.delete(session_id)
+
+    def flush(self):
+        """Wait for scheduled background compactions to finish"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """Session count, evictions and summaries"""
+        with self._lock:
+            return {
+                'backend': self.backend.name,
+                'sessions': self.backend.count(),
+                'max_sessions': self.max_sessions,
+                'ttl': self.ttl,
+                'token_budget': self.token_budget,
+                'summaries': self.summaries,
+                'compaction_conflicts': self.conflicts,
+                'pending_compactions': len(self._compacting),
+                'evicted': self.evicted
+            }
@@ -0,0 +1,131 @@
+"""
+Startup Benchmark
+Measures the cold import time of the RAG modules and how long a fresh API
+server process takes to answer its first requests
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import subprocess
+from typing import List, Dict, Any, Optional
+
+import requests
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+POLL_INTERVAL = 0.02  # Seconds between connection attempts
+
+
+def measure_import(module: str) -> float:
+    """
+    Import time of a module in a fresh interpreter
+
+    Args:
+        module: Module name, e.g. sap_invoice_rag
+
+    Returns:
+        Seconds spent in the import statement
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET.format(module=module)],
+        capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url: str, deadline: float, status: int = 200) -> Optional[requests.Response]:
+    """Poll url until it returns status; None if the deadline passes first"""
+    while time.perf_counter() < deadline:
+        try:
+            response = requests.get(url, timeout=5)
+            if response.status_code == status:
+                return response
+        except requests.ConnectionError:
+            pass
+        time.sleep(POLL_INTERVAL)
+    return None
+
+
+def measure_server(paths: List[str], question: Optional[str] = None, warmup: str = "background",
+                   timeout: float = 120) -> Dict[str, Any]:
+    """
+    Start api_server in a new process and time its first requests
+
+    Args:
+        paths: GET paths requested once the server is up, e.g. ['/count']
+        question: Optional question POSTed to /query after the GET paths
+        warmup: RAG_WARMUP mode of the server (background, blocking or off)
+        timeout: Seconds to wait for the server
+
+    Returns:
+        Seconds from process start to the first health check response and
+        to readiness, plus the latency and status of each request
+    """
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, RAG_WARMUP=warmup)
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api_server:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        env=env
+    )
+    try:
+        deadline = started + timeout
+        if wait_for(f"{url}/", deadline) is None:
+            raise RuntimeError(f"Server did not answer within {timeout}s")
+        results = {'first_response': time.perf_counter() - started, 'requests': []}
+
+        for path in paths:
+            request_started = time.perf_counter()
+            response = requests.get(f"{url}{path}", timeout=timeout)
+            results['requests'].append((f"GET {path}", time.perf_counter() - request_started, response.status_code))
+        if question:
+            request_started = time.perf_counter()
+            response = requests.post(f"{url}/query", json={"question": question}, timeout=timeout)
+            results['requests'].append(("POST /query", time.perf_counter() - request_started, response.status_code))
+
+        ready = wait_for(f"{url}/ready", deadline) if warmup != "off" else None
+        results['ready'] = time.perf_counter() - started if ready is not None else None
+        results['components'] = ready.json()['components'] if ready is not None else {}
+        return results
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import time and time to first request")
+    parser.add_argument("--paths", nargs="*", default=["/count"],
+                        help="GET paths requested after startup (default: /count)")
+    parser.add_argument("--question", help="Also POST this question to /query")
+    parser.add_argument("--warmup", choices=["background", "blocking", "off"], default="background",
+                        help="RAG_WARMUP mode of the benchmarked server (default: background)")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for the server")
+    args = parser.parse_args()
+
+    print("Cold import times:")
+    for module in ("sap_invoice_rag", "api_server"):
+        print(f"  {module}: {measure_import(module) * 1000:.0f} ms")
+
+    print(f"\nAPI server (RAG_WARMUP={args.warmup}):")
+    results = measure_server(args.paths, args.question, args.warmup, args.timeout)
+    print(f"  Process start to first response: {results['first_response'] * 1000:.0f} ms")
+    for label, seconds, status in results['requests']:
+        print(f"  First {label}: {seconds * 1000:.0f} ms (HTTP {status})")
+    if results['ready'] is not None:
+        print(f"  Process start to ready: {results['ready'] * 1000:.0f} ms")
+    for name, info in results['components'].items():
+        print(f"    {name}: built in {info['build_ms']} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,8 @@
 Streamlit App for SAP Invoice RAG System
 """
 
+import json
+
 import streamlit as st
 import requests
 from datetime import datetime, date
@@ -9,6 +11,61 @@ import pandas as pd
 
 # API Configuration
 API_URL = "http://localhost:8000"
+DATE_RANGE_PAGE_SIZE = 200  # Invoices loaded per "Load more"
+DATE_RANGE_FIELDS = [
+    'invoiceNumber', 'companyCode', 'fiscalYear',
+    'documentDateConverted', 'amount', 'currency',
+    'documentType'
+]
+
+
+
+def stream_answer(question: str, session_id: str):
+    """Yield (event, data) pairs from the /query/stream server-sent events"""
+    with requests.post(
+        f"{API_URL}/query/stream",
+        json={"question": question, "session_id": session_id},
+        stream=True,
+        timeout=300
+    ) as response:
+        response.raise_for_status()
+        event = "message"
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                yield event, json.loads(line[len("data:"):].strip())
+
+
+def fetch_date_range_page(start: str, end: str, cursor=None):
+    """One page of the date-range table, projected to the displayed columns"""
+    response = requests.post(
+        f"{API_URL}/invoices/date-range",
+        json={
+            "start_date": start,
+            "end_date": end,
+            "fields": DATE_RANGE_FIELDS,
+            "limit": DATE_RANGE_PAGE_SIZE,
+            "cursor": cursor
+        },
+        timeout=120
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def fetch_date_range_csv(start: str, end: str) -> str:
+    """CSV of every invoice in the date range, read from the NDJSON export stream"""
+    with requests.post(
+        f"{API_URL}/invoices/date-range",
+        json={"start_date": start, "end_date": end, "fields": DATE_RANGE_FIELDS, "format": "ndjson"},
+        stream=True,
+        timeout=600
+    ) as response:
+        response.raise_for_status()
+        rows = [json.loads(line) for line in response.iter_lines(decode_unicode=True) if line]
+    return pd.DataFrame(rows, columns=DATE_RANGE_FIELDS).to_csv(index=False)
+
 
 # Page config
 st.set_page_config(
@@ -91,8 +148,13 @@ with st.sidebar:
     # Session info
     st.subheader("🔑 Session Info")
     st.text_input("Session ID", value=st.session_state.session_id, disabled=True)
+    stream_answers = st.toggle("Stream answers", value=True)
     
     if st.button("Clear Chat History"):
+        try:
+            requests.delete(f"{API_URL}/sessions/{st.session_state.session_id}")
+        except Exception:
+            pass  # The server expires unused sessions anyway
         st.session_state.chat_history = []
         st.rerun()
     
@@ -138,7 +200,42 @@ with tab1:
         send_button = st.button("Send", type="primary", use_container_width=True)
     
     # Process query
-    if send_button and user_question:
+    if send_button and user_question and stream_answers:
+        # Show tool progress and answer tokens as the agent produces them
+        status = st.status("🤔 Thinking...")
+        placeholder = st.empty()
+        answer = ""
+        try:
+            for event, data in stream_answer(user_question, st.session_state.session_id):
+                if event == "tool_start":
+                    status.write(f"🔎 {data['tool']}: {data['input']}")
+                elif event == "tool_end":
+                    status.write(f"✅ {data['summary']}")
+                elif event == "token":
+                    answer += data["text"]
+                    placeholder.markdown(f'<div class="chat-message assistant-message"><b>Assistant:</b> {answer}▌</div>', unsafe_allow_html=True)
+                elif event == "done":
+                    answer = data["answer"]
+                elif event == "error":
+                    raise RuntimeError(data["detail"])
+            status.update(label="Done", state="complete")
+            
+            # Add to chat history
+            st.session_state.chat_history.append({
+                "role": "user",
+                "content": user_question
+            })
+            st.session_state.chat_history.append({
+                "role": "assistant",
+                "content": answer
+            })
+            
+            st.rerun()
+        except Exception as e:
+            status.update(label="Failed", state="error")
+            st.error(f"Error: {e}")
+    
+    elif send_button and user_question:
         with st.spinner("🤔 Thinking..."):
             try:
                 # Send to API
@@ -191,55 +288,71 @@ with tab2:
     if st.button("Search by Date Range", type="primary"):
         with st.spinner("Searching..."):
             try:
-                response = requests.post(
-                    f"{API_URL}/invoices/date-range",
-                    json={
-                        "start_date": start_date.strftime("%Y-%m-%d"),
-                        "end_date": end_date.strftime("%Y-%m-%d")
-                    }
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    count = data["count"]
-                    invoices = data["invoices"]
-                    
-                    # Display results
-                    st.success(f"Found {count} invoices")
-                    
-                    if count > 0:
-                        # Convert to DataFrame
-                        df = pd.DataFrame(invoices)
-                        
-                        # Select relevant columns
-                        display_cols = [
-                            'invoiceNumber', 'companyCode', 'fiscalYear',
-                            'documentDateConverted', 'amount', 'currency',
-                            'documentType'
-                        ]
-                        
-                        # Filter columns that exist
-                        available_cols = [col for col in display_cols if col in df.columns]
-                        
-                        st.dataframe(
-                            df[available_cols],
-                            use_container_width=True,
-                            height=400
-                        )
-                        
-                        # Download button
-                        csv = df.to_csv(index=False)
-                        st.download_button(
-                            label="📥 Download CSV",
-                            data=csv,
-                            file_name=f"invoices_{start_date}_{end_date}.csv",
-                            mime="text/csv"
-                        )
-                else:
-                    st.error(f"API Error: {response.status_code}")
-                    
+                start = start_date.strftime("%Y-%m-%d")
+                end = end_date.strftime("%Y-%m-%d")
+                data = fetch_date_range_page(start, end)
+                st.session_state.date_range = {
+                    "start": start,
+                    "end": end,
+                    "total": data.get("total_count", data["count"]),
+                    "invoices": data["invoices"],
+                    "next_cursor": data["next_cursor"]
+                }
             except Exception as e:
+                st.session_state.pop("date_range", None)
                 st.error(f"Error: {e}")
+    
+    results = st.session_state.get("date_range")
+    if results:
+        count = results["total"]
+        invoices = results["invoices"]
+        
+        # Display results
+        st.success(f"Found {count} invoices")
+        
+        if count > 0:
+            # Convert to DataFrame
+            df = pd.DataFrame(invoices)
+            
+            # Filter columns that exist
+            available_cols = [col for col in DATE_RANGE_FIELDS if col in df.columns]
+            
+            st.caption(f"Showing {len(invoices)} of {count}")
+            st.dataframe(
+                df[available_cols],
+                use_container_width=True,
+                height=400
+            )
+            
+            if results["next_cursor"] and st.button("Load more"):
+                with st.spinner("Loading..."):
+                    try:
+                        data = fetch_date_range_page(results["start"], results["end"], results["next_cursor"])
+                        results["invoices"].extend(data["invoices"])
+                        results["next_cursor"] = data["next_cursor"]
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Error: {e}")
+            
+            # Download button: the loaded rows are the whole range only once every page is in
+            csv = results.get("csv")
+            if csv is None and not results["next_cursor"]:
+                csv = df[available_cols].to_csv(index=False)
+            if csv is None:
+                if st.button(f"📥 Prepare CSV of all {count} invoices"):
+                    with st.spinner("Exporting..."):
+                        try:
+                            results["csv"] = fetch_date_range_csv(results["start"], results["end"])
+                            st.rerun()
+                        except Exception as e:
+                            st.error(f"Error: {e}")
+            else:
+                st.download_button(
+                    label=f"📥 Download CSV ({count} invoices)",
+                    data=csv,
+                    file_name=f"invoices_{results['start']}_{results['end']}.csv",
+                    mime="text/csv"
+                )
 
 # Footer
 st.markdown("---")
@@ -11,7 +11,8 @@ import pandas as pd
 from sap_invoice_rag import (
     query_invoices,
     get_invoice_count,
-    get_invoices_by_date_range
+    get_invoices_by_date_range,
+    clear_session
 )
 
 # Page config
@@ -86,6 +87,7 @@ with st.sidebar:
     st.text_input("Session ID", value=st.session_state.session_id, disabled=True)
     
     if st.button("Clear Chat History"):
+        clear_session(st.session_state.session_id)
         st.session_state.chat_history = []
         st.rerun()
     
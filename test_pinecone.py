@@ -1,34 +1,22 @@
-"""Quick test to check Pinecone connection and data"""
+"""Quick test to check the vector store connection and data (Pinecone unless VECTOR_BACKEND is set)"""
 import os
 from dotenv import load_dotenv
-from pinecone import Pinecone
 from langchain_openai import OpenAIEmbeddings
-from langchain_pinecone import PineconeVectorStore
+
+from vector_backends import BackendVectorStore, get_backend
 
 load_dotenv()
 
-PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-PINECONE_INDEX = "n8n-s4hana-new"
-PINECONE_NAMESPACE = "invoice-documents"
 
-print("Testing Pinecone connection...")
-print(f"Index: {PINECONE_INDEX}")
-print(f"Namespace: {PINECONE_NAMESPACE}")
+# Initialize backend
+backend = get_backend()
 
-# Initialize Pinecone
-pc = Pinecone(api_key=PINECONE_API_KEY)
+print(f"Testing {backend.name} connection...")
 
 # Get index stats
 try:
-    index = pc.Index(PINECONE_INDEX)
-    stats = index.describe_index_stats()
-    print(f"\nIndex Statistics:")
-    print(f"Total vectors: {stats.total_vector_count}")
-    print(f"Namespaces: {list(stats.namespaces.keys())}")
-    
-    for ns, info in stats.namespaces.items():
-        print(f"  '{ns}': {info.vector_count} vectors")
+    print(f"\n{backend.describe()}")
 except Exception as e:
     print(f"Error: {e}")
 
@@ -41,11 +29,9 @@ try:
         api_key=OPENAI_API_KEY
     )
     
-    vectorstore = PineconeVectorStore(
-        index_name=PINECONE_INDEX,
-        embedding=embeddings,
-        namespace=PINECONE_NAMESPACE,
-        pinecone_api_key=PINECONE_API_KEY
+    vectorstore = BackendVectorStore(
+        backend=backend,
+        embedding=embeddings
     )
     
     # Try a simple search
@@ -0,0 +1,764 @@
+"""
+Vector Store Backends
+Common interface over Pinecone, a Qdrant collection and an in-process NumPy
+index, shared by the indexer and the RAG retriever
+"""
+
+import os
+import json
+import asyncio
+import uuid
+import threading
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple, Type
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Configuration
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")  # pinecone | qdrant | local
+EMBEDDING_DIMENSIONS = 512
+
+PINECONE_API_KEY = os.getenv("PINECONE_API_KEY", "your-pinecone-api-key")
+PINECONE_INDEX = os.getenv("PINECONE_INDEX", "n8n-s4hana-new")
+PINECONE_NAMESPACE = os.getenv("PINECONE_NAMESPACE", "invoice-documents")
+PINECONE_ENVIRONMENT = os.getenv("PINECONE_ENVIRONMENT", "us-east-1")
+
+QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
+QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
+QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION", "s4hana-documents")
+
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", "local_index")
+LOCAL_INDEX_TYPE = os.getenv("LOCAL_INDEX_TYPE", "flat")  # flat | hnsw
+
+DELETE_BATCH_SIZE = 1000  # Pinecone limit for IDs per delete request
+LIST_PAGE_SIZE = 100  # Pinecone limit for IDs per list page
+FETCH_BATCH_SIZE = 100  # IDs per fetch request (Pinecone sends them in the URL)
+PINECONE_MAX_TOP_K = 1000  # Pinecone limit for top_k when metadata is included
+
+# Vector record passed to upsert: (vector_id, embedding, metadata incl. 'text')
+VectorRecord = Tuple[str, List[float], Dict[str, Any]]
+# Search hit returned by query: (vector_id, cosine similarity, metadata incl. 'text')
+VectorMatch = Tuple[str, float, Dict[str, Any]]
+
+
+def matches_filter(metadata: Dict[str, Any], filter: Optional[Dict[str, Any]]) -> bool:
+    """
+    Evaluate a Pinecone-style metadata filter against a metadata dict
+
+    Supports implicit AND across fields, plain values (equality) and the
+    $eq, $ne, $in, $nin, $gt, $gte, $lt and $lte operators.
+    """
+    if not filter:
+        return True
+    for field, condition in filter.items():
+        value = metadata.get(field)
+        if not isinstance(condition, dict):
+            condition = {'$eq': condition}
+        for op, operand in condition.items():
+            if op == '$eq' and value != operand:
+                return False
+            if op == '$ne' and value == operand:
+                return False
+            if op == '$in' and value not in operand:
+                return False
+            if op == '$nin' and value in operand:
+                return False
+            if op in ('$gt', '$gte', '$lt', '$lte'):
+                if value is None:
+                    return False
+                try:
+                    if op == '$gt' and not value > operand:
+                        return False
+                    if op == '$gte' and not value >= operand:
+                        return False
+                    if op == '$lt' and not value < operand:
+                        return False
+                    if op == '$lte' and not value <= operand:
+                        return False
+                except TypeError:
+                    return False
+    return True
+
+
+class VectorBackend:
+    """Interface implemented by every vector store backend"""
+
+    name = "base"
+    max_query_k: Optional[int] = None  # Largest k a single query may request (None: no limit)
+
+    def ensure_index(self):
+        """Create the index/collection if it does not exist"""
+
+    def upsert(self, records: List[VectorRecord]):
+        """Insert or overwrite vectors by ID"""
+        raise NotImplementedError
+
+    def delete(self, ids: List[str]):
+        """Delete vectors by ID"""
+        raise NotImplementedError
+
+    def delete_all(self):
+        """Delete every vector in the namespace/collection"""
+        raise NotImplementedError
+
+    def query(self, vector: List[float], k: int,
+              filter: Optional[Dict[str, Any]] = None) -> List[VectorMatch]:
+        """Return the k most similar vectors, best first"""
+        raise NotImplementedError
+
+    async def aquery(self, vector: List[float], k: int,
+                     filter: Optional[Dict[str, Any]] = None) -> List[VectorMatch]:
+        """Async query; backends without an async client run query in a worker thread"""
+        return await asyncio.to_thread(self.query, vector, k, filter)
+
+    def count(self) -> int:
+        """Number of vectors stored"""
+        raise NotImplementedError
+
+    def list_ids(self, batch_size: int = LIST_PAGE_SIZE) -> Iterator[List[str]]:
+        """Page through every vector ID in the namespace/collection"""
+        raise NotImplementedError
+
+    def fetch(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Metadata (incl. 'text') of the given vectors; unknown IDs are left out"""
+        raise NotImplementedError
+
+    def scan(self, batch_size: int = LIST_PAGE_SIZE) -> Iterator[List[Tuple[str, Dict[str, Any]]]]:
+        """
+        Page through every stored vector as (vector_id, metadata) batches
+
+        Only one batch is held at a time, so a full pass over the index
+        runs in memory bounded by batch_size.
+        """
+        for ids in self.list_ids(batch_size):
+            fetched = self.fetch(ids)
+            batch = [(vector_id, fetched[vector_id]) for vector_id in ids if vector_id in fetched]
+            if batch:
+                yield batch
+
+    def flush(self):
+        """Persist pending writes (no-op for remote backends)"""
+
+    def describe(self) -> str:
+        return f"{self.name} backend: {self.count()} vectors"
+
+
+class PineconeBackend(VectorBackend):
+    """Pinecone serverless index, one namespace"""
+
+    name = "pinecone"
+    max_query_k = PINECONE_MAX_TOP_K
+
+    def __init__(self, index_name: str = PINECONE_INDEX, namespace: str = PINECONE_NAMESPACE,
+                 api_key: str = PINECONE_API_KEY, environment: str = PINECONE_ENVIRONMENT,
+                 dimension: int = EMBEDDING_DIMENSIONS):
+        from pinecone import Pinecone
+
+        self.index_name = index_name
+        self.namespace = namespace
+        self.environment = environment
+        self.dimension = dimension
+        self.pc = Pinecone(api_key=api_key)
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = self.pc.Index(self.index_name)
+        return self._index
+
+    def ensure_index(self):
+        from pinecone import ServerlessSpec
+
+        existing_indexes = [idx.name for idx in self.pc.list_indexes()]
+        if self.index_name not in existing_indexes:
+            print(f"Creating index: {self.index_name}")
+            self.pc.create_index(
+                name=self.index_name,
+                dimension=self.dimension,
+                metric="cosine",
+                spec=ServerlessSpec(
+                    cloud="aws",
+                    region=self.environment
+                )
+            )
+            print("Index created successfully")
+        else:
+            print(f"Index '{self.index_name}' already exists")
+
+    def upsert(self, records: List[VectorRecord]):
+        self.index.upsert(
+            vectors=[
+                {'id': vector_id, 'values': vector, 'metadata': metadata}
+                for vector_id, vector, metadata in records
+            ],
+            namespace=self.namespace
+        )
+
+    def delete(self, ids: List[str]):
+        for start in range(0, len(ids), DELETE_BATCH_SIZE):
+            self.index.delete(ids=ids[start:start + DELETE_BATCH_SIZE], namespace=self.namespace)
+
+    def delete_all(self):
+        self.index.delete(delete_all=True, namespace=self.namespace)
+
+    def query(self, vector, k, filter=None):
+        response = self.index.query(
+            vector=vector,
+            top_k=k,
+            filter=filter,
+            include_metadata=True,
+            namespace=self.namespace
+        )
+        return [(match.id, match.score, dict(match.metadata or {})) for match in response.matches]
+
+    def count(self):
+        stats = self.index.describe_index_stats()
+        namespace = (stats.namespaces or {}).get(self.namespace)
+        return namespace.vector_count if namespace else 0
+
+    def list_ids(self, batch_size=LIST_PAGE_SIZE):
+        # Serverless indexes only; follows the pagination token internally
+        for ids in self.index.list(namespace=self.namespace, limit=min(batch_size, LIST_PAGE_SIZE)):
+            yield list(ids)
+
+    def fetch(self, ids):
+        found = {}
+        for start in range(0, len(ids), FETCH_BATCH_SIZE):
+            response = self.index.fetch(ids=ids[start:start + FETCH_BATCH_SIZE], namespace=self.namespace)
+            for vector_id, vector in response.vectors.items():
+                found[vector_id] = dict(vector.metadata or {})
+        return found
+
+    def describe(self):
+        stats = self.index.describe_index_stats()
+        lines = [f"Pinecone index '{self.index_name}'", f"Total vectors: {stats.total_vector_count}"]
+        for ns, info in (stats.namespaces or {}).items():
+            lines.append(f"  Namespace '{ns}': {info.vector_count} vectors")
+        return "\n".join(lines)
+
+
+class QdrantBackend(VectorBackend):
+    """
+    Qdrant collection (e.g. the local s4hana-documents collection served
+    from qdrant_storage by the Qdrant container)
+
+    Payloads use the LangChain layout {'page_content', 'metadata'}; the
+    n8n layout {'content', 'metadata'} is read as well. Qdrant only accepts
+    UUID or integer point IDs, so string vector IDs are mapped with uuid5
+    and kept in the payload.
+    """
+
+    name = "qdrant"
+
+    def __init__(self, url: str = QDRANT_URL, collection: str = QDRANT_COLLECTION,
+                 api_key: Optional[str] = QDRANT_API_KEY, dimension: int = EMBEDDING_DIMENSIONS):
+        try:
+            from qdrant_client import QdrantClient
+        except ImportError as e:
+            raise ImportError("The qdrant backend requires 'pip install qdrant-client'") from e
+
+        self.collection = collection
+        self.dimension = dimension
+        self.client = QdrantClient(url=url, api_key=api_key)
+        self._url = url
+        self._api_key = api_key
+        self._async_client = None
+
+    @staticmethod
+    def _point_id(vector_id: str) -> str:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, vector_id))
+
+    def _to_filter(self, filter: Optional[Dict[str, Any]]):
+        from qdrant_client import models
+
+        if not filter:
+            return None
+        must, must_not = [], []
+        for field, condition in filter.items():
+            key = f"metadata.{field}"
+            if not isinstance(condition, dict):
+                condition = {'$eq': condition}
+            bounds = {}
+            for op, operand in condition.items():
+                if op == '$eq':
+                    must.append(models.FieldCondition(key=key, match=models.MatchValue(value=operand)))
+                elif op == '$ne':
+                    must_not.append(models.FieldCondition(key=key, match=models.MatchValue(value=operand)))
+                elif op == '$in':
+                    must.append(models.FieldCondition(key=key, match=models.MatchAny(any=list(operand))))
+                elif op == '$nin':
+                    must_not.append(models.FieldCondition(key=key, match=models.MatchAny(any=list(operand))))
+                elif op in ('$gt', '$gte', '$lt', '$lte'):
+                    bounds[op[1:]] = operand
+                else:
+                    raise ValueError(f"Unsupported filter operator: {op}")
+            if bounds:
+                must.append(models.FieldCondition(key=key, range=models.Range(**bounds)))
+        return models.Filter(must=must or None, must_not=must_not or None)
+
+    @staticmethod
+    def _from_payload(point_id, payload: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        payload = dict(payload or {})
+        metadata = dict(payload.get('metadata') or {})
+        metadata['text'] = payload.get('page_content', payload.get('content', payload.get('text', '')))
+        return payload.get('vector_id', str(point_id)), metadata
+
+    def ensure_index(self):
+        from qdrant_client import models
+
+        if not self.client.collection_exists(self.collection):
+            print(f"Creating collection: {self.collection}")
+            self.client.create_collection(
+                collection_name=self.collection,
+                vectors_config=models.VectorParams(size=self.dimension, distance=models.Distance.COSINE)
+            )
+        else:
+            print(f"Collection '{self.collection}' already exists")
+
+    def upsert(self, records):
+        from qdrant_client import models
+
+        points = []
+        for vector_id, vector, metadata in records:
+            metadata = dict(metadata)
+            text = metadata.pop('text', '')
+            points.append(models.PointStruct(
+                id=self._point_id(vector_id),
+                vector=vector,
+                payload={'page_content': text, 'metadata': metadata, 'vector_id': vector_id}
+            ))
+        self.client.upsert(collection_name=self.collection, points=points)
+
+    def delete(self, ids):
+        from qdrant_client import models
+
+        for start in range(0, len(ids), DELETE_BATCH_SIZE):
+            batch = ids[start:start + DELETE_BATCH_SIZE]
+            self.client.delete(
+                collection_name=self.collection,
+                points_selector=models.PointIdsList(points=[self._point_id(i) for i in batch])
+            )
+
+    def delete_all(self):
+        self.client.delete_collection(self.collection)
+        self.ensure_index()
+
+    def query(self, vector, k, filter=None):
+        response = self.client.query_points(
+            collection_name=self.collection,
+            query=vector,
+            limit=k,
+            query_filter=self._to_filter(filter),
+            with_payload=True
+        )
+        matches = []
+        for point in response.points:
+            vector_id, metadata = self._from_payload(point.id, point.payload)
+            matches.append((vector_id, point.score, metadata))
+        return matches
+
+    async def aquery(self, vector, k, filter=None):
+        if self._async_client is None:
+            from qdrant_client import AsyncQdrantClient
+            self._async_client = AsyncQdrantClient(url=self._url, api_key=self._api_key)
+        response = await self._async_client.query_points(
+            collection_name=self.collection,
+            query=vector,
+            limit=k,
+            query_filter=self._to_filter(filter),
+            with_payload=True
+        )
+        matches = []
+        for point in response.points:
+            vector_id, metadata = self._from_payload(point.id, point.payload)
+            matches.append((vector_id, point.score, metadata))
+        return matches
+
+    def count(self):
+        return self.client.count(collection_name=self.collection, exact=True).count
+
+    def scan(self, batch_size=LIST_PAGE_SIZE):
+        # scroll returns payloads with each page, so no separate fetch is needed
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False
+            )
+            if points:
+                yield [self._from_payload(point.id, point.payload) for point in points]
+            if offset is None:
+                return
+
+    def list_ids(self, batch_size=LIST_PAGE_SIZE):
+        for batch in self.scan(batch_size):
+            yield [vector_id for vector_id, _ in batch]
+
+    def fetch(self, ids):
+        found = {}
+        for start in range(0, len(ids), FETCH_BATCH_SIZE):
+            points = self.client.retrieve(
+                collection_name=self.collection,
+                ids=[self._point_id(i) for i in ids[start:start + FETCH_BATCH_SIZE]],
+                with_payload=True,
+                with_vectors=False
+            )
+            for point in points:
+                vector_id, metadata = self._from_payload(point.id, point.payload)
+                found[vector_id] = metadata
+        return found
+
+    def describe(self):
+        return f"Qdrant collection '{self.collection}': {self.count()} vectors"
+
+
+class LocalBackend(VectorBackend):
+    """
+    In-process NumPy index persisted to a directory
+
+    Vectors are L2-normalised so cosine similarity is a dot product. 'flat'
+    does an exact scan; 'hnsw' answers unfiltered queries from an hnswlib
+    graph (optional dependency) and falls back to the exact scan when a
+    metadata filter is given. Reads reload the files when another process
+    (a later indexer run) has replaced them, unless this instance has
+    unflushed writes of its own.
+    """
+
+    name = "local"
+
+    def __init__(self, path: str = os.path.join(LOCAL_INDEX_PATH, PINECONE_NAMESPACE),
+                 index_type: str = LOCAL_INDEX_TYPE, dimension: int = EMBEDDING_DIMENSIONS):
+        if index_type not in ('flat', 'hnsw'):
+            raise ValueError(f"Unknown local index type: {index_type}")
+        if index_type == 'hnsw':
+            try:
+                import hnswlib  # noqa: F401
+            except ImportError as e:
+                raise ImportError("LOCAL_INDEX_TYPE=hnsw requires 'pip install hnswlib'") from e
+
+        self.path = path
+        self.index_type = index_type
+        self.dimension = dimension
+        self._lock = threading.RLock()
+        self._matrix = np.zeros((0, dimension), dtype=np.float32)
+        self._size = 0
+        self._ids: List[str] = []
+        self._metadata: List[Dict[str, Any]] = []
+        self._positions: Dict[str, int] = {}
+        self._hnsw = None
+        self._dirty = False
+        self._signature = None
+        self._load()
+
+    def _file_signature(self) -> Optional[Tuple[Tuple[int, int], ...]]:
+        """(mtime, size) of the vector and record files, None if not written yet"""
+        try:
+            return tuple(
+                (stat.st_mtime_ns, stat.st_size)
+                for stat in (os.stat(os.path.join(self.path, name)) for name in ("vectors.npy", "records.json"))
+            )
+        except FileNotFoundError:
+            return None
+
+    def _load(self):
+        signature = self._file_signature()
+        if signature is None:
+            return
+        matrix = np.load(os.path.join(self.path, "vectors.npy"))
+        with open(os.path.join(self.path, "records.json"), 'r', encoding='utf-8') as f:
+            records = json.load(f)
+        if matrix.shape[0] != len(records['ids']):
+            # Caught between the writer's two file replacements; the next read retries
+            return
+        self._matrix = matrix
+        self._ids = records['ids']
+        self._metadata = records['metadata']
+        self._size = len(self._ids)
+        self._positions = {vector_id: i for i, vector_id in enumerate(self._ids)}
+        self._hnsw = None
+        self._signature = signature
+
+    def _reload_if_changed(self):
+        """Pick up files rewritten by another process (caller holds the lock)"""
+        if self._dirty:
+            return
+        signature = self._file_signature()
+        if signature is not None and signature != self._signature:
+            try:
+                self._load()
+            except (OSError, ValueError) as e:
+                print(f"Warning: could not reload local index ({type(e).__name__}: {e}); keeping the loaded one")
+
+    def _grow(self, needed: int):
+        capacity = self._matrix.shape[0]
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2, 1024)
+        grown = np.zeros((new_capacity, self.dimension), dtype=np.float32)
+        grown[:self._size] = self._matrix[:self._size]
+        self._matrix = grown
+
+    def upsert(self, records):
+        if not records:
+            return
+        vectors = np.asarray([vector for _, vector, _ in records], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)
+        with self._lock:
+            self._reload_if_changed()
+            self._grow(self._size + len(records))
+            for (vector_id, _, metadata), vector in zip(records, vectors):
+                position = self._positions.get(vector_id)
+                if position is None:
+                    position = self._size
+                    self._size += 1
+                    self._positions[vector_id] = position
+                    self._ids.append(vector_id)
+                    self._metadata.append(dict(metadata))
+                else:
+                    self._metadata[position] = dict(metadata)
+                self._matrix[position] = vector
+            self._hnsw = None
+            self._dirty = True
+
+    def delete(self, ids):
+        with self._lock:
+            self._reload_if_changed()
+            for vector_id in ids:
+                position = self._positions.pop(vector_id, None)
+                if position is None:
+                    continue
+                # Move the last row into the hole to keep storage dense
+                last = self._size - 1
+                if position != last:
+                    moved_id = self._ids[last]
+                    self._matrix[position] = self._matrix[last]
+                    self._ids[position] = moved_id
+                    self._metadata[position] = self._metadata[last]
+                    self._positions[moved_id] = position
+                self._ids.pop()
+                self._metadata.pop()
+                self._size -= 1
+            self._hnsw = None
+            self._dirty = True
+
+    def delete_all(self):
+        with self._lock:
+            self._matrix = np.zeros((0, self.dimension), dtype=np.float32)
+            self._size = 0
+            self._ids, self._metadata, self._positions = [], [], {}
+            self._hnsw = None
+            self._dirty = True
+        self.flush()
+
+    def _build_hnsw(self):
+        import hnswlib
+
+        graph = hnswlib.Index(space='ip', dim=self.dimension)
+        graph.init_index(max_elements=max(self._size, 1), ef_construction=200, M=16)
+        if self._size:
+            graph.add_items(self._matrix[:self._size], np.arange(self._size))
+        graph.set_ef(64)
+        return graph
+
+    def query(self, vector, k, filter=None):
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query /= norm
+        with self._lock:
+            self._reload_if_changed()
+            if not self._size or k <= 0:
+                return []
+            if self.index_type == 'hnsw' and not filter:
+                if self._hnsw is None:
+                    self._hnsw = self._build_hnsw()
+                labels, distances = self._hnsw.knn_query(query, k=min(k, self._size))
+                positions = labels[0]
+                scores = 1.0 - distances[0]
+            else:
+                scores = self._matrix[:self._size] @ query
+                if filter:
+                    mask = np.fromiter(
+                        (matches_filter(metadata, filter) for metadata in self._metadata),
+                        dtype=bool, count=self._size
+                    )
+                    scores = np.where(mask, scores, -np.inf)
+                top = min(k, self._size)
+                positions = np.argpartition(-scores, top - 1)[:top]
+                positions = positions[np.argsort(-scores[positions])]
+                positions = positions[np.isfinite(scores[positions])]
+                scores = scores[positions]
+            return [
+                (self._ids[p], float(s), dict(self._metadata[p]))
+                for p, s in zip(positions, scores)
+            ]
+
+    def count(self):
+        with self._lock:
+            self._reload_if_changed()
+            return self._size
+
+    def list_ids(self, batch_size=LIST_PAGE_SIZE):
+        with self._lock:
+            self._reload_if_changed()
+            ids = list(self._ids[:self._size])
+        for start in range(0, len(ids), batch_size):
+            yield ids[start:start + batch_size]
+
+    def fetch(self, ids):
+        with self._lock:
+            self._reload_if_changed()
+            return {
+                vector_id: dict(self._metadata[self._positions[vector_id]])
+                for vector_id in ids if vector_id in self._positions
+            }
+
+    def flush(self):
+        """Atomically write vectors and records to disk"""
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(self.path, exist_ok=True)
+            vectors_tmp = os.path.join(self.path, "vectors.tmp.npy")
+            records_tmp = os.path.join(self.path, "records.tmp.json")
+            np.save(vectors_tmp, self._matrix[:self._size])
+            with open(records_tmp, 'w', encoding='utf-8') as f:
+                json.dump({'ids': self._ids, 'metadata': self._metadata}, f)
+            os.replace(vectors_tmp, os.path.join(self.path, "vectors.npy"))
+            os.replace(records_tmp, os.path.join(self.path, "records.json"))
+            self._dirty = False
+            self._signature = self._file_signature()
+
+    def describe(self):
+        return f"Local {self.index_type} index at '{self.path}': {self.count()} vectors"
+
+
+BACKENDS: Dict[str, Type[VectorBackend]] = {
+    'pinecone': PineconeBackend,
+    'qdrant': QdrantBackend,
+    'local': LocalBackend,
+}
+
+_instances: Dict[str, VectorBackend] = {}
+_instances_lock = threading.Lock()
+
+
+def get_backend(name: Optional[str] = None) -> VectorBackend:
+    """
+    Shared backend instance by name (defaults to VECTOR_BACKEND)
+
+    Args:
+        name: 'pinecone', 'qdrant' or 'local'
+
+    Returns:
+        VectorBackend instance, created on first use
+    """
+    name = name or VECTOR_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown vector backend '{name}', expected one of {sorted(BACKENDS)}")
+    with _instances_lock:
+        if name not in _instances:
+            _instances[name] = BACKENDS[name]()
+        return _instances[name]
+
+
+class BackendVectorStore(VectorStore):
+    """LangChain VectorStore adapter over a VectorBackend"""
+
+    def __init__(self, backend: VectorBackend, embedding: Embeddings, text_key: str = "text"):
+        self.backend = backend
+        self._embedding = embedding
+        self.text_key = text_key
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def _to_document(self, metadata: Dict[str, Any]) -> Document:
+        metadata = dict(metadata)
+        text = metadata.pop(self.text_key, '')
+        return Document(page_content=text, metadata=metadata)
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        vectors = self._embedding.embed_documents(texts)
+        self.backend.upsert([
+            (vector_id, vector, {**metadata, self.text_key: text})
+            for vector_id, vector, metadata, text in zip(ids, vectors, metadatas, texts)
+        ])
+        self.backend.flush()
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if ids:
+            self.backend.delete(ids)
+            self.backend.flush()
+        return True
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[Dict[str, Any]] = None
+                                               ) -> List[Tuple[Document, float]]:
+        return [
+            (self._to_document(metadata), score)
+            for _, score, metadata in self.backend.query(embedding, k, filter=filter)
+        ]
+
+    async def asimilarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4,
+                                                      filter: Optional[Dict[str, Any]] = None
+                                                      ) -> List[Tuple[Document, float]]:
+        return [
+            (self._to_document(metadata), score)
+            for _, score, metadata in await self.backend.aquery(embedding, k, filter=filter)
+        ]
+
+    async def asimilarity_search_with_score(self, query: str, k: int = 4,
+                                            filter: Optional[Dict[str, Any]] = None,
+                                            **kwargs: Any) -> List[Tuple[Document, float]]:
+        return await self.asimilarity_search_by_vector_with_score(
+            await self._embedding.aembed_query(query), k=k, filter=filter
+        )
+
+    async def asimilarity_search(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None,
+                                 **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in await self.asimilarity_search_with_score(query, k, filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     filter: Optional[Dict[str, Any]] = None,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(
+            self._embedding.embed_query(query), k=k, filter=filter
+        )
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[Dict[str, Any]] = None,
+                                    **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None,
+                          **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        # Every backend returns cosine similarity
+        return lambda score: score
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   backend: Optional[VectorBackend] = None, **kwargs: Any) -> "BackendVectorStore":
+        store = cls(backend or get_backend(), embedding)
+        store.add_texts(texts, metadatas, **kwargs)
+        return store